@@ -0,0 +1,91 @@
+"""
+Fused colour chain vs. calling the existing adjustment functions in sequence.
+
+Both paths run in memory on the same decoded image so only the processing
+cost is compared. The mean/max absolute difference between the two outputs is
+printed as well, see utils/color_engine.py for where they are expected to
+diverge.
+
+Usage:
+    python benchmarks/bench_color_engine.py --width 4000 --height 3000 --iterations 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.color_engine import apply_color_chain  # noqa: E402
+from utils.image_processing import apply_operation  # noqa: E402
+
+CHAINS = {
+    'full': [
+        ['brightness', {'factor': 1.1}],
+        ['contrast', {'factor': 1.15}],
+        ['saturation', {'factor': 1.2}],
+        ['hue', {'factor': 10}],
+        ['vibrance', {'factor': 1.3}],
+        ['filter', {'type': 'warm', 'intensity': 60}],
+    ],
+    'matrix_only': [
+        ['brightness', {'factor': 1.1}],
+        ['saturation', {'factor': 0.8}],
+        ['filter', {'type': 'sepia', 'intensity': 70}],
+    ],
+    'lut_only': [
+        ['brightness', {'factor': 0.9}],
+        ['contrast', {'factor': 1.3}],
+    ],
+}
+
+def make_test_image(width, height, mode):
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(height, width, 4 if mode == 'RGBA' else 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+def run_sequential(img, chain):
+    for operation, params in chain:
+        img = apply_operation(img, operation, params)
+        img.load()
+    return img
+
+def time_runs(fn, iterations):
+    timings = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--mode', choices=['RGB', 'RGBA'], default='RGB')
+    parser.add_argument('--iterations', type=int, default=3)
+    args = parser.parse_args()
+
+    img = make_test_image(args.width, args.height, args.mode)
+    print(f"{args.width}x{args.height} {args.mode}, {args.iterations} iterations")
+    for name, chain in CHAINS.items():
+        sequential, seq_result = time_runs(lambda: run_sequential(img, chain), args.iterations)
+        fused, fused_result = time_runs(lambda: apply_color_chain(img, chain), args.iterations)
+
+        a = np.asarray(seq_result.convert(args.mode), dtype=np.int16)[..., :3]
+        b = np.asarray(fused_result.convert(args.mode), dtype=np.int16)[..., :3]
+        diff = np.abs(a - b)
+
+        seq_ms = statistics.median(sequential)
+        fused_ms = statistics.median(fused)
+        print(f"  {name:<12} sequential {seq_ms:8.1f} ms  fused {fused_ms:8.1f} ms  "
+              f"speedup {seq_ms / fused_ms:5.2f}x  diff mean {diff.mean():.2f} max {diff.max()}")
+
+if __name__ == '__main__':
+    main()
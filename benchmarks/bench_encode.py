@@ -0,0 +1,98 @@
+"""
+Encode time, output size and peak memory per format and encoder profile.
+
+Encodes the same photo-like image with the previous settings (a defensive
+img.copy() and optimize=True) and with each profile in ENCODE_PROFILES
+(utils/image_processing.py).
+
+Usage:
+    python benchmarks/bench_encode.py --megapixels 3 --mode RGB --iterations 3
+"""
+import argparse
+import io
+import math
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.image_processing import ENCODE_PROFILES, encode_image  # noqa: E402
+from utils.memory import PeakMemory  # noqa: E402
+
+FORMATS = ('jpg', 'png', 'webp', 'gif')
+
+def make_test_image(megapixels, mode):
+    """Smooth gradients with edges and mild noise, like a photo"""
+    width = round(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = round(width * 3 / 4)
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    r = 128 + 100 * np.sin(x / 97.0) * np.cos(y / 151.0)
+    g = 128 + 90 * np.sin((x + y) / 233.0)
+    b = np.where(((x // 400) + (y // 400)) % 2 == 0, 60, 190).astype(np.float32)
+    pixels = np.stack([r, g, b], axis=-1) + rng.normal(0, 6, size=(height, width, 3))
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+    return img.convert(mode)
+
+def legacy_encode(img, file_format, quality=95):
+    """The settings used before encoder profiles"""
+    img_copy = img.copy()
+    with io.BytesIO() as buf:
+        if file_format == 'jpg':
+            if img_copy.mode == 'RGBA':
+                background = Image.new('RGB', img_copy.size, (255, 255, 255))
+                background.paste(img_copy, mask=img_copy.split()[3])
+                background.save(buf, format='JPEG', quality=quality, optimize=True)
+            else:
+                img_copy.convert('RGB').save(buf, format='JPEG', quality=quality, optimize=True)
+        elif file_format == 'png':
+            img_copy.save(buf, format='PNG', optimize=True)
+        elif file_format == 'webp':
+            img_copy.save(buf, format='WEBP', quality=quality)
+        else:
+            if img_copy.mode not in ['P', 'RGB', 'RGBA']:
+                img_copy = img_copy.convert('RGBA')
+            img_copy.save(buf, format='GIF')
+        return buf.getvalue()
+
+def measure(fn, iterations):
+    timings = []
+    peak = None
+    for _ in range(iterations):
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            data = fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        if memory.peak_bytes is not None:
+            peak = max(peak or 0, memory.peak_bytes)
+    return statistics.median(timings), len(data), peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--megapixels', type=float, default=3)
+    parser.add_argument('--mode', choices=['RGB', 'RGBA', 'L'], default='RGB')
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--iterations', type=int, default=3)
+    args = parser.parse_args()
+
+    img = make_test_image(args.megapixels, args.mode)
+    mb = 1024 * 1024
+    print(f"{img.width}x{img.height} {args.mode}, median of {args.iterations}")
+    for file_format in args.formats.split(','):
+        variants = [('legacy', lambda: legacy_encode(img, file_format))]
+        variants += [(profile, lambda profile=profile: encode_image(img, file_format, profile=profile))
+                     for profile in ENCODE_PROFILES]
+        print(f"  {file_format}")
+        for name, fn in variants:
+            ms, size, peak = measure(fn, args.iterations)
+            peak_text = f'{peak / mb:6.1f} MB' if peak is not None else '   n/a'
+            print(f"    {name:<12} {ms:8.1f} ms  {size / 1024:9.1f} KB  peak {peak_text}")
+
+if __name__ == '__main__':
+    main()
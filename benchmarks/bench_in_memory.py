@@ -0,0 +1,117 @@
+"""
+Per-request latency of the /process pipeline: temp-file round-trips vs. in-memory.
+
+The legacy flow mirrors what main.py used to do for every slider tick:
+download the stored image to /tmp, let the operation decode it from disk and
+write a second file, then re-read that file for the upload. The in-memory flow
+downloads bytes, decodes once, encodes into a buffer and uploads the buffer.
+A local directory stands in for the storage bucket so both flows pay the same
+"network" cost.
+
+Usage:
+    python benchmarks/bench_in_memory.py --iterations 10 --operation brightness
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.image_processing import (  # noqa: E402
+    adjust_brightness,
+    adjust_contrast,
+    adjust_saturation,
+    apply_blur,
+    apply_operation,
+    encode_image,
+)
+
+LEGACY_FUNCTIONS = {
+    'brightness': (adjust_brightness, {'factor': 1.2}),
+    'contrast': (adjust_contrast, {'factor': 1.2}),
+    'saturation': (adjust_saturation, {'factor': 1.2}),
+    'blur': (apply_blur, {'amount': 2}),
+}
+
+def make_test_jpeg(path, width=4000, height=3000):
+    """Write a 12 MP JPEG with photo-like gradients and noise"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([
+        (x * 255 // width),
+        (y * 255 // height),
+        ((x + y) * 255 // (width + height)),
+    ], axis=-1).astype(np.int16)
+    noise = rng.integers(-20, 20, size=base.shape, dtype=np.int16)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    Image.fromarray(pixels, 'RGB').save(path, format='JPEG', quality=90)
+
+def run_legacy(bucket_dir, tmp_dir, stored_name, operation):
+    """Download to /tmp, process file-to-file, re-read the output for upload"""
+    func, params = LEGACY_FUNCTIONS[operation]
+    temp_input = os.path.join(tmp_dir, f'input_{stored_name}')
+    shutil.copy(os.path.join(bucket_dir, stored_name), temp_input)
+    output_path = os.path.join(tmp_dir, f'output_{stored_name}')
+    func(temp_input, output_path, *params.values())
+    shutil.copy(output_path, os.path.join(bucket_dir, f'legacy_{stored_name}'))
+    os.remove(output_path)
+    os.remove(temp_input)
+
+def run_in_memory(bucket_dir, stored_name, operation):
+    """Download bytes, process and encode in memory, upload the buffer"""
+    _, params = LEGACY_FUNCTIONS[operation]
+    with open(os.path.join(bucket_dir, stored_name), 'rb') as f:
+        data = f.read()
+    img = apply_operation(data, operation, params)
+    output_data = encode_image(img, 'jpg')
+    with open(os.path.join(bucket_dir, f'memory_{stored_name}'), 'wb') as f:
+        f.write(output_data)
+
+def time_runs(fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--operation', choices=sorted(LEGACY_FUNCTIONS), default='brightness')
+    args = parser.parse_args()
+
+    bucket_dir = tempfile.mkdtemp(prefix='bench_bucket_')
+    tmp_dir = tempfile.mkdtemp(prefix='bench_tmp_')
+    try:
+        stored_name = 'photo_12mp.jpg'
+        make_test_jpeg(os.path.join(bucket_dir, stored_name))
+
+        # Warm up decoders and the page cache once for each flow
+        run_legacy(bucket_dir, tmp_dir, stored_name, args.operation)
+        run_in_memory(bucket_dir, stored_name, args.operation)
+
+        legacy = time_runs(lambda: run_legacy(bucket_dir, tmp_dir, stored_name, args.operation), args.iterations)
+        memory = time_runs(lambda: run_in_memory(bucket_dir, stored_name, args.operation), args.iterations)
+
+        print(f"operation: {args.operation}, 12 MP JPEG, {args.iterations} iterations")
+        for label, timings in (('temp files', legacy), ('in-memory', memory)):
+            print(f"  {label:<10}  median {statistics.median(timings):8.1f} ms  "
+                  f"min {min(timings):8.1f} ms  max {max(timings):8.1f} ms")
+        saved = statistics.median(legacy) - statistics.median(memory)
+        print(f"  per-request latency drop: {saved:.1f} ms "
+              f"({saved / statistics.median(legacy) * 100:.1f}%)")
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Slider feedback latency: a /process round trip against a streamed live preview frame.
+
+Uploads a synthetic image through the Flask test client (in-memory storage,
+no credentials needed), then for a series of slider positions times
+    process  POST /process, then fetching the returned URL (render, encode,
+             store, download, as the editor did per slider position)
+    live     POST /preview/live until its frame arrives on the open
+             /preview/live/stream (render and encode a small frame, no storage)
+and reports the median, plus the bytes the browser receives per position.
+
+Usage:
+    python benchmarks/bench_live_preview.py --size 4000x3000 --operation brightness --positions 20
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('LIFECYCLE_DIR', tempfile.mkdtemp(prefix='bench-lifecycle-'))
+os.environ.setdefault('LIVE_PREVIEW_DIR', tempfile.mkdtemp(prefix='bench-live-'))
+os.environ.setdefault('RESULT_CACHE_MAX_ENTRIES', '0')
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PARAMS = {
+    'brightness': lambda i: {'factor': 0.5 + i * 0.05},
+    'contrast': lambda i: {'factor': 0.5 + i * 0.05},
+    'saturation': lambda i: {'factor': 0.5 + i * 0.05},
+    'blur': lambda i: {'amount': 0.5 + i * 0.5},
+    'sharpen': lambda i: {'amount': 0.2 + i * 0.2},
+}
+
+def make_jpeg(width, height):
+    y, x = np.mgrid[0:height, 0:width]
+    noise = np.random.default_rng(0).integers(0, 24, (height, width, 3))
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8)).save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+def read_frames(response, frames):
+    event = None
+    for chunk in response.response:
+        for line in (chunk.decode() if isinstance(chunk, bytes) else chunk).splitlines():
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: ') and event == 'frame':
+                frames.put(json.loads(line[len('data: '):]))
+            elif line.startswith('data: ') and event == 'idle':
+                return
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', default='4000x3000')
+    parser.add_argument('--operation', default='brightness', choices=sorted(PARAMS))
+    parser.add_argument('--positions', type=int, default=20)
+    args = parser.parse_args()
+
+    import main as app_module
+    client = app_module.app.test_client()
+    width, height = (int(value) for value in args.size.split('x'))
+    response = client.post('/upload', data={'file': (io.BytesIO(make_jpeg(width, height)), 'bench.jpg')},
+                           content_type='multipart/form-data')
+    if response.status_code != 200:
+        raise RuntimeError(f'Upload failed: {response.get_json()}')
+    params = PARAMS[args.operation]
+
+    process, process_bytes = [], []
+    for i in range(args.positions):
+        start = time.perf_counter()
+        result = client.post('/process', json={'operation': args.operation, 'params': params(i)}).get_json()
+        image = client.get(result['url']).data
+        process.append((time.perf_counter() - start) * 1000)
+        process_bytes.append(len(image))
+    client.post('/reset')
+
+    stream = client.get('/preview/live/stream', buffered=False)
+    frames = queue.Queue()
+    reader = threading.Thread(target=read_frames, args=(stream, frames), daemon=True)
+    reader.start()
+    live, live_bytes = [], []
+    for i in range(args.positions):
+        start = time.perf_counter()
+        seq = client.post('/preview/live', json={'operation': args.operation, 'params': params(i)}).get_json()['seq']
+        while True:
+            frame = frames.get(timeout=60)
+            if frame['seq'] == seq:
+                break
+        live.append((time.perf_counter() - start) * 1000)
+        live_bytes.append(frame['bytes'])
+
+    print(f"{width}x{height} JPEG, {args.operation}, {args.positions} slider positions")
+    print(f"  {'process':<8} {statistics.median(process):8.1f} ms  {statistics.median(process_bytes) / 1024:8.1f} KB per position")
+    print(f"  {'live':<8} {statistics.median(live):8.1f} ms  {statistics.median(live_bytes) / 1024:8.1f} KB per position")
+    os._exit(0)
+
+if __name__ == '__main__':
+    main()
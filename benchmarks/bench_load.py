@@ -0,0 +1,165 @@
+"""
+Latency of light endpoints while heavy image operations are running.
+
+Starts the app under gunicorn once per server configuration (fake GCS, no
+credentials needed). A few clients keep posting full-resolution /process
+requests for a large image, with a new blur radius each time so no cache
+answers them. Meanwhile other clients poll light endpoints (/health, /).
+Light-request latency is reported for an idle phase and for the loaded
+phase.
+
+Configurations:
+    sync  the previous deployment: `gunicorn main:app` (one sync worker), image work inline
+    pool  gunicorn.conf.py: threaded workers, image work in the process pool (utils/executor.py)
+
+Usage:
+    python benchmarks/bench_load.py --configs sync,pool --duration 20 --heavy-clients 2 --light-clients 4
+"""
+import argparse
+import io
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = {
+    # gunicorn reads ./gunicorn.conf.py by default, so override its worker settings
+    'sync': (['-b', '{bind}', '--worker-class', 'sync', '--workers', '1', '--threads', '1',
+             'main:app'], {'EXECUTOR_WORKERS': '0'}),
+    'pool': (['-c', 'gunicorn.conf.py', '-b', '{bind}', 'main:app'], {}),
+}
+
+def make_test_jpeg(megapixels):
+    width = round(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = round(width * 3 / 4)
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    with io.BytesIO() as buf:
+        Image.fromarray(pixels).save(buf, format='JPEG', quality=90)
+        return buf.getvalue()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(config, port, log):
+    args, extra_env = CONFIGS[config]
+    env = dict(os.environ, STORAGE_EMULATOR='fake', FAKE_GCS_DIR=tempfile.mkdtemp(prefix='bench-gcs-'),
+               **extra_env)
+    cmd = [sys.executable, '-m', 'gunicorn'] + [arg.format(bind=f'127.0.0.1:{port}') for arg in args]
+    server = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=log)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/health', timeout=1).ok:
+                return server
+        except requests.RequestException:
+            time.sleep(0.5)
+    server.kill()
+    raise RuntimeError(f'{config} server did not start, see {log.name}')
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q / 100 * len(ordered))) - 1)]
+
+def light_client(base, paths, stop, latencies, errors, interval):
+    session = requests.Session()
+    while not stop.is_set():
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                session.get(base + path, timeout=120).raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+            except requests.RequestException:
+                errors.append(path)
+        time.sleep(interval)
+
+def heavy_client(base, data, stop, latencies, errors):
+    session = requests.Session()
+    session.post(f'{base}/upload', files={'file': ('bench.jpg', data, 'image/jpeg')}, timeout=120).raise_for_status()
+    while not stop.is_set():
+        payload = {'operation': 'blur', 'params': {'amount': round(random.uniform(15, 25), 3)},
+                   'full_resolution': True}
+        start = time.perf_counter()
+        try:
+            session.post(f'{base}/process', json=payload, timeout=300).raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+        except requests.RequestException:
+            errors.append('/process')
+
+def run_light(base, args, seconds, stop):
+    latencies, errors = [], []
+    threads = [threading.Thread(target=light_client, args=(base, args.light_paths, stop, latencies, errors,
+                                                           args.interval_ms / 1000))
+               for _ in range(args.light_clients)]
+    for thread in threads:
+        thread.start()
+    stop.wait(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+def summary(name, latencies, errors):
+    stats = '  '.join(f'p{q} {percentile(latencies, q):8.1f}' for q in (50, 95, 99)) if latencies else 'no samples'
+    worst = f'max {max(latencies):8.1f}' if latencies else ''
+    return f"    {name:<8} {len(latencies):5d} req  {stats}  {worst} ms  errors {len(errors)}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--configs', default='sync,pool')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of loaded measurement')
+    parser.add_argument('--idle', type=float, default=5, help='seconds of unloaded measurement')
+    parser.add_argument('--megapixels', type=float, default=12)
+    parser.add_argument('--heavy-clients', type=int, default=2)
+    parser.add_argument('--light-clients', type=int, default=4)
+    parser.add_argument('--interval-ms', type=float, default=50, help='pause between light requests per client')
+    parser.add_argument('--light-paths', type=lambda value: value.split(','), default=['/health', '/'])
+    args = parser.parse_args()
+
+    data = make_test_jpeg(args.megapixels)
+    print(f"{args.megapixels:g} MP JPEG, {args.heavy_clients} heavy clients (full-resolution blur), "
+          f"{args.light_clients} light clients on {','.join(args.light_paths)}")
+    for config in args.configs.split(','):
+        port = free_port()
+        with tempfile.NamedTemporaryFile('w', prefix=f'bench-load-{config}-', suffix='.log', delete=False) as log:
+            server = start_server(config, port, log)
+        base = f'http://127.0.0.1:{port}'
+        try:
+            idle = run_light(base, args, args.idle, threading.Event())
+
+            stop = threading.Event()
+            heavy_latencies, heavy_errors = [], []
+            heavy = [threading.Thread(target=heavy_client, args=(base, data, stop, heavy_latencies, heavy_errors))
+                     for _ in range(args.heavy_clients)]
+            for thread in heavy:
+                thread.start()
+            # Let the heavy clients upload and get going before measuring
+            time.sleep(2)
+            loaded = run_light(base, args, args.duration, stop)
+            for thread in heavy:
+                thread.join()
+        finally:
+            server.terminate()
+            server.wait(30)
+        print(f"  {config}")
+        print(summary('idle', *idle))
+        print(summary('loaded', *loaded))
+        print(summary('heavy', heavy_latencies, heavy_errors))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+"""
+Per-operation benchmark of utils/image_processing across sizes, modes and formats.
+
+Every operation the editor can request (including each apply_filter preset)
+is run on synthetic photo-like images for a matrix of sizes, colour modes and
+source formats. Each run is split into three stages measured separately:
+
+    decode   open_image + load of the encoded source
+    process  apply_operation on the decoded image
+    encode   encode_image to the format /process would store
+
+For each stage the median wall time over --iterations runs and the peak RSS
+rise (see utils/memory.py) are reported, and for the process stage the
+number of pixel conversions it made (DecodedImage views, see ImageWork in
+utils/image_processing.py). remove_background runs against a
+stub segmentation model by default (a luma threshold, so the composite and
+mask handling are measured without model inference); --rembg model uses the
+real model from REMBG_MODEL (e.g. REMBG_MODEL=u2netp for the small one). The
+mask cache is bypassed so every run segments.
+
+Results can be saved as a baseline and later runs checked against it; the
+check exits non-zero when a stage got slower or used more memory than the
+tolerance allows. Baselines are machine-specific: record one on the machine
+you compare on.
+
+Usage:
+    python benchmarks/bench_operations.py --sizes 0.3,3 --save-baseline
+    python benchmarks/bench_operations.py --sizes 0.3,3 --check
+    python benchmarks/bench_operations.py --operations blur,filter_sepia --modes RGB --formats JPEG
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import utils.image_processing as image_processing  # noqa: E402
+from utils.image_processing import (  # noqa: E402
+    FILTER_MATRICES,
+    ImageWork,
+    apply_operation,
+    encode_image,
+    get_appropriate_extension,
+    get_encode_options,
+    open_image,
+)
+from utils.mask_cache import MaskCache  # noqa: E402
+from utils.memory import PeakMemory  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+SIZES_MP = [0.3, 3, 12, 24]
+MODES = ['RGB', 'RGBA', 'L', 'P']
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+# Modes each format can store without Pillow silently converting them
+FORMAT_MODES = {
+    'JPEG': {'RGB', 'L'},
+    'PNG': {'RGB', 'RGBA', 'L', 'P'},
+    'WEBP': {'RGB', 'RGBA'},
+    'GIF': {'L', 'P'},
+}
+
+def half_size(img):
+    return {'width': max(1, img.width // 2), 'height': max(1, img.height // 2)}
+
+# (case name, operation, params or callable(img) -> params)
+OPERATION_CASES = [
+    ('remove_background', 'remove_background', {}),
+    ('remove_background_color', 'remove_background', {'color': '#ffffff'}),
+    ('enhance', 'enhance', {}),
+    ('auto_adjust', 'auto_adjust', {}),
+    ('resize_half', 'resize', half_size),
+    ('rotate_90', 'rotate', {'angle': 90}),
+    ('rotate_45', 'rotate', {'angle': 45}),
+    ('flip', 'flip', {'direction': 'horizontal'}),
+    ('brightness', 'brightness', {'factor': 1.2}),
+    ('contrast', 'contrast', {'factor': 1.2}),
+    ('saturation', 'saturation', {'factor': 1.2}),
+    ('hue', 'hue', {'factor': 20}),
+    ('vibrance', 'vibrance', {'factor': 1.3}),
+    ('compress', 'compress', {'quality': 70}),
+    ('bw', 'bw', {}),
+    ('blur', 'blur', {'amount': 5}),
+    ('sharpen', 'sharpen', {'amount': 1.5}),
+] + [
+    (f'filter_{name}', 'filter', {'type': name, 'intensity': 80})
+    for name in list(FILTER_MATRICES) + ['grayscale', 'invert', 'high_contrast']
+]
+
+STAGES = ('decode', 'process', 'encode')
+
+class StubSessionPool:
+    """Stands in for utils.model_sessions.SessionPool without loading a model"""
+
+    @contextlib.contextmanager
+    def session(self, timeout=None):
+        yield None
+
+def stub_remove(image, session=None, only_mask=False, **kwargs):
+    """Threshold luma instead of running the segmentation model"""
+    return image.convert('L').point(lambda v: 255 if v > 96 else 0)
+
+def use_stub_rembg():
+    image_processing.rembg = SimpleNamespace(remove=stub_remove)
+    image_processing.get_session_pool = lambda model_name=None: StubSessionPool()
+
+def make_test_image(megapixels, mode):
+    """Photo-like gradients with noise at a 4:3 aspect ratio"""
+    width = max(1, round(math.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = max(1, round(width * 3 / 4))
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([
+        (x * 255 // width),
+        (y * 255 // height),
+        ((x + y) * 255 // (width + height)),
+    ], axis=-1).astype(np.int16)
+    noise = rng.integers(-20, 20, size=base.shape, dtype=np.int16)
+    img = Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), 'RGB')
+    del y, x, base, noise
+    if mode == 'RGBA':
+        alpha = Image.linear_gradient('L').resize(img.size)
+        img.putalpha(alpha)
+    elif mode == 'L':
+        img = img.convert('L')
+    elif mode == 'P':
+        img = img.quantize(256)
+    return img
+
+def encode_source(img, file_format):
+    with io.BytesIO() as buf:
+        img.save(buf, format=file_format)
+        return buf.getvalue()
+
+def run_case(data, source_ext, operation, params, iterations):
+    """
+    Run one operation on one encoded source
+
+    Returns:
+        Dictionary with '<stage>_ms' medians and '<stage>_peak_bytes' maxima
+    """
+    timings = {stage: [] for stage in STAGES}
+    peaks = {stage: [] for stage in STAGES}
+    conversions = 0
+    output_ext = get_appropriate_extension(operation, f'input.{source_ext}') or source_ext
+    for _ in range(iterations):
+        with PeakMemory() as mem:
+            start = time.perf_counter()
+            img = open_image(data)
+            img.load()
+            timings['decode'].append((time.perf_counter() - start) * 1000)
+        peaks['decode'].append(mem.peak_bytes)
+
+        case_params = params(img) if callable(params) else params
+        with PeakMemory() as mem, ImageWork() as work:
+            start = time.perf_counter()
+            result = apply_operation(img, operation, case_params)
+            result.load()
+            timings['process'].append((time.perf_counter() - start) * 1000)
+        peaks['process'].append(mem.peak_bytes)
+        conversions = max(conversions, work.conversions)
+
+        with PeakMemory() as mem:
+            start = time.perf_counter()
+            encode_image(result, output_ext, **get_encode_options(operation, case_params))
+            timings['encode'].append((time.perf_counter() - start) * 1000)
+        peaks['encode'].append(mem.peak_bytes)
+        del img, result
+
+    row = {}
+    for stage in STAGES:
+        row[f'{stage}_ms'] = round(statistics.median(timings[stage]), 3)
+        known = [peak for peak in peaks[stage] if peak is not None]
+        row[f'{stage}_peak_bytes'] = max(known) if known else None
+    row['process_conversions'] = conversions
+    return row
+
+def case_key(case_name, megapixels, mode, file_format):
+    return f'{case_name}|{megapixels}MP|{mode}|{file_format}'
+
+def run_matrix(args):
+    cases = [case for case in OPERATION_CASES if not args.operations or case[0] in args.operations]
+    results = {}
+    for megapixels in args.sizes:
+        for mode in args.modes:
+            source = None
+            for file_format in args.formats:
+                if mode not in FORMAT_MODES[file_format]:
+                    continue
+                if source is None:
+                    source = make_test_image(megapixels, mode)
+                data = encode_source(source, file_format)
+                for case_name, operation, params in cases:
+                    key = case_key(case_name, megapixels, mode, file_format)
+                    try:
+                        row = run_case(data, FORMATS[file_format], operation, params, args.iterations)
+                    except Exception as e:
+                        row = {'error': f'{type(e).__name__}: {e}'}
+                    results[key] = row
+                    print_row(key, row)
+            del source
+    return results
+
+def format_bytes(value):
+    return '     n/a' if value is None else f'{value / (1024 * 1024):6.1f}MB'
+
+def print_row(key, row):
+    if 'error' in row:
+        print(f'{key:<52} ERROR {row["error"]}')
+        return
+    cells = '  '.join(f'{stage} {row[f"{stage}_ms"]:9.1f} ms {format_bytes(row[f"{stage}_peak_bytes"])}'
+                      for stage in STAGES)
+    print(f'{key:<52} {cells}  conversions {row["process_conversions"]}', flush=True)
+
+def environment():
+    import PIL
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def check_regressions(results, baseline, time_tolerance, memory_tolerance, min_ms, min_bytes):
+    """
+    Compare results to a baseline
+
+    Returns:
+        List of human-readable regression descriptions
+    """
+    regressions = []
+    for key, row in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if 'error' in row:
+            if 'error' not in base:
+                regressions.append(f'{key}: now fails ({row["error"]})')
+            continue
+        if 'error' in base:
+            continue
+        for stage in STAGES:
+            now, before = row[f'{stage}_ms'], base[f'{stage}_ms']
+            if now > before * (1 + time_tolerance) and now - before > min_ms:
+                regressions.append(f'{key}: {stage} {before:.1f} ms -> {now:.1f} ms')
+            now, before = row[f'{stage}_peak_bytes'], base.get(f'{stage}_peak_bytes')
+            if now is not None and before is not None and now > before * (1 + memory_tolerance) and now - before > min_bytes:
+                regressions.append(f'{key}: {stage} peak {format_bytes(before).strip()} -> {format_bytes(now).strip()}')
+        now, before = row['process_conversions'], base.get('process_conversions')
+        if before is not None and now > before:
+            regressions.append(f'{key}: process conversions {before} -> {now}')
+    return regressions
+
+def parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=lambda v: parse_list(v, float), default=SIZES_MP,
+                        help='comma-separated megapixel sizes (default 0.3,3,12,24)')
+    parser.add_argument('--modes', type=parse_list, default=MODES)
+    parser.add_argument('--formats', type=lambda v: [f.upper() for f in parse_list(v)], default=list(FORMATS))
+    parser.add_argument('--operations', type=parse_list, default=None,
+                        help='case names to run (default all, e.g. blur,filter_sepia)')
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--rembg', choices=['stub', 'model'], default='stub')
+    parser.add_argument('--output', help='write the full results JSON here')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--check', action='store_true', help='fail if results regress against the baseline')
+    parser.add_argument('--time-tolerance', type=float, default=0.15, help='allowed slowdown ratio (default 0.15)')
+    parser.add_argument('--memory-tolerance', type=float, default=0.15, help='allowed peak memory growth ratio')
+    parser.add_argument('--min-ms', type=float, default=2.0, help='ignore slowdowns smaller than this')
+    parser.add_argument('--min-bytes', type=int, default=4 * 1024 * 1024, help='ignore memory growth smaller than this')
+    args = parser.parse_args()
+
+    unknown = set(args.formats) - set(FORMATS) or set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f'unknown format or mode: {", ".join(sorted(unknown))}')
+    if args.operations:
+        names = {case[0] for case in OPERATION_CASES}
+        if set(args.operations) - names:
+            parser.error(f'unknown operation case, choose from: {", ".join(sorted(names))}')
+
+    if args.rembg == 'stub':
+        use_stub_rembg()
+    # Every remove_background run should segment instead of hitting the cache
+    image_processing.mask_cache = MaskCache(memory_bytes=0, disk_bytes=0)
+
+    results = run_matrix(args)
+    report = {'environment': environment(), 'rembg': args.rembg, 'iterations': args.iterations, 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        # Merge so partial runs refresh only the cells they measured
+        baseline.setdefault('results', {}).update(results)
+        baseline['environment'] = report['environment']
+        baseline['rembg'] = args.rembg
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'baseline saved to {args.baseline} ({len(baseline["results"])} cells)')
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f'no baseline at {args.baseline}; run with --save-baseline first')
+            sys.exit(2)
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('rembg') != args.rembg:
+            print(f'warning: baseline used --rembg {baseline.get("rembg")}, this run used --rembg {args.rembg}')
+        regressions = check_regressions(results, baseline['results'], args.time_tolerance,
+                                        args.memory_tolerance, args.min_ms, args.min_bytes)
+        compared = sum(1 for key in results if key in baseline['results'])
+        if regressions:
+            print(f'{len(regressions)} regression(s) in {compared} compared cells:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print(f'no regressions in {compared} compared cells')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Request-thread CPU time of a render: the original's decode, and the encode inline vs in a worker.
+
+render_and_store hands segments and the encode (with the byte budget search,
+the 'final' optimize pass and the variants) to the image executor; the
+decode of an original not yet in the RenderCache still runs on the request
+thread. This reports, per step, the wall time and the CPU time of the
+calling thread (time.thread_time), i.e. what a request thread spends while
+other requests wait for the GIL: the decode, the encode run inline, and the
+same encode through ImageExecutor.encode (sharing the pixels and reading
+the bytes back).
+
+Usage:
+    python benchmarks/bench_request_thread.py --size 4000x3000 --format jpg --runs 5
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.executor import ImageExecutor  # noqa: E402
+from utils.image_processing import open_image  # noqa: E402
+from utils.variants import encode_result  # noqa: E402
+
+def make_image(width, height):
+    # Smooth gradients with noise, so decoders and encoders do photo-like work
+    y, x = np.mgrid[0:height, 0:width]
+    noise = np.random.default_rng(0).integers(0, 24, (height, width, 3))
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+def measure(fn, runs):
+    """Median wall and calling-thread CPU milliseconds of fn"""
+    wall, cpu = [], []
+    for _ in range(runs):
+        start, start_cpu = time.perf_counter(), time.thread_time()
+        fn()
+        wall.append((time.perf_counter() - start) * 1000)
+        cpu.append((time.thread_time() - start_cpu) * 1000)
+    return statistics.median(wall), statistics.median(cpu)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', default='4000x3000')
+    parser.add_argument('--format', default='jpg')
+    parser.add_argument('--profile', default='final')
+    parser.add_argument('--target-kb', type=int, default=0, help='byte budget of the encode (0 for none)')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.split('x'))
+    img = make_image(width, height)
+    with io.BytesIO() as buf:
+        img.save(buf, format='JPEG', quality=90)
+        data = buf.getvalue()
+    options = {'target_bytes': args.target_kb * 1024} if args.target_kb else {}
+
+    def decode():
+        decoded = open_image(io.BytesIO(data))
+        decoded.load()
+
+    executor = ImageExecutor(workers=1)
+    executor.start()
+    steps = (
+        ('decode', decode),
+        ('encode inline', lambda: encode_result(img, args.format, options, args.profile)),
+        ('encode worker', lambda: executor.encode(img, args.format, options, args.profile)),
+    )
+    print(f"{width}x{height} {args.format} ({args.profile}), median of {args.runs}")
+    print(f"  {'step':<14} {'wall':>9} {'thread cpu':>12}")
+    for label, fn in steps:
+        wall, cpu = measure(fn, args.runs)
+        print(f"  {label:<14} {wall:6.1f} ms {cpu:9.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Resize engine vs. full decode + single LANCZOS resize.
+
+Decodes a JPEG from bytes and shrinks it to several target sizes, timing the
+legacy path (decode everything, one Image.LANCZOS resize) against the resize
+engine with the Pillow and OpenCV backends. PSNR against the legacy output
+is checked against the tolerance documented in utils/resize_engine.py; the
+script exits non-zero if a backend falls below it.
+
+Usage:
+    python benchmarks/bench_resize.py --megapixels 24 --targets 3000,1920,800,320 --iterations 5
+"""
+import argparse
+import io
+import math
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.resize_engine import (  # noqa: E402
+    RESIZE_MIN_PSNR,
+    RESIZE_MIN_PSNR_OPENCV,
+    RESIZE_REDUCING_GAP,
+    plan_resize,
+    resize_to,
+)
+
+def make_test_jpeg(megapixels):
+    """Photo-like JPEG: smooth gradients, some edges and mild noise"""
+    width = round(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = round(width * 3 / 4)
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    r = 128 + 100 * np.sin(x / 97.0) * np.cos(y / 151.0)
+    g = 128 + 90 * np.sin((x + y) / 233.0)
+    b = np.where(((x // 400) + (y // 400)) % 2 == 0, 60, 190).astype(np.float32)
+    pixels = np.stack([r, g, b], axis=-1) + rng.normal(0, 6, size=(height, width, 3))
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+    with io.BytesIO() as buf:
+        img.save(buf, format='JPEG', quality=90)
+        return buf.getvalue()
+
+def legacy_resize(data, out_size):
+    img = Image.open(io.BytesIO(data))
+    return img.resize(out_size, Image.LANCZOS)
+
+def engine_resize(data, width, backend):
+    img = Image.open(io.BytesIO(data))
+    out_size, box = plan_resize(img.size, width, None, 'fit')
+    return resize_to(img, out_size, box, backend=backend)
+
+def psnr(a, b):
+    diff = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    mse = np.mean(diff * diff)
+    return math.inf if mse == 0 else 10 * math.log10(255.0 ** 2 / mse)
+
+def time_runs(fn, iterations):
+    timings = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = fn()
+        result.load()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--megapixels', type=float, default=24)
+    parser.add_argument('--targets', default='3000,1920,800,320', help='comma-separated target widths')
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    data = make_test_jpeg(args.megapixels)
+    size = Image.open(io.BytesIO(data)).size
+    print(f"{size[0]}x{size[1]} JPEG ({len(data) / 1e6:.1f} MB), reducing_gap {RESIZE_REDUCING_GAP}, "
+          f"median of {args.iterations}")
+
+    failed = False
+    for width in (int(w) for w in args.targets.split(',')):
+        out_size, _ = plan_resize(size, width, None, 'fit')
+        legacy_ms, reference = time_runs(lambda: legacy_resize(data, out_size), args.iterations)
+        print(f"  -> {out_size[0]}x{out_size[1]}   legacy {legacy_ms:7.1f} ms")
+        for backend, floor in (('pillow', RESIZE_MIN_PSNR), ('opencv', RESIZE_MIN_PSNR_OPENCV)):
+            engine_ms, result = time_runs(lambda: engine_resize(data, width, backend), args.iterations)
+            quality = psnr(reference, result)
+            ok = quality >= floor
+            failed = failed or not ok
+            print(f"     {backend:<7} {engine_ms:7.1f} ms  x{legacy_ms / engine_ms:5.1f}  "
+                  f"PSNR {quality:5.1f} dB (floor {floor:.0f}) {'ok' if ok else 'BELOW TOLERANCE'}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Worker startup time: importing the app, and time until a fresh server answers.
+
+Measures, each in a fresh interpreter, the time to `import main` (fake GCS,
+no credentials needed) and which heavy modules that import pulled in. Then
+starts the app under gunicorn once per server configuration and reports,
+from launch, when /health first answers (the worker can serve) and when
+/ready first returns 200 (storage and image workers are warm).
+
+Configurations:
+    default  gunicorn.conf.py
+    preload  gunicorn.conf.py with GUNICORN_PRELOAD_APP=1 (app imported in the master)
+    rembg    gunicorn.conf.py with REMBG_PRELOAD=1 and READY_REQUIRES=storage,executor,rembg
+
+Usage:
+    python benchmarks/bench_startup.py --configs default,preload --runs 3
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('rembg', 'onnxruntime', 'stripe', 'firebase_admin', 'google.cloud.storage', 'cv2')
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'imported': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+CONFIGS = {
+    'default': {},
+    'preload': {'GUNICORN_PRELOAD_APP': '1'},
+    'rembg': {'REMBG_PRELOAD': '1', 'READY_REQUIRES': 'storage,executor,rembg'},
+}
+
+def server_env(extra_env=None):
+    return dict(os.environ, STORAGE_EMULATOR='fake', FAKE_GCS_DIR=tempfile.mkdtemp(prefix='bench-gcs-'),
+                **(extra_env or {}))
+
+def measure_import():
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=ROOT, env=server_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def measure_server(config, timeout):
+    """Seconds from launch until /health answers and until /ready returns 200"""
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}', 'main:app']
+    with tempfile.NamedTemporaryFile('w', prefix=f'bench-startup-{config}-', suffix='.log', delete=False) as log:
+        start = time.perf_counter()
+        server = subprocess.Popen(cmd, cwd=ROOT, env=server_env(CONFIGS[config]), stdout=log, stderr=log)
+    health = ready = None
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline and ready is None:
+            try:
+                if health is None and requests.get(f'{base}/health', timeout=1).ok:
+                    health = time.perf_counter() - start
+                if health is not None and requests.get(f'{base}/ready', timeout=1).status_code == 200:
+                    ready = time.perf_counter() - start
+                    continue
+            except requests.RequestException:
+                pass
+            time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait(30)
+    if health is None:
+        raise RuntimeError(f'{config} server did not start, see {log.name}')
+    return health, ready
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--configs', default='default,preload')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for /ready')
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    print(f"import main  median {statistics.median(i['seconds'] for i in imports) * 1000:8.1f} ms  "
+          f"heavy modules: {', '.join(imports[0]['imported']) or 'none'}")
+
+    for config in args.configs.split(','):
+        results = [measure_server(config, args.timeout) for _ in range(args.runs)]
+        health = statistics.median(h for h, _ in results)
+        ready_times = [r for _, r in results if r is not None]
+        ready = f'{statistics.median(ready_times):6.2f} s' if ready_times else '   never'
+        print(f"  {config:<8} /health {health:6.2f} s  /ready {ready}  "
+              f"({len(ready_times)}/{len(results)} runs ready)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Storage backend latency, offline: put, get, stream and delete per backend.
+
+Runs utils/storage.py against backends that need no credentials: the
+in-memory backend, local files, and the gcs backend on the in-process fake
+bucket (utils/fake_gcs.py), with and without background publishing. The
+memory and gcs backends add a simulated per-call round-trip. Deleting is
+timed one object at a time and with delete_many (one batch per backend).
+
+Usage:
+    python benchmarks/bench_storage.py --objects 50 --latency-ms 40 --size-kb 800
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.fake_gcs import FakeClient  # noqa: E402
+from utils.storage import GCSBackend, LocalBackend, MemoryBackend, Storage  # noqa: E402
+from utils.storage_uploader import StorageUploader  # noqa: E402
+
+def make_storage(name, public_dir, latency):
+    local = LocalBackend(public_dir, '/static/uploads/')
+    if name == 'local':
+        return Storage(local, local)
+    if name == 'memory':
+        return Storage(MemoryBackend(latency_seconds=latency), local)
+    bucket = FakeClient(latency_seconds=latency).bucket('bench')
+    uploader = StorageUploader(bucket, 'bench', public_dir, '/static/uploads/', async_publish=name == 'gcs-async')
+    return Storage(GCSBackend(uploader), local)
+
+def timed(fn, items):
+    timings = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backends', default='memory,local,gcs,gcs-async')
+    parser.add_argument('--objects', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=40, help='simulated round-trip of memory and gcs')
+    parser.add_argument('--size-kb', type=int, default=800)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_kb * 1024)
+    print(f"{args.objects} objects of {args.size_kb} KB, {args.latency_ms:g} ms simulated round-trip")
+    print(f"  {'backend':<10} {'put':>9} {'get':>9} {'stream':>9} {'delete':>9} {'batch':>9}  ms (median per object)")
+    for name in args.backends.split(','):
+        public_dir = tempfile.mkdtemp(prefix='bench-storage-')
+        try:
+            storage = make_storage(name, public_dir, args.latency_ms / 1000)
+            paths = []
+            put = timed(lambda i: paths.append(storage.put(data, f'bench-{i}.jpg')['path']), range(args.objects))
+            get = timed(storage.get, paths)
+
+            def stream(path):
+                with storage.open(path) as f:
+                    while f.read(64 * 1024):
+                        pass
+            streamed = timed(stream, paths)
+
+            # Let background publishing land before deleting
+            while storage.stats().get('pending'):
+                time.sleep(0.01)
+            half = len(paths) // 2
+            delete = timed(storage.delete, paths[:half])
+            start = time.perf_counter()
+            storage.delete_many(paths[half:])
+            batch = (time.perf_counter() - start) * 1000 / max(1, len(paths) - half)
+        finally:
+            shutil.rmtree(public_dir, ignore_errors=True)
+        medians = [statistics.median(values) if values else 0.0 for values in (put, get, streamed, delete)]
+        print(f"  {name:<10} " + ' '.join(f'{value:9.2f}' for value in medians + [batch]))
+
+if __name__ == '__main__':
+    main()
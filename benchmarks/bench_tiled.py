@@ -0,0 +1,86 @@
+"""
+Peak memory and time of tiled vs. whole-image processing on a large image.
+
+Each case runs an operation (or colour chain) on the same decoded image once
+through the regular path and once strip by strip (utils/tiling.py) the way
+render_and_store does, and reports the RSS rise above the decoded source
+plus the largest pixel difference between the two results.
+
+Usage:
+    python benchmarks/bench_tiled.py --megapixels 24 --memory-mb 64
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.color_engine import apply_color_chain  # noqa: E402
+from utils.image_processing import apply_operation  # noqa: E402
+from utils.memory import PeakMemory  # noqa: E402
+from utils.tiling import apply_tiled  # noqa: E402
+
+CASES = {
+    'vibrance': [['vibrance', {'factor': 1.4}]],
+    'hue': [['hue', {'factor': 30}]],
+    'contrast': [['contrast', {'factor': 1.3}]],
+    'filter': [['filter', {'type': 'sepia', 'intensity': 80}]],
+    'color_chain': [['contrast', {'factor': 1.2}], ['saturation', {'factor': 1.3}], ['filter', {'type': 'warm', 'intensity': 60}]],
+    'blur': [['blur', {'amount': 8}]],
+    'sharpen': [['sharpen', {'amount': 2.0}]],
+    'enhance': [['enhance', {}]],
+    'bw': [['bw', {}]],
+}
+
+def make_test_image(megapixels, mode):
+    width = round(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = round(width * 3 / 4)
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(height, width, len(mode)), dtype=np.uint8)
+    return Image.fromarray(pixels, mode)
+
+def run_untiled(img, operations):
+    if len(operations) > 1:
+        return apply_color_chain(img, operations)
+    operation, params = operations[0]
+    return apply_operation(img, operation, params)
+
+def measure(fn):
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        result = fn()
+        result.load()
+        elapsed = (time.perf_counter() - start) * 1000
+    return result, elapsed, memory.peak_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--megapixels', type=float, default=24)
+    parser.add_argument('--mode', choices=['RGB', 'RGBA'], default='RGBA')
+    parser.add_argument('--memory-mb', type=int, default=64, help='tile working memory ceiling')
+    parser.add_argument('--cases', default=','.join(CASES))
+    args = parser.parse_args()
+
+    img = make_test_image(args.megapixels, args.mode)
+    memory_bytes = args.memory_mb * 1024 * 1024
+    mb = 1024 * 1024
+    print(f"{img.width}x{img.height} {args.mode}, source {img.width * img.height * len(args.mode) / mb:.0f} MB, "
+          f"tile ceiling {args.memory_mb} MB")
+    for name in args.cases.split(','):
+        operations = CASES[name]
+        untiled, untiled_ms, untiled_peak = measure(lambda: run_untiled(img, operations))
+        tiled, tiled_ms, tiled_peak = measure(lambda: apply_tiled(img, operations, fused=False, memory_bytes=memory_bytes))
+        diff = np.abs(np.asarray(untiled, dtype=np.int16) - np.asarray(tiled, dtype=np.int16)).max()
+        del untiled, tiled
+        peaks = [f'{peak / mb:7.0f} MB' if peak is not None else '    n/a' for peak in (untiled_peak, tiled_peak)]
+        print(f"  {name:<12} whole {untiled_ms:8.0f} ms {peaks[0]}   tiled {tiled_ms:8.0f} ms {peaks[1]}   "
+              f"max diff {diff}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Request-visible upload latency: legacy two-call upload vs. single-call vs. background publish.
+
+Runs against the in-process fake bucket (utils/fake_gcs.py) with a simulated
+per-call round-trip, so it needs no credentials:
+
+- legacy:  write a temp file, upload_from_filename, then make_public (two round-trips)
+- memory:  upload_from_file on an in-memory buffer with predefined_acl (one round-trip)
+- async:   write the local copy and return; the upload finishes in the background
+
+Usage:
+    python benchmarks/bench_upload.py --iterations 20 --latency-ms 40 --size-kb 800
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.fake_gcs import FakeBucket  # noqa: E402
+from utils.storage_uploader import StorageUploader  # noqa: E402
+
+def run_legacy(bucket, tmp_dir, data, name):
+    """Temp file, upload_from_filename, then a separate make_public call"""
+    temp_path = os.path.join(tmp_dir, name)
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    blob = bucket.blob(f'uploads/{name}')
+    blob.upload_from_filename(temp_path, content_type='image/jpeg')
+    blob.make_public()
+    os.remove(temp_path)
+
+def time_runs(fn, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(f'bench_{i}.jpg')
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=40.0)
+    parser.add_argument('--size-kb', type=int, default=800)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_kb * 1024)
+    latency = args.latency_ms / 1000.0
+    tmp_dir = tempfile.mkdtemp(prefix='bench_upload_tmp_')
+    public_dir = tempfile.mkdtemp(prefix='bench_upload_public_')
+    try:
+        legacy_bucket = FakeBucket('bench', latency_seconds=latency)
+        memory_bucket = FakeBucket('bench', latency_seconds=latency)
+        async_bucket = FakeBucket('bench', latency_seconds=latency)
+        memory_uploader = StorageUploader(memory_bucket, 'bench', public_dir, '/static/uploads/', async_publish=False)
+        async_uploader = StorageUploader(async_bucket, 'bench', public_dir, '/static/uploads/', async_publish=True)
+
+        legacy = time_runs(lambda name: run_legacy(legacy_bucket, tmp_dir, data, name), args.iterations)
+        memory = time_runs(lambda name: memory_uploader.upload(data, name), args.iterations)
+        background = time_runs(lambda name: async_uploader.upload(data, name), args.iterations)
+
+        # Let background uploads drain so the public check below is meaningful
+        while async_uploader.stats()['pending']:
+            time.sleep(0.01)
+
+        print(f"{args.size_kb} KB object, {args.latency_ms:.0f} ms simulated round-trip, {args.iterations} iterations")
+        rows = (
+            ('legacy', legacy, legacy_bucket),
+            ('in-memory', memory, memory_bucket),
+            ('async', background, async_bucket),
+        )
+        for label, timings, bucket in rows:
+            public = all(bucket.is_public(f'uploads/bench_{i}.jpg') for i in range(args.iterations))
+            print(f"  {label:<10}  median {statistics.median(timings):8.1f} ms  "
+                  f"max {max(timings):8.1f} ms  calls {bucket.calls:4d}  all public: {public}")
+        print(f"  background upload latency: {async_uploader.stats()['upload']}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.rmtree(public_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Responsive variants: encode time of the full result plus its smaller sizes, and bytes per size.
+
+Decodes a synthetic photo-like image once, then encodes the full-size file
+and the OUTPUT_VARIANTS sizes one after another and with encode_variants
+(variants on the thread pool while the full size is encoded), and reports
+the bytes of each size, i.e. what the browser transfers when srcset lets it
+pick a smaller one.
+
+Usage:
+    python benchmarks/bench_variants.py --size 4000x3000 --format jpg --runs 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.image_processing import encode_image  # noqa: E402
+from utils.variants import MAX_VARIANT_RATIO, OUTPUT_VARIANTS, _resize_and_encode, encode_variants  # noqa: E402
+
+def make_image(width, height):
+    # Smooth gradients with noise, so encoders do photo-like work
+    y, x = np.mgrid[0:height, 0:width]
+    noise = np.random.default_rng(0).integers(0, 24, (height, width, 3))
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+def sequential(img, file_format, profile):
+    full = encode_image(img, file_format, profile=profile)
+    width, height = img.size
+    variants = []
+    for name, target_width in OUTPUT_VARIANTS:
+        if target_width <= width * MAX_VARIANT_RATIO:
+            size = (target_width, max(1, round(height * target_width / float(width))))
+            variants.append({'name': name, 'width': target_width,
+                             'data': _resize_and_encode(img, size, file_format, profile)})
+    return full, variants
+
+def concurrent(img, file_format, profile):
+    return encode_variants(img, file_format, lambda: encode_image(img, file_format, profile=profile), profile=profile)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', default='4000x3000')
+    parser.add_argument('--format', default='jpg')
+    parser.add_argument('--profile', default='interactive')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.split('x'))
+    img = make_image(width, height)
+    print(f"{width}x{height} {args.format}, variants {OUTPUT_VARIANTS}, {args.runs} runs")
+    for label, fn in (('full only', lambda *a: (encode_image(img, args.format, profile=args.profile), [])),
+                      ('sequential', sequential), ('concurrent', concurrent)):
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            full, variants = fn(img, args.format, args.profile)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"  {label:<11} {statistics.median(timings):8.1f} ms")
+    print(f"  {'full':<11} {width:>5}w {len(full) / 1024:9.1f} KB")
+    for variant in sorted(variants, key=lambda v: -v['width']):
+        print(f"  {variant['name']:<11} {variant['width']:>5}w {len(variant['data']) / 1024:9.1f} KB")
+
+if __name__ == '__main__':
+    main()
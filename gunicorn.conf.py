@@ -0,0 +1,51 @@
+"""
+Gunicorn settings.
+
+Threaded (gthread) workers serve requests; CPU-bound image work runs in each
+web worker's image process pool (utils/executor.py), so a request thread
+waiting on a slow operation does not hold up uploads, job polls or /health.
+Unless EXECUTOR_WORKERS is set, the cores are split evenly between the web
+workers' pools.
+
+A web worker serves as soon as the app is imported; storage, the image
+workers and (with REMBG_PRELOAD=1) rembg are warmed in a background thread
+afterwards, and /ready tells when they are (utils/readiness.py). With
+GUNICORN_PRELOAD_APP=1 the app is imported once in the master and the web
+workers share its memory copy-on-write; nothing imported by main.py starts
+threads or opens connections, so this is safe.
+
+Configuration (environment variables):
+    PORT                  listen port (default 8080)
+    WEB_CONCURRENCY       web worker processes (default 2)
+    GUNICORN_THREADS      request threads per web worker (default 8)
+    GUNICORN_TIMEOUT      worker timeout, keep above the longest operation timeout (default 300)
+    GUNICORN_PRELOAD_APP  set to 1 to import the app in the master before forking (default 0)
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+preload_app = os.environ.get('GUNICORN_PRELOAD_APP', '0') == '1'
+
+os.environ.setdefault('EXECUTOR_WORKERS', str(max(1, (os.cpu_count() or 1) // workers)))
+
+def on_starting(server):
+    # Counters restart with the server; drop the previous run's worker snapshots
+    from utils.metrics import clear_snapshots
+    clear_snapshots()
+
+def post_worker_init(worker):
+    # Fork the image workers and connect storage before the first request
+    # instead of during it, without holding up this worker's first requests
+    from utils.readiness import start_warm_up
+    start_warm_up()
+    # Share this worker's metrics with the others' /metrics
+    from utils.metrics import start_snapshots
+    start_snapshots()
+
+def worker_exit(server, worker):
+    from utils.metrics import write_snapshot
+    write_snapshot()
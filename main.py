@@ -1,33 +1,53 @@
 import os
+import io
+import json
 import logging
+import mimetypes
 import uuid
-import stripe
-import shutil
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory
+import sys
+import zipfile
+from flask import Flask, Response, g, render_template, request, jsonify, session, redirect, url_for, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import firebase_admin
-from firebase_admin import credentials, storage
-from google.cloud import storage as gcs
 from utils.image_processing import (
-    remove_background,
-    enhance_image_quality,
-    resize_image,
-    rotate_image,
-    flip_image,
-    adjust_brightness,
-    adjust_contrast,
-    adjust_saturation,
-    adjust_hue,
-    adjust_vibrance,
-    compress_image,
-    apply_black_white,
-    apply_blur,
-    apply_sharpen,
-    apply_filter,
-    auto_adjust,
-    get_appropriate_extension
+    ImageWork,
+    encode_image,
+    encode_stats,
+    image_work_stats,
+    open_image
 )
+from utils.edit_stack import (
+    operation_label,
+    push_operation,
+    render_cache,
+    render_stack,
+    stack_encode_options,
+    stack_extension
+)
+from utils.mask_cache import content_key, mask_cache
+from utils.result_cache import result_cache, result_key
+from utils.lifecycle import LifecycleManager
+from utils import history as edit_history
+from utils.preview import PREVIEW_ENABLED, make_proxy, scale_stack
+from utils.variants import encode_variants, srcset
+from utils.live_preview import LIVE_PREVIEW_ENABLED, LivePreviews, StreamLimitError
+from utils.jobs import (
+    ASYNC_HEAVY_OPERATIONS,
+    DONE as JOB_DONE,
+    JOB_MAX_WAIT_SECONDS,
+    QueueFullError,
+    is_heavy_operation,
+    job_queue
+)
+from utils.model_sessions import REMBG_PRELOAD, registry_stats, warm_up
+from utils.storage import STORAGE_BACKEND, create_storage
+from utils.memory import PeakMemory
+from utils.metrics import RequestStages, annotate, errors, stage
+from utils.metrics import render as render_metrics
+from utils.readiness import readiness, register, start_warm_up
+from utils.profiling import PROFILED_ENDPOINTS, SERVER_TIMING, RequestProfile, requested_mode, server_timing
+from utils.batch import BATCH_MAX_ITEMS, batch_runner, parse_recipe
+from utils.executor import ExecutorBusyError, OperationTimeoutError, image_executor
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, 
@@ -52,26 +72,131 @@ os.makedirs(PUBLIC_FOLDER, exist_ok=True)
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+BATCH_MAX_CONTENT_LENGTH = int(os.environ.get('BATCH_MAX_CONTENT_LENGTH', 256 * 1024 * 1024))
 
 # Configure GCS settings
 BUCKET_NAME = os.environ.get('GCS_BUCKET_NAME', 'trag-image-alchemist.firebasestorage.app')
-use_gcs = True  # Set this to False to force local storage
+STORAGE_EMULATOR = os.environ.get('STORAGE_EMULATOR', '')
 
-# Initialize Firebase Admin SDK with service account
-try:
-    cred = credentials.Certificate('firebase-config.json')
-    firebase_admin.initialize_app(cred, {
-        'storageBucket': BUCKET_NAME
-    })
-    storage_client = gcs.Client.from_service_account_json('firebase-config.json')
-    bucket = storage_client.bucket(BUCKET_NAME)
-    logger.info("Successfully initialized GCS with service account")
-except Exception as e:
-    logger.error(f"Failed to initialize GCS: {str(e)}")
-    use_gcs = False
+def connect_storage():
+    """Set up the storage backends on first use
+    
+    Firebase and the GCS client libraries are imported then rather than at
+    module load, so a worker can serve before they are ready.
+    """
+    return create_storage(STORAGE_BACKEND, BUCKET_NAME, PUBLIC_FOLDER, PUBLIC_URL_PREFIX,
+                          emulator=STORAGE_EMULATOR)
+
+def warm_rembg():
+    if not warm_up():
+        raise RuntimeError('rembg session pool failed to load')
+
+# Set up on first use or by the warm-up thread (utils/readiness.py)
+storage = register('storage', connect_storage)
+register('executor', image_executor.start, is_warm=lambda: image_executor.stats()['running'] or not image_executor.workers)
+# Background-removal model sessions are only loaded ahead of time if requested
+register('rembg', warm_rembg, warm_on_start=REMBG_PRELOAD, is_warm=lambda: bool(registry_stats()))
+
+# Tracks each session's stored versions and collects the ones no longer needed
+lifecycle = LifecycleManager(storage.get, [UPLOAD_FOLDER, PUBLIC_FOLDER],
+                             cached_paths=result_cache.paths, invalidate=result_cache.invalidate_path)
+register('lifecycle', lifecycle.start)
+
+# Low-resolution frames streamed while a slider is dragged (nothing is stored)
+live_previews = LivePreviews(lambda path: retrieve_bytes(path), image_executor.apply_segment)
+
+# /health storage names per primary backend
+STORAGE_STATUS = {'gcs': 'GCS', 'local': 'Local Storage', 'memory': 'Memory'}
+
+# Modules /ready reports as imported or not in this worker
+HEAVY_MODULES = ('rembg', 'onnxruntime', 'stripe', 'firebase_admin', 'google.cloud.storage')
+
+# Report each image request's peak memory rise (X-Peak-Memory-Bytes header).
+# The high-water mark is per process: it includes whatever other request
+# threads of the worker allocate at the same time, and each measured request
+# resets it when it starts, so under concurrency the figure is a rough hint.
+# Only the image endpoints are measured; the reset and /proc reads are not
+# worth it for health checks, metrics or static files.
+REQUEST_PEAK_MEMORY = os.environ.get('REQUEST_PEAK_MEMORY', '1') == '1'
+PEAK_MEMORY_ENDPOINTS = ('/process', '/upload', '/batch')
 
-# Configure Stripe
-stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+# Configure Stripe (the client library is imported when a checkout starts)
+STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
+
+@app.before_request
+def start_peak_memory():
+    endpoint = request.url_rule.rule if request.url_rule else None
+    if REQUEST_PEAK_MEMORY and endpoint in PEAK_MEMORY_ENDPOINTS:
+        g.peak_memory = PeakMemory(trim=False).__enter__()
+
+@app.before_request
+def start_image_work():
+    g.image_work = ImageWork().__enter__()
+
+@app.before_request
+def start_request_stages():
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_stages = RequestStages(endpoint).__enter__()
+
+@app.before_request
+def touch_session():
+    # Keeps the session's original and current image from being collected
+    if 'sid' in session:
+        lifecycle.touch(session['sid'])
+
+@app.before_request
+def start_profile():
+    """Profile /process and /upload when asked by header or picked by the sample rate"""
+    endpoint = request.url_rule.rule if request.url_rule else None
+    if endpoint in PROFILED_ENDPOINTS:
+        mode = requested_mode(request.headers)
+        if mode:
+            g.profile = RequestProfile(mode, endpoint).start()
+
+@app.after_request
+def report_peak_memory(response):
+    """Attach the request's peak RSS rise (process-wide, see REQUEST_PEAK_MEMORY)"""
+    memory = g.pop('peak_memory', None)
+    if memory is not None:
+        memory.__exit__(None, None, None)
+        if memory.peak_bytes is not None:
+            response.headers['X-Peak-Memory-Bytes'] = str(memory.peak_bytes)
+            if memory.peak_bytes >= 64 * 1024 * 1024:
+                logger.debug(f"{request.method} {request.path} raised RSS by {memory.peak_bytes / (1024 * 1024):.1f} MB")
+    return response
+
+@app.after_request
+def report_image_work(response):
+    """Attach how many images the request decoded and how many pixel conversions it made"""
+    work = g.pop('image_work', None)
+    if work is not None:
+        work.__exit__(None, None, None)
+        response.headers['X-Image-Decodes'] = str(work.decodes)
+        response.headers['X-Image-Conversions'] = str(work.conversions)
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    """Observe the request's stage timings and count error responses"""
+    stages = g.get('request_stages')
+    if stages is not None:
+        stages.__exit__(None, None, None)
+        if response.status_code >= 400:
+            errors.inc(endpoint=stages.endpoint, status=response.status_code)
+        stages.observe()
+    return response
+
+@app.after_request
+def finish_profile(response):
+    """Write the request's profile and report its stage durations in Server-Timing"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.finish()
+        response.headers['X-Profile-Id'] = profile.id
+    stages = g.get('request_stages')
+    if stages is not None and (profile is not None or (SERVER_TIMING and stages.endpoint in PROFILED_ENDPOINTS)):
+        response.headers['Server-Timing'] = server_timing(stages.stages, stages.seconds)
+    return response
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -92,170 +217,334 @@ def generate_filename(original_filename, operation=None):
         
     return f"{uuid.uuid4()}.{ext}"
 
-# Storage operation functions with fallback
-def store_file(file_obj, destination_filename=None, operation=None):
-    """Store file using GCS or local filesystem with fallback"""
+# Storage operation functions with fallback (utils/storage.py)
+def upload_bytes(data, destination_filename):
+    """Upload in-memory file contents to the storage backend, falling back to local storage
+    
+    On GCS the public-read ACL is set by the upload itself. With ASYNC_PUBLISH=1
+    the returned URL points at a local copy while the upload runs in the background.
+    """
+    with stage('upload'):
+        return storage.get().put(data, destination_filename)
+
+def store_file(file_obj, destination_filename=None, operation=None, variants=None, full_width=None):
+    """Store file using GCS or local filesystem with fallback
+    
+    Args:
+        file_obj: Uploaded file object, or the file contents as bytes
+        destination_filename: Name to store under (generated if omitted)
+        operation: Operation that produced the file, used to pick the extension
+        variants: Also store responsive variants (utils/variants.py): True to
+            decode the file for them, or an already decoded downscale of it
+            (e.g. the preview proxy) to derive them from
+        full_width: Width of the file in pixels when variants is a downscale
+    """
     if not file_obj:
         raise ValueError("No file provided")
         
+    if isinstance(file_obj, (bytes, bytearray)):
+        data = file_obj
+        original_filename = destination_filename
+    else:
+        # Upload straight from the request stream, no temp file needed
+        data = file_obj.read()
+        original_filename = file_obj.filename
+        
     # Generate unique filename if not provided
     if not destination_filename:
-        destination_filename = generate_filename(file_obj.filename, operation)
+        destination_filename = generate_filename(original_filename, operation)
+    if not variants:
+        return upload_bytes(data, destination_filename)
+    
+    # The variants are encoded while the file itself is uploaded
+    img = open_image(data) if variants is True else variants
+    ext = destination_filename.rsplit('.', 1)[1]
+    result, encoded = encode_variants(img, ext, lambda: upload_bytes(data, destination_filename))
+    return store_variants(result, encoded, destination_filename, full_width or img.width)
+
+def store_variants(result, encoded, output_filename, full_width):
+    """Store encoded variants next to a stored result
+    
+    Args:
+        result: Storage result of the full-size file; gets 'variants'
+            ({name: {'path', 'url', 'width'}}, including 'full') and 'srcset'
+        encoded: Encoded variants from encode_variants
+        output_filename: Name the full-size file was stored under
+        full_width: Width of the full-size file in pixels
         
-    # Save locally first (needed for upload)
-    local_path = os.path.join(UPLOAD_FOLDER, destination_filename)
-    file_obj.save(local_path)
+    Returns:
+        The result
+    """
+    if not encoded:
+        return result
+    stem, ext = os.path.splitext(output_filename)
+    variants = {'full': {'path': result['path'], 'url': result['url'], 'width': full_width}}
+    for variant in encoded:
+        stored = upload_bytes(variant['data'], f"{stem}_{variant['name']}{ext}")
+        variants[variant['name']] = {'path': stored['path'], 'url': stored['url'], 'width': variant['width']}
+    result['variants'] = variants
+    result['srcset'] = srcset(variants)
+    return result
+
+def make_preview(data):
+    """Downscaled editing proxy of an uploaded image
     
-    # Always upload to GCS if available
+    Returns:
+        Tuple of (proxy PIL Image, scale), or (None, 1.0) when the original is
+        small enough to edit directly or previews are disabled
+    """
+    if not PREVIEW_ENABLED:
+        return None, 1.0
     try:
-        gcs_path = f'uploads/{destination_filename}'
-        blob = bucket.blob(gcs_path)
-        blob.upload_from_filename(local_path)
-        blob.make_public()
-        url = f'https://storage.googleapis.com/{BUCKET_NAME}/{gcs_path}'
-        os.remove(local_path)
-        return {'path': gcs_path, 'url': url, 'storage': 'gcs'}
+        with stage('operation', 'preview'):
+            return make_proxy(data)
     except Exception as e:
-        logger.error(f"GCS upload failed: {str(e)}")
-        # If GCS fails, fallback to local storage
-        public_path = os.path.join(PUBLIC_FOLDER, destination_filename)
-        shutil.copy(local_path, public_path)
-        os.remove(local_path)  # Clean up temp file
-        url = f"{PUBLIC_URL_PREFIX}{destination_filename}"
-        return {'path': public_path, 'url': url, 'storage': 'local'}
-
-def retrieve_file(file_path, output_path):
-    """Retrieve file from GCS or local storage"""
-    if not file_path:
-        raise ValueError("No file path provided")
+        logger.error(f"Could not create preview proxy: {str(e)}")
+        return None, 1.0
+
+def store_preview(proxy, scale, original_path):
+    """Store the editing proxy of an uploaded image
+    
+    Args:
+        proxy: Proxy PIL Image from make_preview
+        scale: Its scale factor (proxy size / original size)
+        original_path: Storage path of the original image
         
-    if file_path.startswith('uploads/'):
-        try:
-            # This is a GCS path
-            blob = bucket.blob(file_path)
-            blob.download_to_filename(output_path)
-            return True
-        except Exception as e:
-            logger.error(f"Error retrieving from GCS: {str(e)}")
-            return False
-    else:
-        try:
-            # This is a local path
-            shutil.copy(file_path, output_path)
-            return True
-        except Exception as e:
-            logger.error(f"Error retrieving from local storage: {str(e)}")
-            return False
+    Returns:
+        Dictionary with the proxy 'path', 'url', 'scale' and 'hash'
+    """
+    ext = os.path.splitext(original_path)[1].lstrip('.').lower() or 'jpg'
+    preview_filename = f"preview_{os.path.splitext(os.path.basename(original_path))[0]}.{ext}"
+    proxy_data = encode_image(proxy, ext, profile='interactive')
+    result = upload_bytes(proxy_data, preview_filename)
+    result['scale'] = scale
+    result['hash'] = content_key(proxy_data)
+    return result
 
-def delete_file(file_path):
-    """Delete file from GCS or local storage"""
+def retrieve_bytes(file_path):
+    """Retrieve stored file contents into memory"""
     if not file_path:
-        return
-        
-    if file_path.startswith('uploads/'):
-        try:
-            # This is a GCS path
-            blob = bucket.blob(file_path)
-            blob.delete()
-        except Exception as e:
-            logger.error(f"Error deleting from GCS: {str(e)}")
-    else:
-        try:
-            # This is a local path
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            logger.error(f"Error deleting from local storage: {str(e)}")
+        raise ValueError("No file path provided")
+    with stage('download'):
+        return storage.get().get(file_path)
 
-def process_and_store(input_path, operation, params=None):
-    """Process image and store the result"""
-    if params is None:
-        params = {}
-        
-    # Determine the appropriate extension for the output file
-    appropriate_ext = get_appropriate_extension(operation, input_path)
-        
-    # Generate output filename with appropriate extension
-    output_filename = generate_filename(os.path.basename(input_path), operation)
+def render_and_store(original_path, stack, source_hash=None, profile=None, variants=False, preview=False):
+    """Render an edit stack from the original image and store the result
+    
+    Args:
+        original_path: Storage path of the original upload (or of its preview proxy)
+        stack: List of [operation, params] pairs to apply, oldest first
+        source_hash: Content hash of the original; enables the result cache
+        profile: Encoder profile ('interactive' for previews, 'final' by default)
+        variants: Also store responsive variants of the result ('variants'
+            and 'srcset', see store_variants); cached with it
+        preview: original_path is a preview proxy; a compress byte budget is
+            neither applied nor reported
+    """
+    def load_original():
+        data = retrieve_bytes(original_path)
+        if data is None:
+            raise IOError('Could not retrieve the original image')
+        return data
     
-    # If we have a specific extension requirement, ensure it's used
+    # Generate output filename with the extension the stack requires
+    output_filename = generate_filename(os.path.basename(original_path))
+    appropriate_ext = stack_extension(stack, original_path)
     if appropriate_ext:
         output_filename = f"{os.path.splitext(output_filename)[0]}.{appropriate_ext}"
-        
-    output_path = os.path.join(UPLOAD_FOLDER, output_filename)
+    output_ext = output_filename.rsplit('.', 1)[1]
+    annotate(format=output_ext)
+    
+    # Same content with the same edits was already rendered and stored
+    cache_key = result_key(source_hash, stack, output_ext) if source_hash else None
+    if cache_key:
+        cached = result_cache.get(cache_key)
+        if cached:
+            logger.debug(f"Result cache hit for stack {stack}: {cached['path']}")
+            return cached
     
-    # Process the image based on the requested operation
     try:
-        if operation == 'remove_background':
-            background_color = params.get('color', None)
-            remove_background(input_path, output_path, background_color)
-        elif operation == 'enhance':
-            enhance_image_quality(input_path, output_path)
-        elif operation == 'auto_adjust':
-            auto_adjust(input_path, output_path)
-        elif operation == 'resize':
-            width = params.get('width')
-            height = params.get('height')
-            resize_image(input_path, output_path, width, height)
-        elif operation == 'rotate':
-            angle = params.get('angle', 90)
-            rotate_image(input_path, output_path, angle)
-        elif operation == 'flip':
-            direction = params.get('direction', 'horizontal')
-            flip_image(input_path, output_path, direction)
-        elif operation == 'brightness':
-            factor = params.get('factor', 1.0)
-            adjust_brightness(input_path, output_path, factor)
-        elif operation == 'contrast':
-            factor = params.get('factor', 1.0)
-            adjust_contrast(input_path, output_path, factor)
-        elif operation == 'saturation':
-            factor = params.get('factor', 1.0)
-            adjust_saturation(input_path, output_path, factor)
-        elif operation == 'hue':
-            factor = params.get('factor', 0)
-            adjust_hue(input_path, output_path, factor)
-        elif operation == 'vibrance':
-            factor = params.get('factor', 1.0)
-            adjust_vibrance(input_path, output_path, factor)
-        elif operation == 'compress':
-            quality = params.get('quality', 85)
-            compress_image(input_path, output_path, quality)
-        elif operation == 'bw':
-            apply_black_white(input_path, output_path)
-        elif operation == 'blur':
-            amount = params.get('amount', 5)
-            apply_blur(input_path, output_path, amount)
-        elif operation == 'sharpen':
-            amount = params.get('amount', 1.5)
-            apply_sharpen(input_path, output_path, amount)
-        elif operation == 'filter':
-            filter_type = params.get('type', 'none')
-            intensity = params.get('intensity', 100)
-            apply_filter(input_path, output_path, filter_type, intensity)
-        else:
-            raise ValueError(f"Unknown operation: {operation}")
+        # Segments and the encode run in worker processes; intermediate renders stay cached here
+        img = render_stack(original_path, load_original, stack, apply=image_executor.apply_segment)
+        # Smaller display sizes are encoded alongside, from the same render
+        (output_data, compression), encoded = image_executor.encode(
+            img, output_ext, stack_encode_options(stack, preview), profile,
+            variants=None if variants else [])
     except Exception as e:
-        logger.error(f"Error processing image for operation '{operation}': {str(e)}")
+        logger.error(f"Error rendering edit stack {stack}: {str(e)}")
         raise
         
-    # Upload the processed image
-    try:
-        gcs_path = f'uploads/{output_filename}'
-        blob = bucket.blob(gcs_path)
-        blob.upload_from_filename(output_path)
-        blob.make_public()
-        url = f'https://storage.googleapis.com/{BUCKET_NAME}/{gcs_path}'
-        os.remove(output_path)  # Clean up local file
-        return {'path': gcs_path, 'url': url, 'storage': 'gcs'}
-    except Exception as e:
-        logger.error(f"Error uploading processed image: {str(e)}")
-        # If GCS fails, fallback to local storage
-        public_path = os.path.join(PUBLIC_FOLDER, output_filename)
-        shutil.copy(output_path, public_path)
-        os.remove(output_path)  # Clean up temp file
-        url = f"{PUBLIC_URL_PREFIX}{output_filename}"
-        return {'path': public_path, 'url': url, 'storage': 'local'}
+    result = upload_bytes(output_data, output_filename)
+    if compression:
+        result['compression'] = compression
+    store_variants(result, encoded, output_filename, compression['width'] if compression else img.width)
+    if cache_key:
+        result_cache.put(cache_key, result)
+    return result
+
+def is_stored_path(file_path):
+    """Whether a path names a file this app stored (on the storage backend or local public file)"""
+    return storage.get().owns(file_path)
+
+def run_batch(sources, stack, keep_output=False):
+    """Run one edit stack over many images, yielding per-item results as they finish
+    
+    Args:
+        sources: List of dicts with 'index', 'name' and either 'data' (bytes) or 'path' (stored path)
+        stack: List of [operation, params] pairs
+        keep_output: Include the encoded bytes under 'data' (for ZIP responses)
+    """
+    pending = []
+    for source in sources:
+        item = {'index': source['index'], 'name': source['name']}
+        data = source.get('data')
+        if data is None:
+            data = retrieve_bytes(source['path'])
+            if data is None:
+                yield dict(item, success=False, error='Could not retrieve stored image')
+                continue
+        
+        output_filename = generate_filename(source['name'])
+        appropriate_ext = stack_extension(stack, source['name'])
+        if appropriate_ext:
+            output_filename = f"{os.path.splitext(output_filename)[0]}.{appropriate_ext}"
+        item['output_filename'] = output_filename
+        output_ext = output_filename.rsplit('.', 1)[1]
+        
+        item['cache_key'] = result_key(content_key(data), stack, output_ext, namespace='batch')
+        cached = result_cache.get(item['cache_key'])
+        if cached:
+            result = dict(item, success=True, cached=True, url=cached['url'], path=cached['path'])
+            if keep_output:
+                result['data'] = retrieve_bytes(cached['path'])
+            yield result
+            continue
+        pending.append((item, data, output_ext))
+    
+    for item, output, error, seconds in batch_runner.run(pending, stack):
+        if error:
+            logger.error(f"Batch item {item['index']} ({item['name']}) failed: {error}")
+            yield dict(item, success=False, error=error)
+            continue
+        try:
+            stored = upload_bytes(output, item['output_filename'])
+        except Exception as e:
+            yield dict(item, success=False, error=f'Could not store result: {str(e)}')
+            continue
+        result_cache.put(item['cache_key'], stored)
+        result = dict(item, success=True, cached=False, url=stored['url'], path=stored['path'],
+                      seconds=round(seconds, 4))
+        if keep_output:
+            result['data'] = output
+        yield result
+
+def public_batch_result(result):
+    """Per-item result without internal fields"""
+    return {key: value for key, value in result.items() if key not in ('cache_key', 'output_filename', 'data')}
+
+def get_session_id():
+    """Return a stable id for the browser session, creating one if needed"""
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+def plan_session_render(stack, full_resolution=False):
+    """Pick what to render for the session's edit stack
+    
+    Args:
+        stack: List of [operation, params] pairs to apply, oldest first
+        full_resolution: Render from the original even when a proxy exists
+        
+    Returns:
+        Tuple of (source storage path, stack to render, whether it is a preview,
+        content hash of the source)
+    """
+    if not full_resolution and session.get('proxy_image'):
+        scaled = scale_stack(stack, session.get('proxy_scale', 1.0))
+        return session['proxy_image'], scaled, True, session.get('proxy_hash')
+    return session['original_image'], stack, False, session.get('original_hash')
+
+def render_job(source_path, stack, preview, source_hash=None):
+    """Render and store a planned stack; safe to run outside the request context"""
+    image_executor.take_peak_memory()
+    with RequestStages('job') as stages, PeakMemory(trim=False) as memory, ImageWork() as work:
+        annotate(operation=operation_label(stack[-1][0]) if stack else '')
+        try:
+            # Previews favour encode speed, full-resolution results small files
+            result = render_and_store(source_path, stack, source_hash, 'interactive' if preview else 'final',
+                                      variants=True, preview=preview)
+        except Exception:
+            if not stages.nested:
+                errors.inc(endpoint='job', status='failed')
+            raise
+    # Observed here only for background jobs; inline renders belong to their request
+    stages.observe()
+    result['preview'] = preview
+    result['image_work'] = dict(work.counts)
+    # Report the larger rise of this process and the worker processes that rendered
+    peaks = [peak for peak in (memory.peak_bytes, image_executor.take_peak_memory()) if peak is not None]
+    result['peak_memory_bytes'] = max(peaks) if peaks else None
+    return result
+
+def render_session_image(stack, full_resolution=False):
+    """Render the session's edit stack against the preview proxy or the original
+    
+    Args:
+        stack: List of [operation, params] pairs to apply, oldest first
+        full_resolution: Render from the original even when a proxy exists
+    """
+    return render_job(*plan_session_render(stack, full_resolution))
+
+def apply_render_result(stack, result, history='push'):
+    """Record a finished render as the session's current image
+    
+    Args:
+        stack: Edit stack that was rendered
+        result: Stored render ('path', 'url', 'preview', 'storage')
+        history: 'push' to add an undo step, 'store' to attach the render to
+            the shown step, None to leave the undo history alone
+    """
+    session['edit_stack'] = stack
+    session['current_image'] = result['path']
+    session['current_url'] = result['url']
+    session['current_is_preview'] = result['preview']
+    session['storage_type'] = result['storage']
+    sid = get_session_id()
+    lifecycle.record_current(sid, result)
+    if history:
+        with lifecycle.session_record(sid) as record:
+            if history == 'push':
+                edit_history.push(record, stack, result)
+            else:
+                edit_history.store(record, stack, result)
+
+def show_original():
+    """Make the original the session's current image
+    
+    Returns:
+        Full-resolution URL of the original
+    """
+    original_path = session['original_image']
+    url = session.get('original_url') or storage.get().url(original_path)
+    session['current_image'] = original_path
+    session['current_url'] = url
+    session['current_is_preview'] = False
+    session['edit_stack'] = []
+    lifecycle.record_current(get_session_id(), {'path': original_path})
+    return url
+
+def commit_session_image():
+    """Make sure the session's current image is a full-resolution render
+    
+    Returns:
+        URL of the full-resolution current image
+    """
+    if not session.get('current_is_preview'):
+        return session.get('current_url')
+    stack = session.get('edit_stack', [])
+    result = render_session_image(stack, full_resolution=True)
+    apply_render_result(stack, result, history='store')
+    return result['url']
 
 # Routes
 @app.route('/')
@@ -304,6 +593,8 @@ def create_checkout_session():
             return jsonify({'error': 'Invalid price ID'}), 400
             
         # Create Checkout Session
+        import stripe
+        stripe.api_key = STRIPE_SECRET_KEY
         checkout_session = stripe.checkout.Session.create(
             payment_method_types=['card'],
             line_items=[
@@ -335,18 +626,54 @@ def upload_file():
     
     if file and allowed_file(file.filename):
         try:
-            # Store the file (either GCS or local fallback)
-            result = store_file(file)
+            data = file.read()
+            # Decoded once, at proxy size when the image is large: the proxy for
+            # interactive editing is also the source of the smaller variants
+            proxy, scale = make_preview(data)
+            
+            # Store the file (either GCS or local fallback) and its variants
+            if proxy is not None:
+                result = store_file(data, generate_filename(file.filename), variants=proxy,
+                                    full_width=round(proxy.width / scale))
+            else:
+                result = store_file(data, generate_filename(file.filename), variants=True)
+            
+            preview = None
+            if proxy is not None:
+                try:
+                    preview = store_preview(proxy, scale, result['path'])
+                except Exception as e:
+                    logger.error(f"Could not store preview proxy: {str(e)}")
+            if preview and result.get('variants'):
+                # The proxy is one more size to pick from
+                result['variants']['preview'] = {'path': preview['path'], 'url': preview['url'], 'width': proxy.width}
+                result['srcset'] = srcset(result['variants'])
             
             # Store file paths in session
             session['original_image'] = result['path']
+            session['original_url'] = result['url']
+            session['original_hash'] = content_key(data)
+            session['original_srcset'] = result.get('srcset')
             session['current_image'] = result['path']
+            session['current_url'] = result['url']
+            session['current_is_preview'] = False
             session['storage_type'] = result['storage']
+            session['edit_stack'] = []
+            session['proxy_image'] = preview['path'] if preview else None
+            session['proxy_url'] = preview['url'] if preview else None
+            session['proxy_scale'] = preview['scale'] if preview else 1.0
+            session['proxy_hash'] = preview['hash'] if preview else None
+            lifecycle.record_upload(get_session_id(), result, preview)
+            with lifecycle.session_record(get_session_id()) as record:
+                edit_history.start(record, result)
             
             return jsonify({
                 'success': True,
                 'filename': os.path.basename(result['path']),
-                'url': result['url']
+                'url': preview['url'] if preview else result['url'],
+                'full_url': result['url'],
+                'srcset': result.get('srcset'),
+                'preview_scale': session['proxy_scale']
             })
             
         except Exception as e:
@@ -363,67 +690,348 @@ def process_image():
         params = data.get('params', {})
         
         logger.debug(f"Processing image. Operation: {operation}, Params: {params}")
+        annotate(operation=operation_label(operation))
         
-        if 'current_image' not in session:
+        if 'original_image' not in session:
             logger.error("No image in session to process")
             return jsonify({'error': 'No image to process'}), 400
         
-        # Download current image to temp location
-        current_path = session['current_image']
-        temp_input = os.path.join(UPLOAD_FOLDER, f'input_{os.path.basename(current_path)}')
-        
-        if not retrieve_file(current_path, temp_input):
-            return jsonify({'error': 'Could not retrieve the image'}), 500
+        # Re-render with the operation added to the edit stack (against the
+        # preview proxy when one exists)
+        stack = push_operation(session.get('edit_stack', []), operation, params)
+        # A byte budget only means something for the full-resolution file
+        full_resolution = bool(data.get('full_resolution') or (operation == 'compress' and params.get('target_bytes')))
         
-        # Process the image and store the result
-        result = process_and_store(temp_input, operation, params)
+        # Heavy operations can run as a background job the client polls for
+        if (data.get('async') or ASYNC_HEAVY_OPERATIONS) and is_heavy_operation(operation, params):
+            try:
+                job = job_queue.submit(render_job, *plan_session_render(stack, full_resolution),
+                                       label=operation, owner=get_session_id(), meta={'stack': stack})
+            except QueueFullError as e:
+                return jsonify({'error': str(e)}), 503
+            session['pending_job'] = job.id
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status_url': url_for('job_status', job_id=job.id)
+            }), 202
         
-        # Update session with new image path
-        session['current_image'] = result['path']
-        session['storage_type'] = result['storage']
+        result = render_session_image(stack, full_resolution=full_resolution)
         
-        # Clean up temp file
-        if os.path.exists(temp_input):
-            os.remove(temp_input)
+        # Update session with new image path and stack
+        apply_render_result(stack, result)
         
         return jsonify({
             'success': True,
-            'url': result['url']
+            'url': result['url'],
+            'srcset': result.get('srcset'),
+            'preview': result['preview'],
+            'preview_scale': session.get('proxy_scale', 1.0) if result['preview'] else 1.0,
+            'peak_memory_bytes': result['peak_memory_bytes'],
+            'image_work': result.get('image_work'),
+            'compression': result.get('compression')
         })
     
+    except OperationTimeoutError as e:
+        logger.error(f"Timed out processing image: {str(e)}")
+        return jsonify({'error': str(e)}), 504
+    except ExecutorBusyError as e:
+        return jsonify({'error': str(e)}), 503
+    except ValueError as e:
+        # Unknown operation or bad parameters from the client
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/batch', methods=['POST'])
+def batch_process():
+    """Apply one recipe to many images in parallel
+    
+    Accepts multipart form data (files under 'images', optional stored paths
+    under 'paths', the recipe as a JSON string under 'recipe') or a JSON body
+    with 'paths' and 'recipe'. Streams one JSON line per image as it finishes,
+    then a summary line; with zip=1 (or ?format=zip) returns a ZIP of the
+    outputs plus manifest.json instead.
+    """
+    request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+    try:
+        if request.is_json:
+            payload = request.get_json()
+            recipe = payload.get('recipe')
+            paths = payload.get('paths') or []
+            files = []
+            want_zip = bool(payload.get('zip'))
+        else:
+            recipe = json.loads(request.form.get('recipe') or 'null')
+            paths = request.form.getlist('paths')
+            files = request.files.getlist('images')
+            want_zip = request.form.get('zip') in ('1', 'true')
+        want_zip = want_zip or request.args.get('format') == 'zip'
+        stack = parse_recipe(recipe)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if not files and not paths:
+        return jsonify({'error': 'No images provided'}), 400
+    if len(files) + len(paths) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_MAX_ITEMS} images per batch'}), 400
+    
+    sources = []
+    rejected = []
+    for file in files:
+        index = len(sources) + len(rejected)
+        if not file.filename or not allowed_file(file.filename):
+            rejected.append({'index': index, 'name': file.filename, 'success': False, 'error': 'File type not allowed'})
+            continue
+        sources.append({'index': index, 'name': secure_filename(file.filename) or file.filename, 'data': file.read()})
+    for path in paths:
+        index = len(sources) + len(rejected)
+        if not is_stored_path(path) or not allowed_file(path):
+            rejected.append({'index': index, 'name': path, 'success': False, 'error': 'Not a stored image path'})
+            continue
+        sources.append({'index': index, 'name': os.path.basename(path), 'path': path})
+    
+    logger.debug(f"Batch of {len(sources) + len(rejected)} images, recipe {stack}")
+    
+    if want_zip:
+        results = list(rejected)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            for result in run_batch(sources, stack, keep_output=True):
+                if result['success'] and result.get('data') is not None:
+                    stem = os.path.splitext(result['name'])[0]
+                    ext = result['output_filename'].rsplit('.', 1)[1]
+                    # Encoded images do not compress further; store them as they are
+                    archive.writestr(f"{result['index']:04d}_{stem}.{ext}", result['data'])
+                results.append(public_batch_result(result))
+            results.sort(key=lambda result: result['index'])
+            archive.writestr('manifest.json', json.dumps({'recipe': stack, 'items': results}, indent=2))
+        buffer.seek(0)
+        return send_file(buffer, mimetype='application/zip', as_attachment=True, download_name='batch.zip')
+    
+    def generate():
+        succeeded = failed = 0
+        for result in rejected:
+            failed += 1
+            yield json.dumps(result) + '\n'
+        for result in run_batch(sources, stack):
+            if result['success']:
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(public_batch_result(result)) + '\n'
+        yield json.dumps({'done': True, 'succeeded': succeeded, 'failed': failed}) + '\n'
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # Let proxies pass lines through as they are produced
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report a background job's state; pass ?wait=N to long-poll up to N seconds"""
+    try:
+        wait = max(0.0, min(float(request.args.get('wait', 0)), JOB_MAX_WAIT_SECONDS))
+    except ValueError:
+        wait = 0.0
+    state = job_queue.status(job_id, wait)
+    if state is None or state.get('owner') != session.get('sid'):
+        return jsonify({'error': 'Job not found'}), 404
+        
+    response = {
+        'success': True,
+        'job_id': job_id,
+        'status': state['status'],
+        'queued_seconds': state['queued_seconds'],
+        'run_seconds': state['run_seconds'],
+        'error': state['error']
+    }
+    if state['status'] == JOB_DONE:
+        result = state['result']
+        # Only the latest submitted job may replace the session's image
+        if session.get('pending_job') == job_id:
+            apply_render_result(state['meta']['stack'], result)
+            session.pop('pending_job', None)
+        response['url'] = result['url']
+        response['srcset'] = result.get('srcset')
+        response['preview'] = result['preview']
+        response['preview_scale'] = session.get('proxy_scale', 1.0) if result['preview'] else 1.0
+        response['peak_memory_bytes'] = result.get('peak_memory_bytes')
+        response['image_work'] = result.get('image_work')
+        response['compression'] = result.get('compression')
+    return jsonify(response)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running background job"""
+    state = job_queue.status(job_id)
+    if state is None or state.get('owner') != session.get('sid'):
+        return jsonify({'error': 'Job not found'}), 404
+    state = job_queue.cancel(job_id)
+    if session.get('pending_job') == job_id:
+        session.pop('pending_job', None)
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': state['status'],
+        'cancel_requested': state.get('cancel_requested', False)
+    })
+
+@app.route('/preview/live', methods=['POST'])
+def live_preview_value():
+    """Post a slider value for the session's live preview stream to render"""
+    if not LIVE_PREVIEW_ENABLED:
+        return jsonify({'error': 'Live preview is disabled'}), 404
+    if 'original_image' not in session:
+        return jsonify({'error': 'No image to preview'}), 400
+    data = request.json or {}
+    operation = data.get('operation')
+    if not operation:
+        return jsonify({'error': 'No operation given'}), 400
+    
+    # The same stack /process would render, against the proxy when there is one
+    proxy = session.get('proxy_image')
+    seq = live_previews.submit(get_session_id(), {
+        'stack': push_operation(session.get('edit_stack', []), operation, data.get('params', {})),
+        'source': proxy or session['original_image'],
+        'hash': session.get('proxy_hash') if proxy else session.get('original_hash'),
+        'scale': session.get('proxy_scale', 1.0) if proxy else 1.0
+    })
+    return jsonify({'success': True, 'seq': seq}), 202
+
+@app.route('/preview/live/stream')
+def live_preview_stream():
+    """Server-Sent Events stream of live preview frames for the session's slider values"""
+    if not LIVE_PREVIEW_ENABLED:
+        return jsonify({'error': 'Live preview is disabled'}), 404
+    if 'original_image' not in session:
+        return jsonify({'error': 'No image to preview'}), 400
+    try:
+        live_previews.open()
+    except StreamLimitError as e:
+        return jsonify({'error': str(e)}), 503
+    source = session.get('proxy_image') or session['original_image']
+    response = Response(stream_with_context(live_previews.stream(get_session_id(), source)),
+                        mimetype='text/event-stream')
+    response.call_on_close(live_previews.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Let proxies pass frames through as they are produced
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/reset', methods=['POST'])
 def reset_image():
     if 'original_image' in session and 'current_image' in session:
-        original_path = session['original_image']
-        # Create URL based on storage type
-        if session.get('storage_type') == 'gcs':
-            url = f'https://storage.googleapis.com/{BUCKET_NAME}/{original_path}'
+        edited = bool(session.get('edit_stack'))
+        url = show_original()
+        # Resetting is a step of its own, so it can be undone; resetting an
+        # unedited image adds nothing to undo
+        with lifecycle.session_record(get_session_id()) as record:
+            if edited:
+                edit_history.push(record, [], {'path': session['original_image'], 'url': url})
+            history = edit_history.summary(record)
+        return jsonify({
+            'success': True,
+            'url': session.get('proxy_url') or url,
+            'full_url': url,
+            'srcset': session.get('original_srcset'),
+            'preview_scale': session.get('proxy_scale', 1.0),
+            'can_undo': history['can_undo'],
+            'can_redo': history['can_redo']
+        })
+    return jsonify({'error': 'No original image found'}), 400
+
+def step_history(offset):
+    """Undo (offset -1) or redo (offset 1) one edit of the session
+    
+    Steps whose render is still stored are shown right away; the others are
+    rendered again from their edit stack.
+    """
+    if 'original_image' not in session:
+        return jsonify({'error': 'No image to edit'}), 400
+    sid = get_session_id()
+    with lifecycle.session_record(sid) as record:
+        step = edit_history.move(record, offset)
+        step = dict(step) if step else None
+    if step is None:
+        return jsonify({'error': 'Nothing to undo' if offset < 0 else 'Nothing to redo'}), 409
+    
+    rendered = False
+    if not step['stack']:
+        url = show_original()
+        response = {'url': session.get('proxy_url') or url, 'full_url': url, 'srcset': session.get('original_srcset'),
+                    'preview': False, 'preview_scale': session.get('proxy_scale', 1.0)}
+    else:
+        if step['path'] is None:
+            result = render_session_image(step['stack'])
+            apply_render_result(step['stack'], result, history='store')
+            rendered = True
         else:
-            url = f"{PUBLIC_URL_PREFIX}{os.path.basename(original_path)}"
-            
-        session['current_image'] = original_path
+            result = step
+            apply_render_result(step['stack'], result, history=None)
+        response = {'url': result['url'], 'srcset': result.get('srcset'), 'preview': result['preview'],
+                    'preview_scale': session.get('proxy_scale', 1.0) if result['preview'] else 1.0}
+    with lifecycle.session_record(sid) as record:
+        history = edit_history.summary(record)
+    return jsonify(dict(response, success=True, rendered=rendered,
+                        can_undo=history['can_undo'], can_redo=history['can_redo']))
+
+@app.route('/undo', methods=['POST'])
+def undo_edit():
+    """Go back one edit"""
+    try:
+        return step_history(-1)
+    except Exception as e:
+        logger.error(f"Error undoing edit: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/redo', methods=['POST'])
+def redo_edit():
+    """Go forward one undone edit"""
+    try:
+        return step_history(1)
+    except Exception as e:
+        logger.error(f"Error redoing edit: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/history', methods=['GET'])
+def edit_history_status():
+    """Report the session's undo history: the steps and which ones have a stored render"""
+    if 'sid' not in session:
+        return jsonify(edit_history.summary({}))
+    with lifecycle.session_record(session['sid'], touch=False) as record:
+        return jsonify(edit_history.summary(record))
+
+@app.route('/commit', methods=['POST'])
+def commit_image():
+    """Render the current edits at full resolution"""
+    if 'original_image' not in session:
+        return jsonify({'error': 'No image to commit'}), 400
+    try:
+        url = commit_session_image()
         return jsonify({
             'success': True,
             'url': url
         })
-    return jsonify({'error': 'No original image found'}), 400
+    except Exception as e:
+        logger.error(f"Error committing image: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/download', methods=['GET'])
 def download_image():
     if 'current_image' not in session:
         return jsonify({'error': 'No image to download'}), 400
-        
-    current_path = session['current_image']
     
-    # Create URL based on storage type
-    if session.get('storage_type') == 'gcs':
-        url = f'https://storage.googleapis.com/{BUCKET_NAME}/{current_path}'
-    else:
-        url = f"{PUBLIC_URL_PREFIX}{os.path.basename(current_path)}"
+    # Previews are replaced by a full-resolution render of the same edits
+    try:
+        url = commit_session_image()
+    except Exception as e:
+        logger.error(f"Error rendering full-resolution image: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+        
+    if not url:
+        url = storage.get().url(session['current_image'])
         
     return jsonify({
         'success': True,
@@ -435,16 +1043,130 @@ def serve_upload(filename):
     """Serve files from the uploads directory"""
     return send_from_directory(PUBLIC_FOLDER, filename)
 
+@app.route('/storage/<path:object_path>')
+def serve_stored_object(object_path):
+    """Serve objects of the in-memory storage backend (STORAGE_BACKEND=memory)"""
+    backend = storage.get().backend_for(object_path)
+    if backend is None or backend.name != 'memory':
+        return jsonify({'error': 'Not found'}), 404
+    data = retrieve_bytes(object_path)
+    if data is None:
+        return jsonify({'error': 'Not found'}), 404
+    return send_file(io.BytesIO(data), mimetype=mimetypes.guess_type(object_path)[0] or 'application/octet-stream')
+
 @app.route('/health')
 def health_check():
-    storage_status = "GCS" if use_gcs else "Local Storage"
+    # Liveness only: does not wait for storage to connect (see /ready)
+    if not storage.warm:
+        storage_status = "Connecting"
+    else:
+        storage_status = STORAGE_STATUS.get(storage.value.name, storage.value.name)
     return jsonify({
         "status": "healthy",
         "storage": storage_status,
         "version": "1.2.0"
     }), 200
 
+@app.route('/ready')
+def readiness_check():
+    """Report which subsystems of this worker are warm; 503 until the required ones are"""
+    ready, subsystems = readiness()
+    return jsonify({
+        'pid': os.getpid(),
+        'ready': ready,
+        'subsystems': subsystems,
+        'imported': {name: name in sys.modules for name in HEAVY_MODULES}
+    }), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of all web workers (stage latency histograms, errors, storage fallbacks, caches)"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/stats/models')
+def model_stats():
+    """Report rembg session timings and mask cache counters for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'pools': registry_stats(),
+        'mask_cache': mask_cache.stats()
+    }), 200
+
+@app.route('/stats/cache')
+def cache_stats():
+    """Report result and render cache counters for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'result_cache': result_cache.stats(),
+        'render_cache': render_cache.stats()
+    }), 200
+
+@app.route('/stats/encode')
+def encoder_stats():
+    """Report encode time and output size per format and encoder profile for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'encode': encode_stats()
+    }), 200
+
+@app.route('/stats/images')
+def image_stats():
+    """Report decodes and pixel conversions by kind for this worker (including its image workers)"""
+    return jsonify({
+        'pid': os.getpid(),
+        'image_work': image_work_stats()
+    }), 200
+
+@app.route('/stats/storage')
+def storage_stats():
+    """Report upload latency and background publishing counters for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'storage': storage.value.stats() if storage.warm else None
+    }), 200
+
+@app.route('/stats/lifecycle')
+def lifecycle_stats():
+    """Report stored-file collection runs and reclaimed bytes (collections run in one worker at a time)"""
+    return jsonify({
+        'pid': os.getpid(),
+        'lifecycle': lifecycle.stats()
+    }), 200
+
+@app.route('/stats/live-preview')
+def live_preview_stats():
+    """Report open live preview streams and refused ones for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'live_preview': live_previews.stats()
+    }), 200
+
+@app.route('/stats/batch')
+def batch_stats():
+    """Report batch process pool counters for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'batch': batch_runner.stats()
+    }), 200
+
+@app.route('/stats/executor')
+def executor_stats():
+    """Report image worker process counters for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'executor': image_executor.stats()
+    }), 200
+
+@app.route('/stats/jobs')
+def job_stats():
+    """Report background job queue counters for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'jobs': job_queue.stats()
+    }), 200
+
 if __name__ == '__main__':
+    start_warm_up()
     port = int(os.environ.get("PORT", 8080))
     host = "0.0.0.0"
     app.run(host=host, port=port, debug=True)
\ No newline at end of file
@@ -2,10 +2,12 @@
 
 let currentImage = null;
 let isProcessing = false;
+// Size of the displayed preview relative to the full-resolution image
+let previewScale = 1;
 
-// --- Undo/Redo stacks ---
-let undoStack = [];
-let redoStack = [];
+// --- Undo/Redo (history is kept by the server, see /undo and /redo) ---
+let canUndo = false;
+let canRedo = false;
 
 document.addEventListener('DOMContentLoaded', function() {
   // DOM elements
@@ -85,8 +87,9 @@ document.addEventListener('DOMContentLoaded', function() {
             if (editorContainer) editorContainer.style.display = 'block';
             
             // Update preview image
-            previewImg.src = data.url;
+            showPreview(data.url, data.srcset);
             currentImage = data.url;
+            previewScale = data.preview_scale || 1;
             
             // Reset active tool
             toolButtons.forEach(btn => btn.classList.remove('active'));
@@ -145,8 +148,9 @@ document.addEventListener('DOMContentLoaded', function() {
         hideLoading();
         
         if (data.success) {
-          previewImg.src = data.url;
-          onImageLoaded(data.url); // <-- clear undo/redo
+          showPreview(data.url, data.srcset);
+          previewScale = data.preview_scale || 1;
+          onImageLoaded(data.url, data);
           
           // Reset active tool
           toolButtons.forEach(btn => btn.classList.remove('active'));
@@ -168,55 +172,88 @@ document.addEventListener('DOMContentLoaded', function() {
   // Download button
   if (downloadButton) {
     downloadButton.addEventListener('click', function() {
-      if (!currentImage) return;
+      if (isProcessing || !currentImage) return;
       
-      // Create a temporary link to download the image
-      const a = document.createElement('a');
-      a.href = currentImage;
-      a.download = 'edited-image' + currentImage.split('.').pop();
-      document.body.appendChild(a);
-      a.click();
-      document.body.removeChild(a);
+      // The editor shows a preview; ask the server for the full-resolution render
+      const hideLoading = showLoading('Preparing full-resolution image...');
       
+      fetch('/download')
+      .then(response => response.json())
+      .then(data => {
+        hideLoading();
+        
+        if (!data.success) {
+          showAlert(data.error || 'Error downloading image', 'danger');
+          return;
+        }
+        
+        // Create a temporary link to download the image
+        const a = document.createElement('a');
+        a.href = data.url;
+        a.download = 'edited-image.' + data.url.split('.').pop();
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+      })
+      .catch(error => {
+        hideLoading();
+        showAlert('Error downloading image: ' + error.message, 'danger');
+      });
     });
   }
   
+  // Utility: show an image, letting the browser pick the smallest stored
+  // size (srcset) that fills the preview area
+  function showPreview(url, srcset) {
+    if (srcset) {
+      previewImg.sizes = Math.max(1, previewContainer.clientWidth) + 'px';
+      previewImg.srcset = srcset;
+    } else {
+      previewImg.removeAttribute('srcset');
+    }
+    previewImg.src = url;
+  }
+
   // Utility: update undo/redo button state
   function updateUndoRedoButtons() {
-    if (undoButton) undoButton.disabled = undoStack.length === 0;
-    if (redoButton) redoButton.disabled = redoStack.length === 0;
+    if (undoButton) undoButton.disabled = !canUndo;
+    if (redoButton) redoButton.disabled = !canRedo;
   }
 
-  // Utility: push current image to undo stack
-  function pushUndo() {
-    if (currentImage) {
-      undoStack.push(currentImage);
-      // Limit stack size if needed
-      if (undoStack.length > 20) undoStack.shift();
-      redoStack = [];
-      updateUndoRedoButtons();
-    }
+  // Undo or redo one edit on the server, which also reverts the edit stack
+  function stepHistory(direction) {
+    isProcessing = true;
+    const hideLoading = showLoading(direction === 'undo' ? 'Undoing...' : 'Redoing...');
+    fetch('/' + direction, { method: 'POST' })
+    .then(response => response.json())
+    .then(data => {
+      hideLoading();
+      isProcessing = false;
+      if (data.success) {
+        showPreview(data.url, data.srcset);
+        currentImage = data.url;
+        previewScale = data.preview_scale || 1;
+        canUndo = data.can_undo;
+        canRedo = data.can_redo;
+        updateUndoRedoButtons();
+        controlsContainer.innerHTML = '';
+      } else {
+        showAlert(data.error || 'Error changing history', 'danger');
+      }
+    })
+    .catch(error => {
+      hideLoading();
+      isProcessing = false;
+      showAlert('Error changing history: ' + error.message, 'danger');
+    });
   }
 
-  // Undo action
   function undo() {
-    if (undoStack.length === 0) return;
-    redoStack.push(currentImage);
-    currentImage = undoStack.pop();
-    previewImg.src = currentImage;
-    updateUndoRedoButtons();
-    // Optionally clear controls
-    controlsContainer.innerHTML = '';
+    if (canUndo) stepHistory('undo');
   }
 
-  // Redo action
   function redo() {
-    if (redoStack.length === 0) return;
-    undoStack.push(currentImage);
-    currentImage = redoStack.pop();
-    previewImg.src = currentImage;
-    updateUndoRedoButtons();
-    controlsContainer.innerHTML = '';
+    if (canRedo) stepHistory('redo');
   }
 
   // Wire up Undo/Redo buttons
@@ -351,7 +388,17 @@ document.addEventListener('DOMContentLoaded', function() {
           </div>
           <div class="control-group">
             <label class="control-label">Height (px)</label>
-            <input type="number" id="resize-height" class="form-control mb-3" min="1" max="5000">
+            <input type="number" id="resize-height" class="form-control mb-2" min="1" max="5000">
+          </div>
+          <div class="control-group">
+            <label class="control-label">Mode</label>
+            <select id="resize-mode" class="form-control mb-3">
+              <option value="exact">Stretch to size</option>
+              <option value="fit">Fit inside</option>
+              <option value="fill">Fill and crop</option>
+              <option value="crop">Crop only</option>
+              <option value="thumbnail">Thumbnail (shrink only)</option>
+            </select>
           </div>
           <button id="apply-resize" class="btn btn-primary">Resize Image</button>
         `;
@@ -360,8 +407,9 @@ document.addEventListener('DOMContentLoaded', function() {
         const img = new Image();
         img.src = currentImage;
         img.onload = function() {
-          document.getElementById('resize-width').value = this.width;
-          document.getElementById('resize-height').value = this.height;
+          // Sizes are entered in full-resolution pixels
+          document.getElementById('resize-width').value = Math.round(this.width / previewScale);
+          document.getElementById('resize-height').value = Math.round(this.height / previewScale);
         };
         
         // Apply button
@@ -372,13 +420,16 @@ document.addEventListener('DOMContentLoaded', function() {
             
             const width = document.getElementById('resize-width').value;
             const height = document.getElementById('resize-height').value;
+            const mode = document.getElementById('resize-mode').value;
             
-            if (!width || !height) {
-              showAlert('Please enter both width and height', 'warning');
+            // Fit and thumbnail keep the aspect ratio, so one dimension is enough
+            const oneDimensionOk = mode === 'fit' || mode === 'thumbnail';
+            if (oneDimensionOk ? (!width && !height) : (!width || !height)) {
+              showAlert(oneDimensionOk ? 'Please enter a width or a height' : 'Please enter both width and height', 'warning');
               return;
             }
             
-            processImage('resize', { width: width, height: height });
+            processImage('resize', { width: width, height: height, mode: mode });
           });
         }
         break;
@@ -479,15 +530,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const brightnessValue = document.getElementById('brightness-value');
         
         if (brightnessSlider && brightnessValue) {
-          const updateBrightness = debounce((value) => {
-            if (!isProcessing) {
-              processImage('brightness', { factor: value });
-            }
-          }, 100);
-
-          brightnessSlider.addEventListener('input', function() {
-            brightnessValue.textContent = parseFloat(this.value).toFixed(2);
-            updateBrightness(this.value);
+          bindLiveSlider(brightnessSlider, 'brightness', value => ({ factor: value }), function(value) {
+            brightnessValue.textContent = parseFloat(value).toFixed(2);
           });
         }
         break;
@@ -510,15 +554,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const contrastValue = document.getElementById('contrast-value');
         
         if (contrastSlider && contrastValue) {
-          const updateContrast = debounce((value) => {
-            if (!isProcessing) {
-              processImage('contrast', { factor: value });
-            }
-          }, 100);
-
-          contrastSlider.addEventListener('input', function() {
-            contrastValue.textContent = parseFloat(this.value).toFixed(2);
-            updateContrast(this.value);
+          bindLiveSlider(contrastSlider, 'contrast', value => ({ factor: value }), function(value) {
+            contrastValue.textContent = parseFloat(value).toFixed(2);
           });
         }
         break;
@@ -541,15 +578,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const saturationValue = document.getElementById('saturation-value');
         
         if (saturationSlider && saturationValue) {
-          const updateSaturation = debounce((value) => {
-            if (!isProcessing) {
-              processImage('saturation', { factor: value });
-            }
-          }, 100);
-
-          saturationSlider.addEventListener('input', function() {
-            saturationValue.textContent = parseFloat(this.value).toFixed(2);
-            updateSaturation(this.value);
+          bindLiveSlider(saturationSlider, 'saturation', value => ({ factor: value }), function(value) {
+            saturationValue.textContent = parseFloat(value).toFixed(2);
           });
         }
         break;
@@ -572,15 +602,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const hueValue = document.getElementById('hue-value');
         
         if (hueSlider && hueValue) {
-          const updateHue = debounce((value) => {
-            if (!isProcessing) {
-              processImage('hue', { factor: value });
-            }
-          }, 100);
-
-          hueSlider.addEventListener('input', function() {
-            hueValue.textContent = this.value + '°';
-            updateHue(this.value);
+          bindLiveSlider(hueSlider, 'hue', value => ({ factor: value }), function(value) {
+            hueValue.textContent = value + '°';
           });
         }
         break;
@@ -624,30 +647,11 @@ document.addEventListener('DOMContentLoaded', function() {
             const filter = this.dataset.filter;
             const intensityControl = document.getElementById('filter-intensity-control');
             
-            // Show/hide intensity slider based on filter selection
-            if (filter === 'none') {
-              intensityControl.style.display = 'none';
-              // Reset to original instead of applying a filter
-              fetch('/reset', {
-                method: 'POST',
-                headers: {
-                  'Content-Type': 'application/json'
-                }
-              })
-              .then(response => response.json())
-              .then(data => {
-                if (data.success) {
-                  previewImg.src = data.url;
-                  onImageLoaded(data.url);
-                } else {
-                  showAlert(data.error || 'Error resetting image', 'danger');
-                }
-              });
-            } else {
-              intensityControl.style.display = 'block';
-              const intensity = document.getElementById('filter-intensity').value;
-              processImage('filter', { type: filter, intensity: intensity });
-            }
+            // Show/hide intensity slider based on filter selection; 'none'
+            // replaces the filter step like any other choice, so it stays one undo step
+            intensityControl.style.display = filter === 'none' ? 'none' : 'block';
+            const intensity = document.getElementById('filter-intensity').value;
+            processImage('filter', { type: filter, intensity: intensity });
             
             // Update active state
             document.querySelectorAll('.filter-option').forEach(btn => btn.classList.remove('active'));
@@ -660,41 +664,12 @@ document.addEventListener('DOMContentLoaded', function() {
         const intensityValue = document.getElementById('intensity-value');
         
         if (intensitySlider && intensityValue) {
-          let isAdjusting = false;  // Prevent multiple simultaneous adjustments
-          
-          intensitySlider.addEventListener('input', function() {
-            if (isAdjusting) return;
-            isAdjusting = true;
-            
-            intensityValue.textContent = this.value + '%';
-            
-            // Apply filter with new intensity if a filter is selected
+          // Each value replaces the filter step on the server (filter is adjustable)
+          bindLiveSlider(intensitySlider, 'filter', function(value) {
             const activeFilter = document.querySelector('.filter-option.active');
-            if (activeFilter && activeFilter.dataset.filter !== 'none') {
-              // First reset to original
-              fetch('/reset', {
-                method: 'POST',
-                headers: {
-                  'Content-Type': 'application/json'
-                }
-              })
-              .then(response => response.json())
-              .then(data => {
-                if (data.success) {
-                  // Then apply new filter with current intensity
-                  processImage('filter', { 
-                    type: activeFilter.dataset.filter, 
-                    intensity: intensitySlider.value 
-                  });
-                }
-                isAdjusting = false;
-              })
-              .catch(() => {
-                isAdjusting = false;
-              });
-            } else {
-              isAdjusting = false;
-            }
+            return { type: activeFilter ? activeFilter.dataset.filter : 'none', intensity: value };
+          }, function(value) {
+            intensityValue.textContent = value + '%';
           });
         }
         break;
@@ -735,15 +710,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const blurValue = document.getElementById('blur-value');
         
         if (blurSlider && blurValue) {
-          const updateBlur = debounce((value) => {
-            if (!isProcessing) {
-              processImage('blur', { amount: value });
-            }
-          }, 100);
-
-          blurSlider.addEventListener('input', function() {
-            blurValue.textContent = parseFloat(this.value).toFixed(1);
-            updateBlur(this.value);
+          bindLiveSlider(blurSlider, 'blur', value => ({ amount: value }), function(value) {
+            blurValue.textContent = parseFloat(value).toFixed(1);
           });
         }
         break;
@@ -766,15 +734,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const sharpenValue = document.getElementById('sharpen-value');
         
         if (sharpenSlider && sharpenValue) {
-          const updateSharpen = debounce((value) => {
-            if (!isProcessing) {
-              processImage('sharpen', { amount: value });
-            }
-          }, 100);
-
-          sharpenSlider.addEventListener('input', function() {
-            sharpenValue.textContent = parseFloat(this.value).toFixed(1);
-            updateSharpen(this.value);
+          bindLiveSlider(sharpenSlider, 'sharpen', value => ({ amount: value }), function(value) {
+            sharpenValue.textContent = parseFloat(value).toFixed(1);
           });
         }
         break;
@@ -793,13 +754,39 @@ document.addEventListener('DOMContentLoaded', function() {
           <div class="alert alert-info mt-3">
             Lower quality results in smaller file size.
           </div>
+          <div class="control-group">
+            <label class="control-label">Target Size (KB)</label>
+            <input type="number" id="target-size" class="form-control mb-3" min="1" placeholder="e.g. 500">
+            <div class="form-check mb-3">
+              <input type="checkbox" id="target-allow-scale" class="form-check-input" checked>
+              <label class="form-check-label" for="target-allow-scale">Scale down if needed</label>
+            </div>
+          </div>
+          <button id="apply-target-size" class="btn btn-primary">Compress to Size</button>
         `;
         
+        // Compress to a byte budget: the server searches quality (and scale)
+        const applyTargetSize = document.getElementById('apply-target-size');
+        if (applyTargetSize) {
+          applyTargetSize.addEventListener('click', function() {
+            const targetKb = parseFloat(document.getElementById('target-size').value);
+            if (!targetKb || targetKb <= 0) {
+              showAlert('Please enter a target size in KB', 'warning');
+              return;
+            }
+            processImage('compress', {
+              target_bytes: Math.round(targetKb * 1024),
+              allow_scale: document.getElementById('target-allow-scale').checked
+            });
+          });
+        }
+        
         // Quality slider
         const qualitySlider = document.getElementById('quality-slider');
         const qualityValue = document.getElementById('quality-value');
         
         if (qualitySlider && qualityValue) {
+          // Quality only changes the encoder settings, which live frames cannot show
           const updateQuality = debounce((value) => {
             if (!isProcessing) {
               processImage('compress', { quality: value });
@@ -819,11 +806,122 @@ document.addEventListener('DOMContentLoaded', function() {
     }
   }
   
+  // --- Live preview: low-resolution frames streamed while a slider moves ---
+  // Slider values are posted to /preview/live and frames arrive on one
+  // Server-Sent Events stream; only the released value goes through /process.
+  const live = {
+    source: null,
+    available: typeof EventSource !== 'undefined',
+    ready: false,
+    showFrames: false,
+    sending: false,
+    next: null,
+    shownSeq: 0
+  };
+
+  function openLivePreview() {
+    if (live.source || !live.available) return;
+    live.source = new EventSource('/preview/live/stream');
+    live.source.addEventListener('ready', function() {
+      live.ready = true;
+    });
+    live.source.addEventListener('frame', function(event) {
+      const frame = JSON.parse(event.data);
+      // Ignore frames older than the one shown, and any after a commit
+      if (!live.showFrames || frame.seq < live.shownSeq) return;
+      live.shownSeq = frame.seq;
+      previewImg.removeAttribute('srcset');
+      previewImg.src = frame.image;
+    });
+    // The server ends idle streams; the next slider move opens a new one
+    live.source.addEventListener('idle', closeLivePreview);
+    live.source.onerror = function() {
+      // Refused (too many streams) or unsupported: fall back to /process calls
+      if (!live.ready) live.available = false;
+      closeLivePreview();
+    };
+  }
+
+  function closeLivePreview() {
+    if (live.source) live.source.close();
+    live.source = null;
+    live.ready = false;
+  }
+
+  // Post a slider value; values that come in while one is posted replace each other
+  function sendLiveValue(operation, params) {
+    openLivePreview();
+    live.showFrames = true;
+    if (live.sending) {
+      live.next = [operation, params];
+      return;
+    }
+    live.sending = true;
+    fetch('/preview/live', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ operation: operation, params: params })
+    })
+    .catch(() => {})
+    .finally(() => {
+      live.sending = false;
+      if (live.next) {
+        const [nextOperation, nextParams] = live.next;
+        live.next = null;
+        sendLiveValue(nextOperation, nextParams);
+      }
+    });
+  }
+
+  // Wire a slider: live frames while it moves, one /process when it is released
+  // (debounced /process calls while it moves when live preview is unavailable)
+  function bindLiveSlider(slider, operation, paramsFor, onInput) {
+    const update = debounce((value) => {
+      commitValue(operation, paramsFor(value));
+    }, 100);
+
+    slider.addEventListener('input', function() {
+      onInput(this.value);
+      if (live.available) {
+        sendLiveValue(operation, paramsFor(this.value));
+      } else {
+        update(this.value);
+      }
+    });
+    slider.addEventListener('change', function() {
+      if (!live.available) {
+        update(this.value);
+      } else {
+        live.showFrames = false;
+        live.next = null;
+        commitValue(operation, paramsFor(this.value));
+      }
+    });
+  }
+
+  // A value released while a /process call is in flight is kept (the latest
+  // one wins) and committed once that call finishes, so it is never dropped
+  let pendingCommit = null;
+
+  function commitValue(operation, params) {
+    if (isProcessing) {
+      pendingCommit = [operation, params];
+      return;
+    }
+    processImage(operation, params);
+  }
+
+  function commitPendingValue() {
+    if (!pendingCommit) return;
+    const [operation, params] = pendingCommit;
+    pendingCommit = null;
+    processImage(operation, params);
+  }
+
   // Process image with selected operation
   function processImage(operation, params = {}) {
     if (isProcessing || !currentImage) return;
     
-    pushUndo(); // Save state before processing
     isProcessing = true;
     const hideLoading = showLoading('Processing image...');
     
@@ -834,19 +932,35 @@ document.addEventListener('DOMContentLoaded', function() {
       },
       body: JSON.stringify({
         operation: operation,
-        params: params
+        params: params,
+        async: true // heavy operations come back as a job to poll
       })
     })
     .then(response => response.json())
+    .then(data => data.job_id ? waitForJob(data.job_id) : data)
     .then(data => {
       hideLoading();
       isProcessing = false;
       
-      if (data.success) {
+      if (data.success && data.url) {
         // Update preview with new image
-        previewImg.src = data.url + '?t=' + new Date().getTime(); // Add timestamp to prevent caching
+        showPreview(data.url + '?t=' + new Date().getTime(), data.srcset); // Add timestamp to prevent caching
         currentImage = data.url;
+        previewScale = data.preview_scale || 1;
+        
+        if (data.compression) {
+          const c = data.compression;
+          const achieved = (c.bytes / 1024).toFixed(1) + ' KB';
+          const details = (c.quality ? 'quality ' + c.quality : 'lossless') +
+            (c.scale < 1 ? ', scaled to ' + c.width + 'x' + c.height : '');
+          showAlert(c.met ? 'Compressed to ' + achieved + ' (' + details + ')'
+                          : 'Could not reach the target size; smallest result is ' + achieved + ' (' + details + ')',
+                    c.met ? 'success' : 'warning');
+        }
         
+        // A new edit can be undone and drops whatever could be redone
+        canUndo = true;
+        canRedo = false;
         updateUndoRedoButtons();
       } else {
         showAlert(data.error || 'Error processing image', 'danger');
@@ -856,14 +970,30 @@ document.addEventListener('DOMContentLoaded', function() {
       hideLoading();
       isProcessing = false;
       showAlert('Error processing image: ' + error.message, 'danger');
-    });
+    })
+    .finally(commitPendingValue);
+  }
+
+  // Long-poll a background job until it finishes
+  function waitForJob(jobId) {
+    return fetch('/jobs/' + jobId + '?wait=20')
+      .then(response => response.json())
+      .then(data => {
+        if (data.status === 'queued' || data.status === 'running') {
+          return waitForJob(jobId);
+        }
+        if (data.status === 'failed' || data.status === 'cancelled') {
+          return { success: false, error: data.error || 'Processing ' + data.status };
+        }
+        return data;
+      });
   }
 
-  // After image upload or reset, clear stacks
-  function onImageLoaded(newUrl) {
+  // After image upload or reset; a reset reports what can be undone
+  function onImageLoaded(newUrl, data = {}) {
     currentImage = newUrl;
-    undoStack = [];
-    redoStack = [];
+    canUndo = Boolean(data.can_undo);
+    canRedo = Boolean(data.can_redo);
     updateUndoRedoButtons();
   }
 });
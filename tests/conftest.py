@@ -0,0 +1,59 @@
+"""
+Shared setup for the test suite.
+
+The app is configured for offline runs before anything imports it: storage
+in memory, image work inline instead of in worker processes, and the shared
+state directories (jobs, lifecycle records, live preview values) under a
+temporary directory.
+"""
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+STATE_DIR = tempfile.mkdtemp(prefix='alchemist-tests-')
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('EXECUTOR_WORKERS', '0')
+os.environ.setdefault('JOB_STATE_DIR', os.path.join(STATE_DIR, 'jobs'))
+os.environ.setdefault('LIFECYCLE_DIR', os.path.join(STATE_DIR, 'lifecycle'))
+os.environ.setdefault('LIVE_PREVIEW_DIR', os.path.join(STATE_DIR, 'live_preview'))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def make_image(width=160, height=120, mode='RGB'):
+    """Smooth gradients with a little noise, so operations do photo-like work"""
+    y, x = np.mgrid[0:height, 0:width]
+    noise = np.random.default_rng(0).integers(0, 24, (height, width, 3))
+    pixels = np.stack([x * 200 // width + 20, y * 200 // height + 20, (x + y) * 200 // (width + height) + 20], axis=-1)
+    img = Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+    if mode == 'RGBA':
+        img.putalpha(Image.fromarray((x * 255 // width).astype(np.uint8)))
+    return img
+
+def max_difference(a, b):
+    """Largest per-channel difference between two images of the same size and mode"""
+    assert a.size == b.size and a.mode == b.mode
+    return int(np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).max())
+
+def jpeg_bytes(img, quality=90):
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+@pytest.fixture
+def client():
+    """Flask test client of the app, with its own session"""
+    import main
+    return main.app.test_client()
+
+def upload(client, img, name='photo.jpg'):
+    """Upload an image through /upload and return the JSON response"""
+    response = client.post('/upload', data={'file': (io.BytesIO(jpeg_bytes(img)), name)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
@@ -0,0 +1,75 @@
+"""Fused colour engine against applying the same operations one by one."""
+import numpy as np
+import pytest
+from conftest import make_image, max_difference
+
+from utils.color_engine import apply_color_chain, compile_chain
+from utils.image_processing import apply_operation
+
+# Affine operations fold into one matrix; the sequential path rounds once per step
+AFFINE = [
+    [['brightness', {'factor': 1.2}]],
+    [['contrast', {'factor': 1.3}]],
+    [['saturation', {'factor': 1.4}]],
+    [['filter', {'type': 'sepia', 'intensity': 70}]],
+    [['filter', {'type': 'grayscale', 'intensity': 100}]],
+    [['filter', {'type': 'invert', 'intensity': 100}]],
+    [['filter', {'type': 'warm', 'intensity': 60}]],
+    [['brightness', {'factor': 0.9}], ['contrast', {'factor': 1.2}]],
+]
+
+# Lookup-table stages approximate the HSV round trip of the regular functions
+LUT = [
+    [['hue', {'factor': 30}]],
+    [['vibrance', {'factor': 1.3}]],
+]
+
+CHAIN = [
+    ['brightness', {'factor': 1.1}],
+    ['contrast', {'factor': 1.15}],
+    ['saturation', {'factor': 1.2}],
+    ['hue', {'factor': 10}],
+    ['vibrance', {'factor': 1.3}],
+    ['filter', {'type': 'warm', 'intensity': 60}],
+]
+
+def sequential(img, operations):
+    for operation, params in operations:
+        img = apply_operation(img, operation, params)
+    return img
+
+def mean_difference(a, b):
+    return float(np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).mean())
+
+@pytest.mark.parametrize('operations', AFFINE, ids=lambda ops: '+'.join(op for op, _ in ops))
+def test_affine_operations_match(operations):
+    img = make_image()
+    assert max_difference(apply_color_chain(img, operations), sequential(img, operations)) <= len(operations)
+
+@pytest.mark.parametrize('operations', LUT, ids=lambda ops: ops[0][0])
+def test_lookup_table_operations_match(operations):
+    img = make_image()
+    fused, expected = apply_color_chain(img, operations), sequential(img, operations)
+    assert mean_difference(fused, expected) < 1
+    assert max_difference(fused, expected) <= 8
+
+def test_chain_matches_applying_each_step():
+    img = make_image()
+    fused, expected = apply_color_chain(img, CHAIN), sequential(img, CHAIN)
+    assert mean_difference(fused, expected) < 2
+    assert max_difference(fused, expected) <= 10
+
+def test_alpha_passes_through_untouched():
+    img = make_image(mode='RGBA')
+    fused = apply_color_chain(img, CHAIN)
+    assert fused.mode == 'RGBA'
+    assert np.array_equal(np.asarray(fused)[..., 3], np.asarray(img)[..., 3])
+
+def test_neutral_chain_is_identity():
+    assert compile_chain([['brightness', {'factor': 1.0}], ['hue', {'factor': 0}]]).is_identity
+    img = make_image()
+    assert apply_color_chain(img, [['saturation', {'factor': 1.0}]]) is img
+
+def test_non_colour_operation_is_rejected():
+    with pytest.raises(ValueError):
+        compile_chain([['blur', {'amount': 2}]])
@@ -0,0 +1,39 @@
+"""Compress to a target size: the byte-budget search and where the budget applies."""
+from conftest import make_image, upload
+
+from utils.edit_stack import stack_encode_options
+from utils.image_processing import encode_image, encode_to_target
+
+def test_quality_search_meets_the_budget():
+    img = make_image(640, 480)
+    full = len(encode_image(img, 'jpg', quality=95))
+    data, report = encode_to_target(img, 'jpg', full // 3)
+    assert len(data) == report['bytes'] <= full // 3
+    assert report['met'] and report['scale'] == 1.0
+    assert report['quality'] < 95
+
+def test_scales_down_when_quality_is_not_enough():
+    img = make_image(640, 480)
+    data, report = encode_to_target(img, 'jpg', 1500)
+    assert report['met'] and len(data) <= 1500
+    assert report['width'] < 640
+
+    _, report = encode_to_target(img, 'jpg', 1500, allow_scale=False)
+    assert not report['met'] and report['width'] == 640
+
+def test_preview_renders_leave_the_budget_out():
+    stack = [['compress', {'target_bytes': 20000}], ['hue', {'factor': 20}]]
+    assert stack_encode_options(stack)['target_bytes'] == 20000
+    options = stack_encode_options(stack, preview=True)
+    assert options['target_bytes'] is None
+    assert 'allow_scale' not in options
+
+def test_later_preview_edits_report_no_compression(client):
+    upload(client, make_image(2000, 1500))
+    compressed = client.post('/process', json={'operation': 'compress', 'params': {'target_bytes': 20000}}).get_json()
+    assert not compressed['preview']
+    assert compressed['compression']['met']
+
+    edited = client.post('/process', json={'operation': 'hue', 'params': {'factor': 20}}).get_json()
+    assert edited['success'] and edited['preview']
+    assert edited['compression'] is None
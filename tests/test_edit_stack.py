@@ -0,0 +1,120 @@
+"""Edit stacks: hash-chain keys, adjustable operations and prefix reuse in render_stack."""
+import pytest
+from conftest import make_image, max_difference, upload
+
+from utils.edit_stack import (
+    RenderCache,
+    derive_key,
+    normalize_params,
+    prefix_keys,
+    push_operation,
+    render_stack,
+    segment_boundaries,
+)
+from utils.tiling import apply_segment
+
+STACK = [
+    ['brightness', {'factor': 1.2}],
+    ['contrast', {'factor': 1.1}],
+    ['blur', {'amount': 2}],
+    ['saturation', {'factor': 1.3}],
+]
+
+class CountingApply:
+    """apply_segment that records the segments it was asked to render"""
+
+    def __init__(self):
+        self.segments = []
+
+    def __call__(self, img, operations):
+        self.segments.append([operation for operation, _ in operations])
+        return apply_segment(img, operations)
+
+def test_equivalent_params_share_a_key():
+    assert normalize_params({'factor': '1.50'}) == normalize_params({'factor': 1.5})
+    assert derive_key('src', 'brightness', {'factor': '1.50'}) == derive_key('src', 'brightness', {'factor': 1.5})
+    assert derive_key('src', 'filter', {'type': ' Sepia'}) == derive_key('src', 'filter', {'type': 'sepia'})
+
+def test_prefix_keys_chain_on_the_parent():
+    keys = prefix_keys('src', STACK)
+    assert len(keys) == len(STACK) + 1
+    assert keys[0] == 'src'
+    # Changing one operation changes its key and every key after it, not the ones before
+    changed = prefix_keys('src', STACK[:1] + [['contrast', {'factor': 1.4}]] + STACK[2:])
+    assert changed[:2] == keys[:2]
+    assert all(a != b for a, b in zip(changed[2:], keys[2:]))
+    # The same operations on another source share nothing
+    assert not set(prefix_keys('other', STACK)[1:]) & set(keys[1:])
+
+def test_adjustable_operation_replaces_its_last_value():
+    stack = push_operation([], 'brightness', {'factor': 1.1})
+    stack = push_operation(stack, 'brightness', {'factor': 1.3})
+    assert stack == [['brightness', {'factor': 1.3}]]
+    stack = push_operation(stack, 'flip', {'direction': 'horizontal'})
+    stack = push_operation(stack, 'flip', {'direction': 'horizontal'})
+    assert [operation for operation, _ in stack] == ['brightness', 'flip', 'flip']
+
+def test_colour_operations_form_one_segment():
+    assert segment_boundaries(STACK) == [0, 2, 3, 4]
+    assert segment_boundaries([]) == [0]
+
+def test_render_resumes_from_the_longest_cached_prefix():
+    original = make_image()
+    cache = RenderCache()
+    apply = CountingApply()
+    first = render_stack('src', lambda: original, STACK, cache=cache, apply=apply)
+    assert apply.segments == [['brightness', 'contrast'], ['blur'], ['saturation']]
+
+    # Moving the last slider recomputes only the last segment
+    apply.segments.clear()
+    adjusted = STACK[:-1] + [['saturation', {'factor': 0.7}]]
+    second = render_stack('src', lambda: original, adjusted, cache=cache, apply=apply)
+    assert apply.segments == [['saturation']]
+
+    # Cached and uncached renders of a stack are the same image
+    uncached = render_stack('src', lambda: original, adjusted, cache=RenderCache(), apply=apply_segment)
+    assert max_difference(second, uncached) == 0
+    again = render_stack('src', lambda: original, STACK, cache=cache, apply=apply)
+    assert max_difference(first, again) == 0
+
+def test_render_cache_stays_under_its_budget():
+    img = make_image(100, 100)
+    size = 100 * 100 * 3
+    cache = RenderCache(max_bytes=2 * size)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, img.copy())
+    assert cache.current_bytes <= 2 * size
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
+    # An image larger than the whole budget is not cached at all
+    cache.put('big', make_image(300, 300))
+    assert cache.get('big') is None
+
+def test_render_cache_counts_a_shared_image_once():
+    img = make_image(100, 100)
+    size = 100 * 100 * 3
+    cache = RenderCache(max_bytes=2 * size)
+    # An operation that returns its input puts the same object under two keys
+    cache.put('a', img)
+    cache.put('b', img)
+    assert cache.current_bytes == size
+    cache.put('c', img.copy())
+    assert cache.current_bytes == 2 * size and cache.get('a') is img
+    # Its bytes are released with the last key holding it
+    cache.put('d', img.copy())
+    cache.put('e', img.copy())
+    assert cache.get('a') is None and cache.get('b') is None
+    assert cache.current_bytes == 2 * size
+
+@pytest.mark.parametrize('operation, params', [
+    ('bogus', {}),
+    ('rotate', {'angle': 'abc'}),
+    ('compress', {'target_bytes': '-5'}),
+    ('resize', {}),
+])
+def test_bad_operations_are_client_errors(client, operation, params):
+    upload(client, make_image(400, 300))
+    response = client.post('/process', json={'operation': operation, 'params': params})
+    assert response.status_code == 400 and response.get_json()['error']
+    # The session keeps its last good image
+    assert client.get('/history').get_json()['steps'][-1]['operations'] == []
@@ -0,0 +1,116 @@
+"""Undo/redo history: stepping, the byte budget on stored renders, and the /undo and /redo routes."""
+from conftest import make_image, upload
+
+from utils import history
+
+MB = 1024 * 1024
+
+def render(name, size=100):
+    return {'path': f'uploads/{name}', 'url': f'/storage/uploads/{name}', 'storage': 'memory',
+            'preview': True, 'bytes': size}
+
+def stack(i):
+    return [['brightness', {'factor': 1 + i / 10}], ['rotate', {'angle': 90 * i}]]
+
+def new_record(steps, size=100, max_mb=50):
+    record = {}
+    history.start(record, render('original.jpg', 10 * MB))
+    for i in range(1, steps + 1):
+        history.push(record, stack(i), render(f'step{i}.jpg', size), max_mb=max_mb)
+    return record
+
+def stored_steps(record):
+    return [step['path'] is not None for step in record['history']['steps']]
+
+def test_undo_redo_round_trip():
+    record = new_record(3)
+    assert history.move(record, -1)['path'] == 'uploads/step2.jpg'
+    assert history.move(record, -1)['path'] == 'uploads/step1.jpg'
+    assert history.move(record, -1)['stack'] == []
+    assert history.move(record, -1) is None
+    assert history.move(record, 1)['path'] == 'uploads/step1.jpg'
+    assert history.move(record, 1)['path'] == 'uploads/step2.jpg'
+    assert history.move(record, 1)['path'] == 'uploads/step3.jpg'
+    assert history.move(record, 1) is None
+    assert history.summary(record)['can_undo'] and not history.summary(record)['can_redo']
+
+def test_new_edit_drops_the_redo_steps():
+    record = new_record(3)
+    history.move(record, -1)
+    history.move(record, -1)
+    history.push(record, [['hue', {'factor': 20}]], render('branch.jpg'))
+    assert [step['path'] for step in record['history']['steps']] == \
+        ['uploads/original.jpg', 'uploads/step1.jpg', 'uploads/branch.jpg']
+    assert not history.summary(record)['can_redo']
+
+def test_byte_budget_keeps_renders_nearest_the_shown_step():
+    # A 1 MB budget keeps two of the four 400 KB renders; the original never counts
+    record = new_record(4, size=400 * 1024, max_mb=1)
+    assert stored_steps(record) == [True, False, False, True, True]
+    assert sum(step['bytes'] for step in record['history']['steps'][1:]) <= MB
+
+    # Stepping back moves the budget with the shown step; the dropped ones keep their recipe
+    step = history.move(record, -1, max_mb=1)
+    assert step['path'] == 'uploads/step3.jpg'
+    step = history.move(record, -1, max_mb=1)
+    assert step['path'] is None and step['stack'] == stack(2)
+    assert stored_steps(record)[3]
+
+    # A re-render of a recipe-only step is stored on it within the budget
+    history.store(record, stack(2), render('step2-again.jpg', 400 * 1024), max_mb=1)
+    assert record['history']['steps'][2]['path'] == 'uploads/step2-again.jpg'
+    assert sum(step['bytes'] for step in record['history']['steps'][1:]) <= MB
+
+def test_shown_step_keeps_its_render_even_over_budget():
+    record = new_record(1, size=2 * MB, max_mb=1)
+    assert stored_steps(record) == [True, True]
+
+def test_oldest_steps_are_dropped_beyond_max_steps():
+    record = {}
+    history.start(record, render('original.jpg'))
+    for i in range(1, 6):
+        history.push(record, stack(i), render(f'step{i}.jpg'), max_steps=3)
+    assert [step['path'] for step in record['history']['steps']] == \
+        ['uploads/step3.jpg', 'uploads/step4.jpg', 'uploads/step5.jpg']
+    assert record['history']['position'] == 2
+
+def test_store_ignores_a_step_that_moved_on():
+    record = new_record(2)
+    history.store(record, stack(1), render('late.jpg'))
+    assert record['history']['steps'][-1]['path'] == 'uploads/step2.jpg'
+
+def test_pinned_paths_follow_stored_renders_and_variants():
+    record = new_record(2, size=600 * 1024, max_mb=1)
+    record['history']['steps'][-1]['variants'] = {'thumb': {'path': 'uploads/step2_thumb.jpg', 'url': '', 'width': 256}}
+    assert history.pinned_paths(record) == {'uploads/original.jpg', 'uploads/step2.jpg', 'uploads/step2_thumb.jpg'}
+
+def test_undo_and_redo_routes(client):
+    upload(client, make_image(400, 300))
+    first = client.post('/process', json={'operation': 'brightness', 'params': {'factor': 1.3}}).get_json()
+    second = client.post('/process', json={'operation': 'flip', 'params': {'direction': 'horizontal'}}).get_json()
+
+    undone = client.post('/undo').get_json()
+    assert undone['url'] == first['url'] and not undone['rendered']
+    assert undone['can_undo'] and undone['can_redo']
+    assert client.post('/undo').get_json()['can_undo'] is False
+    assert client.post('/undo').status_code == 409
+
+    client.post('/redo')
+    redone = client.post('/redo').get_json()
+    assert redone['url'] == second['url'] and not redone['can_redo']
+    assert client.post('/redo').status_code == 409
+    assert [step['operations'] for step in client.get('/history').get_json()['steps']] == \
+        [[], ['brightness'], ['brightness', 'flip']]
+
+def test_filter_changes_replace_the_filter_and_idle_resets_add_no_steps(client):
+    upload(client, make_image(400, 300))
+    client.post('/reset')
+    for intensity in (40, 100):
+        client.post('/process', json={'operation': 'filter', 'params': {'type': 'sepia', 'intensity': intensity}})
+    client.post('/process', json={'operation': 'filter', 'params': {'type': 'none', 'intensity': 100}})
+    # One step per committed value, each holding a single filter pass
+    assert [step['operations'] for step in client.get('/history').get_json()['steps']] == \
+        [[], ['filter'], ['filter'], ['filter']]
+    client.post('/reset')
+    client.post('/reset')
+    assert len(client.get('/history').get_json()['steps']) == 5
@@ -0,0 +1,64 @@
+"""Background job queue: results, failures, capacity, cancellation and shared state."""
+import threading
+
+import pytest
+
+from utils.jobs import CANCELLED, DONE, FAILED, JobQueue, QueueFullError, is_heavy_operation
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(workers=1, queue_size=1, state_dir=str(tmp_path))
+
+def test_job_result_is_returned(queue):
+    job = queue.submit(lambda a, b: {'sum': a + b}, 2, 3, label='add', owner='me')
+    state = queue.status(job.id, wait=5)
+    assert state['status'] == DONE
+    assert state['result'] == {'sum': 5}
+    assert state['owner'] == 'me'
+
+def test_failure_is_reported(queue):
+    def fail():
+        raise RuntimeError('boom')
+    state = queue.status(queue.submit(fail).id, wait=5)
+    assert state['status'] == FAILED
+    assert state['error'] == 'boom'
+
+def test_full_queue_rejects_jobs(queue):
+    release = threading.Event()
+    running = queue.submit(release.wait, 5)
+    queued = queue.submit(lambda: 'queued')
+    with pytest.raises(QueueFullError):
+        queue.submit(lambda: 'rejected')
+    release.set()
+    assert queue.status(running.id, wait=5)['status'] == DONE
+    assert queue.status(queued.id, wait=5)['status'] == DONE
+    assert queue.stats()['rejected'] == 1
+
+def test_cancelled_queued_job_never_runs(queue):
+    release = threading.Event()
+    ran = []
+    blocker = queue.submit(release.wait, 5)
+    job = queue.submit(lambda: ran.append(True))
+    assert queue.cancel(job.id)['cancel_requested']
+    release.set()
+    queue.status(blocker.id, wait=5)
+    assert queue.status(job.id, wait=5)['status'] == CANCELLED
+    assert not ran
+
+def test_other_workers_read_the_shared_state(queue, tmp_path):
+    job = queue.submit(lambda: 'done')
+    queue.status(job.id, wait=5)
+    # Another web worker only sees the state files
+    other = JobQueue(workers=1, queue_size=1, state_dir=str(tmp_path))
+    state = other.status(job.id)
+    assert state['status'] == DONE
+    assert state['result'] == 'done'
+    assert other.status('not-a-job-id') is None
+
+def test_heavy_operations():
+    assert is_heavy_operation('remove_background')
+    assert is_heavy_operation('blur', {'amount': 25})
+    assert not is_heavy_operation('blur', {'amount': 2})
+    assert is_heavy_operation('resize', {'width': '5000', 'height': '4000'})
+    assert not is_heavy_operation('resize', {'width': 'wide'})
+    assert not is_heavy_operation('brightness', {'factor': 1.2})
@@ -0,0 +1,136 @@
+"""Lifecycle GC: what is collected, and that protected and pinned paths never are."""
+import os
+import time
+
+import pytest
+
+from utils import history
+from utils.lifecycle import LifecycleManager, _locked_file
+from utils.storage import LocalBackend, MemoryBackend, Storage
+
+@pytest.fixture
+def storage(tmp_path):
+    return Storage(MemoryBackend(), LocalBackend(str(tmp_path / 'public'), '/static/uploads/'))
+
+def manager(storage, tmp_path, **kwargs):
+    kwargs.setdefault('grace_seconds', 0)
+    return LifecycleManager(lambda: storage, [str(tmp_path / 'public')], directory=str(tmp_path / 'lifecycle'),
+                            quota_mb=kwargs.pop('quota_mb', 0), **kwargs)
+
+def put(storage, name, variants=()):
+    result = storage.put(b'x' * 1000, name)
+    if variants:
+        result['variants'] = {'full': {'path': result['path'], 'url': result['url'], 'width': 2000}}
+        for variant in variants:
+            stored = storage.put(b'v' * 100, f'{name}_{variant}')
+            result['variants'][variant] = {'path': stored['path'], 'url': stored['url'], 'width': 256}
+    return result
+
+def stored(storage, path):
+    return storage.get(path) is not None
+
+def test_superseded_versions_go_and_protected_ones_stay(storage, tmp_path):
+    gc = manager(storage, tmp_path)
+    original, proxy = put(storage, 'original.jpg', ['thumb']), put(storage, 'proxy.jpg')
+    gc.record_upload('s1', original, proxy)
+    old = put(storage, 'old.jpg', ['thumb'])
+    gc.record_current('s1', old)
+    current = put(storage, 'current.jpg', ['thumb'])
+    gc.record_current('s1', current)
+
+    report = gc.collect()
+    assert report['deleted'] == {'superseded': 2}
+    assert not stored(storage, old['path'])
+    assert not stored(storage, old['variants']['thumb']['path'])
+    for result in (original, proxy, current):
+        assert stored(storage, result['path'])
+    assert stored(storage, original['variants']['thumb']['path'])
+    assert stored(storage, current['variants']['thumb']['path'])
+
+def test_history_renders_are_pinned(storage, tmp_path):
+    gc = manager(storage, tmp_path)
+    original = put(storage, 'original.jpg')
+    gc.record_upload('s1', original)
+    with gc.session_record('s1') as record:
+        history.start(record, original)
+    renders = []
+    for i in range(3):
+        result = put(storage, f'step{i}.jpg', ['thumb'])
+        renders.append(result)
+        gc.record_current('s1', result)
+        with gc.session_record('s1') as record:
+            history.push(record, [['brightness', {'factor': 1.1 + i / 10}]], result)
+    # Undo twice: the first render is current, the later ones stay for redo
+    with gc.session_record('s1') as record:
+        history.move(record, -1)
+        history.move(record, -1)
+    gc.record_current('s1', renders[0])
+
+    gc.collect()
+    for result in renders:
+        assert stored(storage, result['path'])
+        assert stored(storage, result['variants']['thumb']['path'])
+
+def test_grace_period_and_result_cache_keep_recent_files(storage, tmp_path):
+    invalidated = []
+    cached = put(storage, 'cached.jpg')
+    gc = manager(storage, tmp_path, cached_paths=lambda: {cached['path']}, invalidate=invalidated.append)
+    gc.record_upload('s1', put(storage, 'original.jpg'))
+    old = put(storage, 'old.jpg')
+    for result in (cached, old, put(storage, 'current.jpg')):
+        gc.record_current('s1', result)
+    gc.collect()
+    assert stored(storage, cached['path'])
+    assert not stored(storage, old['path'])
+    assert invalidated == [old['path']]
+
+    young = manager(storage, tmp_path, grace_seconds=3600)
+    recent = put(storage, 'recent.jpg')
+    young.record_current('s1', recent)
+    young.record_current('s1', put(storage, 'newest.jpg'))
+    young.collect()
+    assert stored(storage, recent['path'])
+
+def test_expired_sessions_are_collected_except_shared_protected_paths(storage, tmp_path):
+    gc = manager(storage, tmp_path, session_ttl_seconds=60)
+    shared = put(storage, 'shared.jpg')
+    gone = put(storage, 'gone.jpg')
+    gc.record_upload('old', gone)
+    gc.record_current('old', shared)
+    gc.record_upload('live', shared)
+    with gc.session_record('old', touch=False) as record:
+        record['last_seen'] = time.time() - 3600
+
+    report = gc.collect()
+    assert report['expired_sessions'] == 1
+    assert not stored(storage, gone['path'])
+    assert stored(storage, shared['path'])
+    assert not os.path.exists(gc._session_path('old'))
+
+def test_orphans_and_quota_spare_protected_local_files(storage, tmp_path):
+    local = storage.fallback
+    gc = manager(storage, tmp_path, quota_mb=2500 / (1024 * 1024))
+    original = local.put(b'o' * 1000, 'original.jpg')
+    gc.record_upload('s1', original)
+    orphan = local.put(b'x' * 1000, 'orphan.jpg')
+    tracked = local.put(b't' * 1000, 'tracked.jpg')
+    gc.record_current('s1', dict(tracked, bytes=1000))
+    current = local.put(b'c' * 1000, 'current.jpg')
+    gc.record_current('s1', dict(current, bytes=1000))
+    with gc.session_record('s1') as record:
+        # Keep the older version out of the superseded rule: only the quota can remove it
+        record['versions'][tracked['path']]['created'] = time.time() + 3600
+
+    report = gc.collect()
+    assert report['deleted'] == {'orphan': 1, 'quota': 1}
+    assert not os.path.exists(orphan['path'])
+    assert not os.path.exists(tracked['path'])
+    assert os.path.exists(original['path'])
+    assert os.path.exists(current['path'])
+
+def test_only_one_collection_runs_at_a_time(storage, tmp_path):
+    gc = manager(storage, tmp_path)
+    os.makedirs(gc.directory, exist_ok=True)
+    with _locked_file(os.path.join(gc.directory, 'gc.lock')):
+        assert gc.collect() is None
+    assert gc.collect() is not None
@@ -0,0 +1,106 @@
+"""Live preview stream: frames for posted values, superseded frames, limits and shared values."""
+import base64
+import io
+import json
+
+import pytest
+from conftest import jpeg_bytes, make_image
+from PIL import Image
+
+from utils import live_preview
+from utils.live_preview import LivePreviews, StreamLimitError
+from utils.tiling import apply_segment
+
+SOURCE = 'uploads/photo.jpg'
+
+def value(factor, source=SOURCE):
+    return {'stack': [['brightness', {'factor': factor}]], 'source': source, 'hash': 'photo', 'scale': 1.0}
+
+def events(stream):
+    """Parse the events of a stream generator as (name, data) pairs, skipping keepalives"""
+    for chunk in stream:
+        if chunk.startswith(':'):
+            continue
+        lines = dict(line.split(': ', 1) for line in chunk.strip().splitlines())
+        yield lines['event'], json.loads(lines['data'])
+
+@pytest.fixture
+def previews(tmp_path):
+    data = jpeg_bytes(make_image(800, 600))
+    return LivePreviews({SOURCE: data}.get, apply_segment, directory=str(tmp_path), long_edge=200,
+                        idle_seconds=1, max_streams=1)
+
+def test_posted_value_is_rendered_as_a_frame(previews):
+    previews.open()
+    stream = events(previews.stream('s1', SOURCE))
+    assert next(stream) == ('ready', {'long_edge': 200})
+    seq = previews.submit('s1', value(1.3))
+    name, frame = next(stream)
+    assert name == 'frame' and frame['seq'] == seq
+    img = Image.open(io.BytesIO(base64.b64decode(frame['image'].split(',', 1)[1])))
+    assert img.format == 'JPEG' and img.size == (frame['width'], frame['height']) == (200, 150)
+    # No further values: the stream ends once idle
+    assert next(stream) == ('idle', {})
+    previews.close()
+
+def test_value_posted_while_the_stream_opens_is_rendered(previews):
+    seq = previews.submit('s1', value(1.3))
+    stream = events(previews.stream('s1'))
+    next(stream)
+    assert next(stream)[1]['seq'] == seq
+
+def test_old_value_is_not_replayed(previews, monkeypatch):
+    monkeypatch.setattr(live_preview, 'STARTUP_WINDOW_SECONDS', 0)
+    previews.submit('s1', value(1.3))
+    stream = events(previews.stream('s1'))
+    next(stream)
+    assert next(stream) == ('idle', {})
+
+def test_superseded_frame_is_dropped(previews):
+    newer = []
+
+    def apply(img, operations):
+        # A newer value arrives while the first frame renders
+        if not newer:
+            newer.append(previews.submit('s1', value(0.7)))
+        return apply_segment(img, operations)
+
+    previews.apply = apply
+    previews.max_stall_seconds = 60
+    stream = events(previews.stream('s1', SOURCE))
+    next(stream)
+    previews.submit('s1', value(1.3))
+    name, frame = next(stream)
+    assert name == 'frame' and frame['seq'] == newer[0]
+
+def test_unreadable_source_reports_an_error(previews):
+    stream = events(previews.stream('s1'))
+    next(stream)
+    seq = previews.submit('s1', value(1.3, source='uploads/missing.jpg'))
+    assert next(stream) == ('error', {'seq': seq, 'error': 'Could not retrieve the image'})
+
+def test_streams_per_worker_are_limited(previews):
+    previews.open()
+    with pytest.raises(StreamLimitError):
+        previews.open()
+    assert previews.stats()['refused'] == 1
+    previews.close()
+    previews.open()
+    previews.close()
+
+def test_values_reach_a_stream_held_by_another_worker(previews, tmp_path):
+    other = LivePreviews(lambda path: None, apply_segment, directory=str(tmp_path))
+    stream = events(previews.stream('s1', SOURCE))
+    next(stream)
+    seq = other.submit('s1', value(1.3))
+    assert next(stream)[1]['seq'] == seq
+    assert other.latest('s1')['seq'] == seq
+
+def test_session_ids_are_checked(previews):
+    with pytest.raises(ValueError):
+        previews.submit('../etc', value(1.3))
+    assert previews.latest('s2') is None
+
+def test_routes_need_an_image(client):
+    assert client.post('/preview/live', json={'operation': 'brightness', 'params': {'factor': 1.2}}).status_code == 400
+    assert client.get('/preview/live/stream').status_code == 400
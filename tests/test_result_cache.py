@@ -0,0 +1,68 @@
+"""Content-addressed result cache: keys, expiry, eviction and invalidation."""
+from utils.result_cache import ResultCache, result_key
+
+STACK = [['brightness', {'factor': 1.2}], ['flip', {'direction': 'horizontal'}]]
+
+def stored(name, variants=None):
+    result = {'path': f'uploads/{name}', 'url': f'/storage/uploads/{name}', 'storage': 'memory', 'bytes': 100}
+    if variants:
+        result['variants'] = {variant: {'path': f'uploads/{name}_{variant}', 'url': '', 'width': 256}
+                              for variant in variants}
+    return result
+
+def test_key_depends_on_input_stack_format_and_pipeline():
+    key = result_key('abc', STACK, 'jpg')
+    assert key == result_key('abc', [['brightness', {'factor': '1.20'}], STACK[1]], 'jpg')
+    assert key != result_key('abd', STACK, 'jpg')
+    assert key != result_key('abc', STACK[:1], 'jpg')
+    assert key != result_key('abc', STACK, 'png')
+    # Batch results have no variants, so they never stand in for a render
+    assert key != result_key('abc', STACK, 'jpg', namespace='batch')
+
+def test_hit_returns_a_copy_with_the_stored_fields():
+    cache = ResultCache()
+    cache.put('k', dict(stored('a.jpg'), upload_seconds=0.1, preview=True))
+    hit = cache.get('k')
+    assert hit == stored('a.jpg')
+    hit['path'] = 'changed'
+    assert cache.get('k')['path'] == 'uploads/a.jpg'
+    assert cache.get('missing') is None
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
+
+def test_entries_expire():
+    cache = ResultCache(ttl_seconds=-1)
+    cache.put('k', stored('a.jpg'))
+    assert cache.get('k') is None
+    assert cache.stats()['expirations'] == 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', stored('a.jpg'))
+    cache.put('b', stored('b.jpg'))
+    cache.get('a')
+    cache.put('c', stored('c.jpg'))
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+
+def test_disabled_cache_stores_nothing():
+    cache = ResultCache(max_entries=0)
+    cache.put('k', stored('a.jpg'))
+    assert cache.get('k') is None
+
+def test_missing_local_file_is_a_miss(tmp_path):
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(b'data')
+    cache = ResultCache()
+    cache.put('k', {'path': str(path), 'url': '/static/uploads/a.jpg', 'storage': 'local', 'bytes': 4})
+    assert cache.get('k')
+    path.unlink()
+    assert cache.get('k') is None
+
+def test_invalidating_a_variant_drops_its_result():
+    cache = ResultCache()
+    cache.put('k', stored('a.jpg', variants=['thumb']))
+    cache.put('other', stored('b.jpg'))
+    assert cache.paths() == {'uploads/a.jpg', 'uploads/a.jpg_thumb', 'uploads/b.jpg'}
+    assert cache.invalidate_path('uploads/a.jpg_thumb') == 1
+    assert cache.get('k') is None
+    assert cache.get('other')
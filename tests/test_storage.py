@@ -0,0 +1,97 @@
+"""Storage backends: round trips, routing by path, the local fallback and background publishing."""
+import pytest
+
+from utils.fake_gcs import FakeClient
+from utils.storage import GCSBackend, LocalBackend, MemoryBackend, Storage, is_object_path
+from utils.storage_uploader import StorageUploader
+
+class FailingBackend(MemoryBackend):
+    def put(self, data, filename):
+        raise ConnectionError('bucket unreachable')
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalBackend(str(tmp_path / 'public'), '/static/uploads/')
+
+def gcs_backend(tmp_path):
+    bucket = FakeClient().bucket('test-bucket')
+    return GCSBackend(StorageUploader(bucket, 'test-bucket', str(tmp_path / 'public'), '/static/uploads/',
+                                      async_publish=False))
+
+@pytest.mark.parametrize('primary', ['memory', 'local', 'gcs'])
+def test_round_trip(primary, local, tmp_path):
+    backend = {'memory': MemoryBackend(), 'local': local, 'gcs': gcs_backend(tmp_path)}[primary]
+    storage = Storage(backend, local)
+    stored = storage.put(b'image bytes', 'a.jpg')
+    assert stored['storage'] == primary
+    assert stored['bytes'] == len(b'image bytes')
+    assert storage.owns(stored['path'])
+    assert storage.get(stored['path']) == b'image bytes'
+    with storage.open(stored['path']) as f:
+        assert f.read() == b'image bytes'
+    assert storage.url(stored['path']) == stored['url']
+
+    storage.delete_many([stored['path'], stored['path']])
+    assert storage.get(stored['path']) is None
+
+def test_paths_route_to_the_backend_that_stored_them(local):
+    memory = MemoryBackend()
+    storage = Storage(memory, local)
+    remote = storage.put(b'remote', 'a.jpg')
+    fallback = local.put(b'local', 'b.jpg')
+    assert storage.backend_for(remote['path']) is memory
+    assert storage.backend_for(fallback['path']) is local
+    assert storage.backend_for('/etc/passwd') is None
+    with pytest.raises(ValueError):
+        storage.url('/etc/passwd')
+
+def test_failed_upload_falls_back_to_local(local):
+    storage = Storage(FailingBackend(), local)
+    stored = storage.put(b'data', 'a.jpg')
+    assert stored['storage'] == 'local'
+    assert storage.get(stored['path']) == b'data'
+
+def test_unconfigured_primary_writes_locally(local):
+    storage = Storage(None, local)
+    assert storage.name == 'local'
+    assert storage.put(b'data', 'a.jpg')['storage'] == 'local'
+
+def test_paths_cannot_climb_out(local, tmp_path):
+    assert is_object_path('uploads/a.jpg')
+    assert not is_object_path('uploads/../secret')
+    assert not is_object_path('other/a.jpg')
+    assert not local.owns(str(tmp_path / 'public' / '..' / 'secret'))
+
+def test_background_publishing_is_seen_by_every_worker(tmp_path, monkeypatch):
+    bucket = FakeClient().bucket('test-bucket')
+    attempts = []
+
+    def flaky_write(name, data, public):
+        attempts.append(name)
+        raise ConnectionError('bucket unreachable')
+
+    monkeypatch.setattr(bucket, '_write', flaky_write)
+
+    def uploader():
+        return StorageUploader(bucket, 'test-bucket', str(tmp_path / 'public'), '/static/uploads/',
+                               async_publish=True, retries=2, retry_seconds=0)
+
+    # Two uploaders stand in for two web worker processes sharing the public folder
+    writer, reader = uploader(), uploader()
+    stored = GCSBackend(writer).put(b'image bytes', 'a.jpg')
+    writer._executor.shutdown(wait=True)
+    assert len(attempts) == 3
+    assert writer.stats()['pending'] == 0 and writer.stats()['abandoned'] == 1
+
+    # The upload was given up on: every worker keeps serving the local copy
+    other = GCSBackend(reader)
+    assert other.get(stored['path']) == b'image bytes'
+    assert other.url(stored['path']) == '/static/uploads/a.jpg'
+
+    monkeypatch.undo()
+    writer = uploader()
+    GCSBackend(writer).put(b'new bytes', 'b.jpg')
+    writer._executor.shutdown(wait=True)
+    assert other.url('uploads/b.jpg') == 'https://storage.googleapis.com/test-bucket/uploads/b.jpg'
+    other.delete('uploads/b.jpg')
+    assert reader.local_copy_path('uploads/b.jpg') is None
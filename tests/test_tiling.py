@@ -0,0 +1,59 @@
+"""Strip-wise processing must produce the same pixels as processing the whole image."""
+import pytest
+from conftest import make_image, max_difference
+
+from utils.color_engine import apply_color_chain
+from utils.image_processing import apply_operation
+from utils.tiling import WORKING_BYTES_PER_PIXEL, apply_tiled, halo_rows, is_tileable, strip_height
+
+WIDTH, HEIGHT = 400, 300
+
+# A working-memory ceiling that splits the test image into strips of about 40 rows
+def ceiling(operation, params=None):
+    per_pixel = WORKING_BYTES_PER_PIXEL[operation]
+    return WIDTH * per_pixel * (40 + 2 * halo_rows(operation, params))
+
+SINGLE = [
+    ['blur', {'amount': 3}],
+    ['blur', {'amount': 8}],
+    ['sharpen', {'amount': 2}],
+    ['enhance', {}],
+    ['bw', {}],
+    ['brightness', {'factor': 1.3}],
+    ['hue', {'factor': 40}],
+    ['vibrance', {'factor': 1.5}],
+    ['filter', {'type': 'sepia', 'intensity': 80}],
+]
+
+@pytest.mark.parametrize('operation,params', SINGLE, ids=lambda value: value if isinstance(value, str) else '')
+def test_single_operation_matches_untiled(operation, params):
+    img = make_image(WIDTH, HEIGHT)
+    memory = ceiling(operation, params)
+    assert strip_height(WIDTH, WORKING_BYTES_PER_PIXEL[operation], halo_rows(operation, params), memory) < HEIGHT
+    tiled = apply_tiled(img, [[operation, params]], fused=False, memory_bytes=memory)
+    assert max_difference(tiled, apply_operation(img, operation, params)) == 0
+
+@pytest.mark.parametrize('operations', [
+    [['brightness', {'factor': 1.1}], ['contrast', {'factor': 1.3}], ['hue', {'factor': 20}]],
+    [['contrast', {'factor': 1.5}]],
+    [['filter', {'type': 'high_contrast', 'intensity': 80}]],
+], ids=['chain', 'contrast', 'high_contrast'])
+def test_colour_chain_matches_untiled(operations):
+    # Contrast pivots on the mean of the whole image, not of each strip
+    img = make_image(WIDTH, HEIGHT)
+    tiled = apply_tiled(img, operations, memory_bytes=ceiling('fused'))
+    assert max_difference(tiled, apply_color_chain(img, operations)) == 0
+
+def test_rgba_strips_keep_alpha():
+    img = make_image(WIDTH, HEIGHT, mode='RGBA')
+    operations = [['blur', {'amount': 2}]]
+    tiled = apply_tiled(img, operations, fused=False, memory_bytes=ceiling('blur', {'amount': 2}))
+    assert max_difference(tiled, apply_operation(img, 'blur', {'amount': 2})) == 0
+
+def test_only_supported_segments_tile():
+    assert is_tileable([['brightness', {}], ['saturation', {}]])
+    assert is_tileable([['blur', {'amount': 2}]])
+    assert not is_tileable([['blur', {'amount': 2}], ['sharpen', {}]])
+    assert not is_tileable([['flip', {'direction': 'horizontal'}]])
+    with pytest.raises(ValueError):
+        apply_tiled(make_image(), [['rotate', {'angle': 90}]])
@@ -0,0 +1,56 @@
+"""Responsive variants: which sizes are made, their dimensions, srcset and stored paths."""
+import io
+
+from conftest import make_image, upload
+from PIL import Image
+
+from utils.executor import ImageExecutor
+from utils.variants import encode_result, encode_variants, parse_variants, srcset, variant_paths
+
+VARIANTS = [('display', 1024), ('thumb', 256)]
+
+def test_spec_is_parsed_widest_first():
+    assert parse_variants('thumb:256, display:1024,') == VARIANTS
+    assert parse_variants('') == []
+
+def test_variants_are_encoded_alongside_the_full_size():
+    img = make_image(2000, 1500)
+    full, encoded = encode_variants(img, 'jpg', lambda: 'full', variants=VARIANTS)
+    assert full == 'full'
+    assert [(variant['name'], variant['width'], variant['height']) for variant in encoded] == \
+        [('display', 1024, 768), ('thumb', 256, 192)]
+    for variant in encoded:
+        decoded = Image.open(io.BytesIO(variant['data']))
+        assert decoded.format == 'JPEG' and decoded.size == (variant['width'], variant['height'])
+
+def test_sizes_close_to_the_full_width_are_skipped():
+    # 1024 px is above MAX_VARIANT_RATIO of a 1280 px preview
+    _, encoded = encode_variants(make_image(1280, 960), 'png', lambda: None, variants=VARIANTS)
+    assert [variant['name'] for variant in encoded] == ['thumb']
+    _, encoded = encode_variants(make_image(300, 200), 'png', lambda: None, variants=VARIANTS)
+    assert encoded == []
+
+def test_srcset_and_paths():
+    variants = {
+        'full': {'path': 'uploads/a.jpg', 'url': '/a.jpg', 'width': 2000},
+        'thumb': {'path': 'uploads/a_thumb.jpg', 'url': '/a_thumb.jpg', 'width': 256},
+        'display': {'path': 'uploads/a_display.jpg', 'url': '/a_display.jpg', 'width': 1024},
+    }
+    assert srcset(variants) == '/a_thumb.jpg 256w, /a_display.jpg 1024w, /a.jpg 2000w'
+    assert sorted(variant_paths({'path': 'uploads/a.jpg', 'variants': variants})) == \
+        ['uploads/a_display.jpg', 'uploads/a_thumb.jpg']
+    assert variant_paths({'path': 'uploads/a.jpg'}) == []
+
+def test_upload_and_process_return_a_srcset(client):
+    uploaded = upload(client, make_image(2000, 1500))
+    assert uploaded['srcset'].count('w,') == 2
+    processed = client.post('/process', json={'operation': 'brightness', 'params': {'factor': 1.2}}).get_json()
+    # The 1280 px preview only gets a thumbnail next to it
+    urls = [entry.split()[0] for entry in processed['srcset'].split(', ')]
+    assert len(urls) == 2 and urls[-1] == processed['url']
+    assert client.get(urls[0]).status_code == 200
+
+def test_encode_in_a_worker_process_matches_inline():
+    img = make_image(1600, 1200)
+    options = {'target_bytes': 30000}
+    assert ImageExecutor(workers=1).encode(img, 'jpg', options, 'final') == encode_result(img, 'jpg', options, 'final')
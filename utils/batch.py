@@ -0,0 +1,172 @@
+"""
+Batch execution of one recipe over many images on a process pool.
+
+Decoding, processing and encoding happen in worker processes so a batch
+uses every core instead of one GIL-bound thread; storage stays in the web
+worker, which uploads each encoded result as it comes back. Items are
+independent: a failing image is reported as failed and the rest of the batch
+carries on.
+
+Worker processes are started with BATCH_START_METHOD ('spawn' by default, so
+they do not inherit the web worker's threads and client connections) and
+are kept for later batches. Each worker has its own rembg sessions and mask
+cache memory tier; the mask cache disk tier is shared.
+
+Configuration (environment variables):
+    BATCH_WORKERS        worker processes (default: CPU count)
+    BATCH_MAX_ITEMS      images accepted per batch (default 100)
+    BATCH_START_METHOD   multiprocessing start method (default spawn)
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.edit_stack import normalize_params, render_once, stack_encode_options
+from utils.image_processing import OPERATIONS, encode_image
+
+logger = logging.getLogger(__name__)
+
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 100))
+BATCH_START_METHOD = os.environ.get('BATCH_START_METHOD', 'spawn')
+
+def parse_recipe(recipe):
+    """
+    Turn a batch recipe into an edit stack
+
+    Args:
+        recipe: {'operation': name, 'params': {...}} for a single operation,
+            or {'steps': [[name, params], ...]} (steps may also be
+            {'operation': ..., 'params': ...} objects)
+
+    Returns:
+        List of [operation, params] pairs
+
+    Raises:
+        ValueError: if the recipe is malformed or names an unknown operation
+    """
+    if not isinstance(recipe, dict):
+        raise ValueError('Recipe must be an object')
+    if 'steps' in recipe:
+        steps = recipe['steps']
+    else:
+        steps = [[recipe.get('operation'), recipe.get('params') or {}]]
+    if not isinstance(steps, list) or not steps:
+        raise ValueError('Recipe needs at least one step')
+
+    stack = []
+    for step in steps:
+        if isinstance(step, dict):
+            operation, params = step.get('operation'), step.get('params') or {}
+        elif isinstance(step, (list, tuple)) and len(step) == 2:
+            operation, params = step
+        else:
+            raise ValueError(f'Malformed recipe step: {step!r}')
+        if operation not in OPERATIONS:
+            raise ValueError(f'Unknown operation: {operation}')
+        if not isinstance(params, dict):
+            raise ValueError(f'Parameters for {operation} must be an object')
+        stack.append([operation, normalize_params(params)])
+    return stack
+
+def render_recipe(data, stack, output_ext):
+    """
+    Decode, render and encode one image (runs in a worker process)
+
+    Args:
+        data: Encoded input image bytes
+        stack: List of [operation, params] pairs
+        output_ext: Extension to encode as
+
+    Returns:
+        Tuple of (encoded bytes, seconds spent)
+    """
+    start = time.perf_counter()
+    img = render_once(data, stack)
+    output = encode_image(img, output_ext, **stack_encode_options(stack))
+    return output, time.perf_counter() - start
+
+class BatchRunner:
+    """
+    Lazily started process pool shared by all batches of a web worker
+    """
+
+    def __init__(self, workers=BATCH_WORKERS, start_method=BATCH_START_METHOD):
+        self.workers = max(1, workers)
+        self.start_method = start_method
+        self._executor = None
+        self._lock = threading.Lock()
+        self.items = 0
+        self.failures = 0
+        self.restarts = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                logger.info(f"Started batch pool with {self.workers} {self.start_method} workers")
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, items, stack):
+        """
+        Render items in parallel, yielding each outcome as soon as it is ready
+
+        Args:
+            items: List of (item, data, output_ext); item is an opaque value
+                handed back with the outcome
+            stack: List of [operation, params] pairs
+
+        Yields:
+            Tuples of (item, encoded bytes or None, error message or None, seconds)
+        """
+        if not items:
+            return
+        executor = self._get_executor()
+        futures = {}
+        for item, data, output_ext in items:
+            futures[executor.submit(render_recipe, data, stack, output_ext)] = item
+
+        for future in as_completed(futures):
+            item = futures[future]
+            with self._lock:
+                self.items += 1
+            try:
+                output, seconds = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); later batches get a fresh pool
+                self._discard_executor(executor)
+                with self._lock:
+                    self.failures += 1
+                yield item, None, 'Worker process died while processing this image', None
+                continue
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                yield item, None, str(e), None
+                continue
+            yield item, output, None, seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'start_method': self.start_method,
+                'running': self._executor is not None,
+                'items': self.items,
+                'failures': self.failures,
+                'restarts': self.restarts,
+            }
+
+batch_runner = BatchRunner()
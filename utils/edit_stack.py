@@ -0,0 +1,361 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from utils.color_engine import FUSABLE_OPERATIONS
+from utils.image_processing import (
+    OPERATIONS,
+    apply_operation,
+    decode_image,
+    get_appropriate_extension,
+    get_encode_options,
+    open_image,
+)
+from utils.metrics import annotate, cache_lookup, size_bucket, stage
+from utils.tiling import apply_segment, apply_tiled, should_tile
+
+logger = logging.getLogger(__name__)
+
+# Operations driven by a slider or option picker: touching the same control again
+# replaces its previous value instead of stacking another pass on top of it
+ADJUSTABLE_OPERATIONS = {
+    'brightness', 'contrast', 'saturation', 'hue', 'vibrance',
+    'blur', 'sharpen', 'compress', 'filter', 'remove_background',
+}
+
+# Memory budget for cached intermediate renders (per worker process)
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+def normalize_params(params):
+    """
+    Normalize operation parameters so equivalent requests compare equal
+
+    The editor sends slider values as strings ("1.50"); numeric strings are
+    converted to floats so "1.5", "1.50" and 1.5 all produce the same key.
+
+    Args:
+        params: Dictionary of operation parameters (may be None)
+
+    Returns:
+        New dictionary with normalized values
+    """
+    normalized = {}
+    for key, value in (params or {}).items():
+        if isinstance(value, bool) or value is None:
+            normalized[key] = value
+        elif isinstance(value, (int, float)):
+            normalized[key] = float(value)
+        elif isinstance(value, str):
+            try:
+                normalized[key] = float(value)
+            except ValueError:
+                normalized[key] = value.strip().lower()
+        else:
+            normalized[key] = value
+    return normalized
+
+def push_operation(stack, operation, params=None):
+    """
+    Add an operation to an edit stack
+
+    Args:
+        stack: List of [operation, params] pairs, oldest first
+        operation: Operation name
+        params: Dictionary of operation parameters
+
+    Returns:
+        New stack list; the input stack is not modified
+    """
+    entry = [operation, params or {}]
+    if stack and stack[-1][0] == operation and operation in ADJUSTABLE_OPERATIONS:
+        # Same control touched again: only the last stage changes
+        return list(stack[:-1]) + [entry]
+    return list(stack) + [entry]
+
+def derive_key(parent_key, operation, params=None):
+    """
+    Content key for the result of applying one operation to a keyed input
+
+    Args:
+        parent_key: Key of the input image
+        operation: Operation name
+        params: Dictionary of operation parameters
+
+    Returns:
+        Hex digest identifying the output image
+    """
+    payload = json.dumps([parent_key, operation, normalize_params(params)], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def prefix_keys(source_key, stack):
+    """
+    Keys for every prefix of an edit stack
+
+    Args:
+        source_key: Key identifying the original image
+        stack: List of [operation, params] pairs
+
+    Returns:
+        List of len(stack) + 1 keys; index 0 is the original, index i is the
+        result after the first i operations
+    """
+    keys = [source_key]
+    for operation, params in stack:
+        keys.append(derive_key(keys[-1], operation, params))
+    return keys
+
+def stack_encode_options(stack, preview=False):
+    """
+    Encoder settings implied by the operations in a stack (later ones win)
+
+    Args:
+        stack: List of [operation, params] pairs
+        preview: The stack renders a preview proxy; a compress byte budget
+            only applies to the full-resolution file, so it is left out
+
+    Returns:
+        Dictionary of keyword arguments for encode_image
+    """
+    options = {}
+    for operation, params in stack:
+        options.update(get_encode_options(operation, params))
+    if preview and options.get('target_bytes'):
+        options = {'quality': options['quality'], 'target_bytes': None}
+    return options
+
+def stack_extension(stack, source_name):
+    """
+    Output extension for a rendered stack
+
+    Args:
+        stack: List of [operation, params] pairs
+        source_name: File name of the original image
+
+    Returns:
+        String with appropriate extension (without dot) or None
+    """
+    for operation, _ in stack:
+        ext = get_appropriate_extension(operation)
+        if ext:
+            return ext
+    return get_appropriate_extension(None, source_name)
+
+def _image_size_bytes(img):
+    bands = len(img.getbands())
+    return img.width * img.height * bands
+
+class RenderCache:
+    """
+    Size-bounded LRU cache of decoded intermediate renders keyed by stack prefix
+
+    The same image object can sit under several keys (an operation that
+    returns its input unchanged); its bytes are counted once.
+    """
+
+    def __init__(self, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        # id() of each cached image -> number of keys holding it
+        self._refs = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            img = self._entries.get(key)
+            if img is None:
+                self.misses += 1
+                cache_lookup('render', 'miss')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            cache_lookup('render', 'hit')
+            return img
+
+    def longest_prefix(self, keys):
+        """
+        Find the longest cached prefix among a list of prefix keys
+
+        Args:
+            keys: Prefix keys as returned by prefix_keys
+
+        Returns:
+            Tuple of (prefix length, PIL Image), or (0, None) if nothing is cached
+        """
+        with self._lock:
+            for i in range(len(keys) - 1, -1, -1):
+                img = self._entries.get(keys[i])
+                if img is not None:
+                    self._entries.move_to_end(keys[i])
+                    self.hits += 1
+                    cache_lookup('render', 'hit')
+                    return i, img
+            self.misses += 1
+            cache_lookup('render', 'miss')
+            return 0, None
+
+    def put(self, key, img):
+        size = _image_size_bytes(img)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = img
+            self._add_ref(img, size)
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._drop_ref(evicted)
+
+    def _add_ref(self, img, size):
+        refs = self._refs.get(id(img), 0)
+        if not refs:
+            self.current_bytes += size
+        self._refs[id(img)] = refs + 1
+
+    def _drop_ref(self, img):
+        refs = self._refs.pop(id(img)) - 1
+        if refs:
+            self._refs[id(img)] = refs
+        else:
+            self.current_bytes -= _image_size_bytes(img)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._refs.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+render_cache = RenderCache()
+
+def segment_boundaries(stack):
+    """
+    Split a stack into render segments
+
+    Consecutive colour operations form one segment that the fused colour
+    engine renders in a single pass; every other operation is its own
+    segment. Boundaries depend only on the stack, so a given stack always
+    renders the same way regardless of what is cached.
+
+    Args:
+        stack: List of [operation, params] pairs
+
+    Returns:
+        Sorted list of prefix lengths, starting with 0 and ending with len(stack)
+    """
+    boundaries = [0]
+    for i, (operation, _) in enumerate(stack):
+        fusable = operation in FUSABLE_OPERATIONS
+        previous_fusable = i > 0 and stack[i - 1][0] in FUSABLE_OPERATIONS
+        if i > 0 and not (fusable and previous_fusable):
+            boundaries.append(i)
+    if stack:
+        boundaries.append(len(stack))
+    return boundaries
+
+def operation_label(operation):
+    """Metrics label of an operation name; unknown names share one label"""
+    return operation if operation in OPERATIONS else 'unknown'
+
+def segment_label(operations):
+    """Metrics label of a render segment: its operation, or 'color_chain' for fused colour operations"""
+    return operation_label(operations[0][0]) if len(operations) == 1 else 'color_chain'
+
+def render_stack(source_key, load_original, stack, cache=render_cache, apply=apply_segment):
+    """
+    Render an edit stack from the original image, reusing cached prefixes
+
+    Only the segments after the longest cached prefix are recomputed, so
+    adjusting the most recently used slider costs a single stage (or a
+    single fused colour pass).
+
+    Args:
+        source_key: Key identifying the original image (e.g. its storage path)
+        load_original: Callable returning the original image (path, bytes or PIL Image)
+        stack: List of [operation, params] pairs
+        cache: RenderCache holding intermediate results
+        apply: Callable applying one segment to an image, e.g. to run it in
+            another process (utils.executor)
+
+    Returns:
+        Rendered PIL Image object
+    """
+    keys = prefix_keys(source_key, stack)
+    boundaries = segment_boundaries(stack)
+
+    # Find the longest segment-aligned prefix that is already rendered
+    found, img = cache.longest_prefix([keys[i] for i in boundaries])
+    start = boundaries[found]
+    if img is None:
+        with stage('decode'):
+            img = open_image(load_original())
+            img.load()
+        cache.put(keys[0], img)
+    annotate(size=size_bucket(img.size))
+
+    logger.debug(f"Rendering stack of {len(stack)} operations, recomputing {len(stack) - start}")
+
+    # Recompute only the segments after the cached prefix
+    for begin, end in zip(boundaries, boundaries[1:]):
+        if begin < start:
+            continue
+        # Large images are processed in strips where the segment allows it
+        with stage('operation', segment_label(stack[begin:end])):
+            img = apply(img, stack[begin:end])
+            img.load()
+        cache.put(keys[end], img)
+
+    return img
+
+def render_once(source, stack):
+    """
+    Render a stack on an image outside any session, without caching
+
+    A single operation runs through its regular function (tiled for large
+    images), exactly as /process applies it to a stored file; longer stacks
+    are rendered segment by segment like render_stack.
+
+    Args:
+        source: Path to input image, raw bytes or PIL Image object
+        stack: List of [operation, params] pairs
+
+    Returns:
+        Rendered PIL Image object
+    """
+    with stage('decode'):
+        decoded = decode_image(source)
+        img = decoded.image
+        # A resize decodes inside the operation, at reduced scale where it can
+        if stack[0][0] != 'resize':
+            img.load()
+    annotate(size=size_bucket(img.size))
+    if len(stack) == 1:
+        operation, params = stack[0]
+        with stage('operation', operation_label(operation)):
+            if should_tile(img, stack):
+                # Strip-wise processing keeps very large images under the memory ceiling
+                return apply_tiled(img, stack, fused=False)
+            # The decoded image keeps its encoded bytes, so e.g. mask caching can key on them
+            return apply_operation(decoded, operation, params)
+
+    boundaries = segment_boundaries(stack)
+    for begin, end in zip(boundaries, boundaries[1:]):
+        with stage('operation', segment_label(stack[begin:end])):
+            img = apply_segment(img, stack[begin:end])
+    return img
@@ -0,0 +1,444 @@
+"""
+Process pool for CPU-bound image work, outside the web worker's threads.
+
+Pillow, OpenCV and rembg work is handed to a small pool of long-lived worker
+processes, so a slow operation occupies a worker process instead of the
+gunicorn worker: request threads stay free for uploads, storage, job polls
+and light endpoints such as /health.
+
+Workers are forked from a fork server that has already imported NumPy,
+OpenCV and Pillow (EXECUTOR_PRELOAD), and each worker imports the image
+modules and rembg when it starts, before it takes a task; no request pays for
+imports. rembg is not preloaded in the fork server: onnxruntime starts threads
+when imported, and a process with threads must not be forked. Each worker
+runs one task at a time. Workers run at a lower CPU priority (EXECUTOR_NICE)
+so request threads still get a core when every core is busy with image work.
+
+Two kinds of task run in the workers: render segments (apply_segment) and
+the encode of a finished render with its responsive variants (encode),
+including the quality search for a byte budget and the 'final' optimize
+pass. Decoding the original stays in the web worker: it happens once per
+upload, and the decoded image and intermediate renders are kept in the web
+worker's RenderCache (utils/edit_stack.py) for the next edit. Only the
+decode of an original that is not cached runs on a request thread
+(benchmarks/bench_request_thread.py measures it next to the work the
+workers take over).
+
+Data crosses the process boundary in shared memory, not pickled through the
+pipe. Only the names and small metadata go through the pipe:
+- decoded images travel as raw pixel buffers, which the worker maps
+  zero-copy with Image.frombuffer (L, RGBA and similar modes)
+- encoded files come back as their bytes, one block per task
+Replies also carry the task's peak memory, its decode and conversion counts
+and its metric events (utils/metrics.py), credited to the calling thread.
+
+Every task has a timeout: EXECUTOR_TIMEOUT_SECONDS, or the per-operation
+value in EXECUTOR_OPERATION_TIMEOUTS for the slowest operation in the task.
+A worker that overruns is killed and replaced, and the caller gets
+OperationTimeoutError. A worker that dies (e.g. killed for memory) is
+replaced as well. A task that rejects its parameters raises ValueError in
+the caller, as it would inline; other task errors raise RuntimeError.
+
+With EXECUTOR_WORKERS=0 everything runs inline in the calling thread.
+
+Configuration (environment variables):
+    EXECUTOR_WORKERS             worker processes per web worker (default CPU count, 0 runs inline)
+    EXECUTOR_START_METHOD        forkserver (default) or spawn
+    EXECUTOR_PRELOAD             comma-separated modules imported before workers are forked
+    EXECUTOR_TIMEOUT_SECONDS     default task timeout (default 60)
+    EXECUTOR_OPERATION_TIMEOUTS  per-operation timeouts, e.g. "remove_background:180,enhance:90"
+                                 ("encode" sets the timeout of encode tasks)
+    EXECUTOR_WAIT_SECONDS        how long a request waits for a free worker (default 30)
+    EXECUTOR_NICE                niceness added to worker processes (default 10, 0 keeps the web worker's)
+"""
+import gc
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from utils.image_processing import ImageWork, load_rembg, record_image_work
+from utils.memory import PeakMemory
+from utils.metrics import Capture, replay
+from utils.profiling import current_profile, profile_task
+from utils.tiling import apply_segment
+from utils.timing import TimingStats
+from utils.variants import encode_result
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_WORKERS = int(os.environ.get('EXECUTOR_WORKERS', os.cpu_count() or 1))
+EXECUTOR_START_METHOD = os.environ.get('EXECUTOR_START_METHOD', 'forkserver')
+EXECUTOR_PRELOAD = [name for name in os.environ.get(
+    'EXECUTOR_PRELOAD',
+    'numpy,cv2,PIL.Image'
+).split(',') if name]
+EXECUTOR_TIMEOUT_SECONDS = float(os.environ.get('EXECUTOR_TIMEOUT_SECONDS', 60))
+EXECUTOR_WAIT_SECONDS = float(os.environ.get('EXECUTOR_WAIT_SECONDS', 30))
+EXECUTOR_NICE = int(os.environ.get('EXECUTOR_NICE', 10))
+
+def _parse_timeouts(value):
+    timeouts = {}
+    for entry in value.split(','):
+        if ':' in entry:
+            operation, seconds = entry.split(':', 1)
+            timeouts[operation.strip()] = float(seconds)
+    return timeouts
+
+EXECUTOR_OPERATION_TIMEOUTS = _parse_timeouts(
+    os.environ.get('EXECUTOR_OPERATION_TIMEOUTS', 'remove_background:180'))
+
+# Image.info entries that travel with transferred pixels
+TRANSFER_INFO_KEYS = ('transparency', 'icc_profile', 'exif', 'dpi')
+
+# Rows are copied into shared memory in chunks of about this size
+TRANSFER_CHUNK_BYTES = 4 * 1024 * 1024
+
+class OperationTimeoutError(Exception):
+    """Raised when a task runs longer than its timeout"""
+
+class ExecutorBusyError(Exception):
+    """Raised when no worker becomes free within EXECUTOR_WAIT_SECONDS"""
+
+class WorkerCrashedError(Exception):
+    """Raised when a worker process dies while running a task"""
+
+def operation_timeout(operations):
+    """
+    Timeout for a task running a list of operations
+
+    Args:
+        operations: List of [operation, params] pairs
+
+    Returns:
+        Seconds allowed for the slowest operation in the list
+    """
+    return max(EXECUTOR_OPERATION_TIMEOUTS.get(operation, EXECUTOR_TIMEOUT_SECONDS)
+               for operation, _ in operations)
+
+def _close(shm, unlink=False):
+    try:
+        shm.close()
+    except BufferError:
+        # An image still maps the buffer; drop it and try again
+        gc.collect()
+        try:
+            shm.close()
+        except BufferError:
+            logger.debug(f"Shared memory {shm.name} is still mapped, leaving it to be released later")
+    if unlink:
+        shm.unlink()
+
+def _share_image(img):
+    """
+    Copy an image's pixels into a new shared memory block
+
+    Returns:
+        Tuple of (SharedMemory, metadata needed to rebuild the image)
+    """
+    img.load()
+    row_bytes = len(img.crop((0, 0, img.width, 1)).tobytes())
+    shm = shared_memory.SharedMemory(create=True, size=max(1, row_bytes * img.height))
+    # Copy a band of rows at a time so no full-size temporary is made
+    rows = max(1, TRANSFER_CHUNK_BYTES // max(1, row_bytes))
+    offset = 0
+    for top in range(0, img.height, rows):
+        chunk = img.crop((0, top, img.width, min(img.height, top + rows))).tobytes()
+        shm.buf[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    meta = {
+        'mode': img.mode,
+        'size': img.size,
+        'palette': img.getpalette(img.palette.mode) if img.mode == 'P' and img.palette else None,
+        'palette_mode': img.palette.mode if img.mode == 'P' and img.palette else None,
+        'info': {key: img.info[key] for key in TRANSFER_INFO_KEYS if key in img.info},
+    }
+    return shm, meta
+
+def _share_bytes(chunks):
+    """Copy byte strings one after another into a new shared memory block"""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, sum(len(chunk) for chunk in chunks)))
+    offset = 0
+    for chunk in chunks:
+        shm.buf[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    return shm
+
+def _mapped_image(shm, meta):
+    """Image over a shared memory block (zero-copy where Pillow can map the mode)"""
+    img = Image.frombuffer(meta['mode'], meta['size'], shm.buf, 'raw', meta['mode'], 0, 1)
+    if meta['palette']:
+        img.putpalette(meta['palette'], rawmode=meta['palette_mode'])
+    img.info.update(meta['info'])
+    return img
+
+def _run_task(kind, shm_name, meta, args):
+    """Run one task in a worker; returns (output shared memory name, output metadata)"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        if kind == 'segment':
+            result = apply_segment(_mapped_image(shm, meta), args['operations'])
+            result.load()
+            out, out_meta = _share_image(result)
+            del result
+        elif kind == 'encode':
+            img = _mapped_image(shm, meta)
+            (data, compression), encoded = encode_result(img, args['file_format'], args['encode_options'],
+                                                         args['encoder_profile'], args['variants'])
+            del img
+            chunks = [data] + [variant.pop('data') for variant in encoded]
+            out = _share_bytes(chunks)
+            out_meta = {'sizes': [len(chunk) for chunk in chunks], 'compression': compression,
+                        'variants': encoded}
+        else:
+            raise ValueError(f'Unknown task kind: {kind!r}')
+    finally:
+        _close(shm)
+    out_name = out.name
+    _close(out)
+    return out_name, out_meta
+
+def _worker_main(conn, niceness):
+    """Worker process loop: receive a task, run it, send the outcome"""
+    if niceness:
+        os.nice(niceness)
+    # Import rembg before the first task instead of during it
+    load_rembg()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        try:
+            with PeakMemory(trim=False) as memory, ImageWork() as work, Capture() as capture:
+                with profile_task(task[3].get('profile')):
+                    out_name, out_meta = _run_task(*task)
+            reply = ('ok', out_name, out_meta, memory.peak_bytes, dict(work.counts), capture.events)
+        except Exception as e:
+            reply = ('error', str(e), {'invalid': isinstance(e, ValueError)}, None, None, None)
+        conn.send(reply)
+
+class _Worker:
+    """A worker process and the parent's end of its pipe"""
+
+    def __init__(self, context, niceness):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, niceness),
+                                       name='image-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+class ImageExecutor:
+    """
+    Pre-forked worker processes shared by all request threads of a web worker
+    """
+
+    def __init__(self, workers=EXECUTOR_WORKERS, start_method=EXECUTOR_START_METHOD,
+                 preload=EXECUTOR_PRELOAD, wait_seconds=EXECUTOR_WAIT_SECONDS, niceness=EXECUTOR_NICE):
+        self.workers = max(0, workers)
+        self.start_method = start_method
+        self.preload = preload
+        self.wait_seconds = wait_seconds
+        self.niceness = niceness
+        self._context = None
+        self._idle = []
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self.tasks = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.busy_rejections = 0
+        self.wait_time = TimingStats()
+        self.task_time = TimingStats()
+
+    def start(self):
+        """Fork the worker processes (done on first use if not called earlier)"""
+        with self._cond:
+            if self._context is not None or not self.workers:
+                return
+            start = time.perf_counter()
+            context = multiprocessing.get_context(self.start_method)
+            if self.start_method == 'forkserver':
+                # Imported once in the fork server, inherited by every worker
+                context.set_forkserver_preload(self.preload)
+            self._idle = [_Worker(context, self.niceness) for _ in range(self.workers)]
+            self._context = context
+            self._cond.notify_all()
+        logger.info(f"Started {self.workers} {self.start_method} image workers "
+                    f"in {time.perf_counter() - start:.2f}s")
+
+    def _acquire(self):
+        self.start()
+        start = time.perf_counter()
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._idle, timeout=self.wait_seconds):
+                self.busy_rejections += 1
+                raise ExecutorBusyError('All image workers are busy, try again shortly')
+            self.wait_time.record(time.perf_counter() - start)
+            return self._idle.pop()
+
+    def _release(self, worker, replace=False):
+        if replace:
+            worker.kill()
+            worker = _Worker(self._context, self.niceness)
+        with self._cond:
+            self._idle.append(worker)
+            self._cond.notify()
+
+    def _call(self, kind, shm, meta, args, timeout):
+        """Send a task to a free worker and wait for its reply"""
+        profile = current_profile()
+        if profile is not None:
+            # The worker profiles the task too when the request is being profiled
+            args = dict(args, profile=profile.task_profile())
+        worker = self._acquire()
+        start = time.perf_counter()
+        replace = True
+        try:
+            try:
+                worker.conn.send((kind, shm.name, meta, args))
+                if not worker.conn.poll(timeout):
+                    with self._cond:
+                        self.timeouts += 1
+                    raise OperationTimeoutError(f'Operation timed out after {timeout:g}s')
+                status, value, out_meta, peak_bytes, work, events = worker.conn.recv()
+            except (EOFError, OSError):
+                with self._cond:
+                    self.crashes += 1
+                raise WorkerCrashedError('Image worker died while processing the image')
+            replace = False
+        finally:
+            worker.tasks += 1
+            self._release(worker, replace=replace)
+            with self._cond:
+                self.tasks += 1
+                self.task_time.record(time.perf_counter() - start)
+
+        self._record_peak(peak_bytes)
+        if work:
+            # Counted towards the calling thread, as if the work had run inline
+            record_image_work(work)
+        if events:
+            replay(events)
+        if status == 'error':
+            with self._cond:
+                self.failures += 1
+            # Bad parameters stay a ValueError, so callers can tell them from failures
+            raise (ValueError if out_meta['invalid'] else RuntimeError)(value)
+        return shared_memory.SharedMemory(name=value), out_meta
+
+    def _record_peak(self, peak_bytes):
+        if peak_bytes is not None:
+            self._local.peak_bytes = max(getattr(self._local, 'peak_bytes', 0) or 0, peak_bytes)
+
+    def take_peak_memory(self):
+        """
+        Highest worker peak memory seen by this thread's tasks since the last call
+
+        Returns:
+            Peak RSS rise in bytes, or None if no task reported one
+        """
+        peak = getattr(self._local, 'peak_bytes', None)
+        self._local.peak_bytes = None
+        return peak
+
+    def apply_segment(self, img, operations):
+        """
+        Apply a render segment in a worker process
+
+        Drop-in replacement for utils.tiling.apply_segment on a loaded image.
+
+        Args:
+            img: PIL Image object
+            operations: List of [operation, params] pairs: a colour chain or a single operation
+
+        Returns:
+            Processed PIL Image object
+        """
+        if not self.workers:
+            return apply_segment(img, operations)
+
+        shm, meta = _share_image(img)
+        try:
+            out, out_meta = self._call('segment', shm, meta, {'operations': operations},
+                                       operation_timeout(operations))
+        finally:
+            _close(shm, unlink=True)
+        try:
+            result = _mapped_image(out, out_meta)
+            # Own the pixels before the shared block goes away
+            result = result.copy() if result.readonly else result
+            result.load()
+        finally:
+            _close(out, unlink=True)
+        return result
+
+    def encode(self, img, file_format, encode_options, profile=None, variants=None):
+        """
+        Encode a result and its responsive variants in a worker process
+
+        Drop-in replacement for utils.variants.encode_result.
+
+        Args:
+            img: PIL Image object
+            file_format: Extension (without dot) to encode as
+            encode_options: Keyword arguments for encode_image (may hold 'target_bytes')
+            profile: Encoder profile of the full-size file
+            variants: List of (name, width) pairs (defaults to OUTPUT_VARIANTS, [] for none)
+
+        Returns:
+            Tuple of ((encoded bytes, byte budget report or None), list of
+            variant dicts with 'name', 'width', 'height' and 'data')
+        """
+        if not self.workers:
+            return encode_result(img, file_format, encode_options, profile, variants)
+
+        shm, meta = _share_image(img)
+        args = {'file_format': file_format, 'encode_options': encode_options,
+                'encoder_profile': profile, 'variants': variants}
+        try:
+            out, out_meta = self._call('encode', shm, meta, args, operation_timeout([['encode', None]]))
+        finally:
+            _close(shm, unlink=True)
+        try:
+            chunks, offset = [], 0
+            for size in out_meta['sizes']:
+                chunks.append(bytes(out.buf[offset:offset + size]))
+                offset += size
+        finally:
+            _close(out, unlink=True)
+        encoded = [dict(variant, data=data) for variant, data in zip(out_meta['variants'], chunks[1:])]
+        return (chunks[0], out_meta['compression']), encoded
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'start_method': self.start_method,
+                'running': self._context is not None,
+                'idle': len(self._idle),
+                'tasks': self.tasks,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'crashes': self.crashes,
+                'busy_rejections': self.busy_rejections,
+                'timeout_seconds': EXECUTOR_TIMEOUT_SECONDS,
+                'operation_timeouts': EXECUTOR_OPERATION_TIMEOUTS,
+                'wait': self.wait_time.as_dict(),
+                'task': self.task_time.as_dict(),
+            }
+
+image_executor = ImageExecutor()
@@ -0,0 +1,205 @@
+"""
+In-process stand-in for the subset of google.cloud.storage used by the app.
+
+FakeBucket/FakeBlob keep objects in memory (or in a local directory) and can
+add artificial per-call latency, so storage code paths can be exercised and
+benchmarked offline without credentials or a live bucket. Enable it for the
+app with STORAGE_EMULATOR=fake; FAKE_GCS_LATENCY_MS adds latency per call.
+"""
+import io
+import os
+import threading
+import time
+
+class FakeNotFound(Exception):
+    """Raised when a blob does not exist (mirrors google.api_core NotFound)"""
+
+class FakeBlob:
+    """Minimal google.cloud.storage.Blob replacement"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.public = False
+
+    @property
+    def public_url(self):
+        return f'https://storage.googleapis.com/{self.bucket.name}/{self.name}'
+
+    def upload_from_file(self, file_obj, size=None, content_type=None, predefined_acl=None, **kwargs):
+        data = file_obj.read() if size is None else file_obj.read(size)
+        self.upload_from_string(data, content_type=content_type, predefined_acl=predefined_acl)
+
+    def upload_from_string(self, data, content_type=None, predefined_acl=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.bucket._call()
+        self.content_type = content_type
+        self.public = predefined_acl == 'publicRead'
+        self.bucket._write(self.name, bytes(data), self.public)
+
+    def upload_from_filename(self, filename, content_type=None, predefined_acl=None, **kwargs):
+        with open(filename, 'rb') as f:
+            self.upload_from_string(f.read(), content_type=content_type, predefined_acl=predefined_acl)
+
+    def download_as_bytes(self, **kwargs):
+        self.bucket._call()
+        return self.bucket._read(self.name)
+
+    def open(self, mode='rb', **kwargs):
+        if mode != 'rb':
+            raise ValueError('FakeBlob only opens for binary reading')
+        return io.BytesIO(self.download_as_bytes())
+
+    def download_to_filename(self, filename, **kwargs):
+        with open(filename, 'wb') as f:
+            f.write(self.download_as_bytes())
+
+    def make_public(self, **kwargs):
+        self.bucket._call()
+        self.bucket._read(self.name)
+        self.bucket._public.add(self.name)
+        self.public = True
+
+    def exists(self, **kwargs):
+        self.bucket._call()
+        return self.bucket._exists(self.name)
+
+    def delete(self, **kwargs):
+        # Inside a batch the round-trip and any error come when the batch ends
+        batch = self.bucket.client.current_batch
+        if batch is None:
+            self.bucket._call()
+        try:
+            self.bucket._delete(self.name)
+        except FakeNotFound as e:
+            if batch is None:
+                raise
+            batch.errors.append(e)
+
+class FakeBucket:
+    """
+    Minimal google.cloud.storage.Bucket replacement
+
+    Args:
+        name: Bucket name used in public URLs
+        directory: Store objects as files under this directory instead of in memory
+        latency_seconds: Artificial delay added to every remote call
+        client: FakeClient the bucket belongs to (a new one if omitted)
+    """
+
+    def __init__(self, name='fake-bucket', directory=None, latency_seconds=0.0, client=None):
+        self.name = name
+        self.client = client or FakeClient(latency_seconds=latency_seconds)
+        self.directory = directory
+        self.latency_seconds = latency_seconds
+        self._objects = {}
+        self._public = set()
+        self._lock = threading.Lock()
+        self.calls = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name.replace('/', '__'))
+
+    def _write(self, name, data, public):
+        with self._lock:
+            if self.directory:
+                with open(self._path(name), 'wb') as f:
+                    f.write(data)
+            else:
+                self._objects[name] = data
+            if public:
+                self._public.add(name)
+
+    def _read(self, name):
+        with self._lock:
+            if self.directory:
+                try:
+                    with open(self._path(name), 'rb') as f:
+                        return f.read()
+                except FileNotFoundError:
+                    raise FakeNotFound(name)
+            if name not in self._objects:
+                raise FakeNotFound(name)
+            return self._objects[name]
+
+    def _exists(self, name):
+        with self._lock:
+            if self.directory:
+                return os.path.exists(self._path(name))
+            return name in self._objects
+
+    def _delete(self, name):
+        with self._lock:
+            self._public.discard(name)
+            if self.directory:
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    raise FakeNotFound(name)
+            elif self._objects.pop(name, None) is None:
+                raise FakeNotFound(name)
+
+    def is_public(self, name):
+        with self._lock:
+            return name in self._public
+
+class FakeBatch:
+    """
+    Minimal google.cloud.storage.Batch replacement
+
+    Blob deletes run right away but cost one round-trip for the whole batch;
+    their errors are collected and raised when the batch ends (unless
+    raise_exception is False), as a real batch does.
+    """
+
+    def __init__(self, client, raise_exception=True):
+        self.client = client
+        self.raise_exception = raise_exception
+        self.errors = []
+
+    def __enter__(self):
+        self.client._batches.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.client._batches.remove(self)
+        if self.client.latency_seconds:
+            time.sleep(self.client.latency_seconds)
+        if exc_type is None and self.errors and self.raise_exception:
+            raise self.errors[0]
+        return False
+
+class FakeClient:
+    """Minimal google.cloud.storage.Client replacement"""
+
+    def __init__(self, directory=None, latency_seconds=0.0):
+        self.directory = directory
+        self.latency_seconds = latency_seconds
+        self._buckets = {}
+        self._batches = []
+
+    def bucket(self, name):
+        if name not in self._buckets:
+            directory = os.path.join(self.directory, name) if self.directory else None
+            self._buckets[name] = FakeBucket(name, directory, self.latency_seconds, client=self)
+        return self._buckets[name]
+
+    def batch(self, raise_exception=True):
+        return FakeBatch(self, raise_exception)
+
+    @property
+    def current_batch(self):
+        return self._batches[-1] if self._batches else None
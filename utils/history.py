@@ -0,0 +1,171 @@
+"""
+Per-session undo/redo history of edit stacks.
+
+Each step of the history is the edit stack the session showed at that point
+and, while it fits the budget, the stored render of it ('path', 'url',
+'preview'). Stepping to a step that still has its render is instant: the
+session just points at the stored file again. Steps beyond the byte budget
+keep only their recipe (the stack) and are rendered again when reached,
+through the usual edit-stack pipeline, which resumes from the longest
+cached prefix render and reuses stored results from the result cache.
+Stored renders are not used as sources for other steps: re-decoding an
+encoded (often lossy) file would compound the loss.
+
+The step the session shows and its undo/redo neighbours keep their renders
+first; the farthest steps lose theirs first. The first step is the
+original and never counts against the budget. Steps with a stored render
+(and its responsive variants, utils/variants.py) are protected from
+lifecycle collection (utils/lifecycle.py) while the session is live.
+
+History lives in the session's lifecycle record, a plain dictionary:
+    {'steps': [{'stack': [...], 'path': ..., 'url': ..., 'storage': ..., 'preview': bool, 'bytes': n,
+                'variants': {...}, 'srcset': ...}, ...],
+     'position': index of the step the session shows}
+
+Configuration (environment variables):
+    HISTORY_MAX_STEPS  steps kept per session, oldest dropped first (default 20)
+    HISTORY_MAX_MB     stored renders kept per session (default 50)
+"""
+import os
+
+HISTORY_MAX_STEPS = int(os.environ.get('HISTORY_MAX_STEPS', 20))
+HISTORY_MAX_MB = float(os.environ.get('HISTORY_MAX_MB', 50))
+
+# Fields of a step without a stored render
+_RECIPE_ONLY = {'path': None, 'url': None, 'storage': None, 'preview': False, 'bytes': 0,
+                'variants': None, 'srcset': None}
+
+def make_step(stack, result=None):
+    """
+    History step for an edit stack
+
+    Args:
+        stack: List of [operation, params] pairs
+        result: Stored render of the stack ('path', 'url', 'storage', 'preview'
+            and optionally 'bytes', 'variants' and 'srcset'), or None to keep
+            only the recipe
+    """
+    step = dict(_RECIPE_ONLY, stack=stack)
+    if result:
+        step.update(path=result['path'], url=result['url'], storage=result.get('storage'),
+                    preview=bool(result.get('preview')), bytes=result.get('bytes') or 0,
+                    variants=result.get('variants'), srcset=result.get('srcset'))
+    return step
+
+def start(record, original):
+    """
+    Begin a new history at a freshly uploaded original
+
+    Args:
+        record: Session lifecycle record
+        original: Storage result of the original ('path', 'url')
+    """
+    record['history'] = {'steps': [make_step([], original)], 'position': 0}
+
+def _trim(history, max_steps, max_bytes):
+    steps = history['steps']
+    if len(steps) > max_steps:
+        dropped = len(steps) - max_steps
+        history['steps'] = steps = steps[dropped:]
+        history['position'] = max(0, history['position'] - dropped)
+    # Renders nearest the shown step stay; the original (stack []) is never dropped
+    position = history['position']
+    by_distance = sorted(range(len(steps)), key=lambda index: abs(index - position))
+    used = 0
+    for index in by_distance:
+        step = steps[index]
+        if step['path'] is None or not step['stack']:
+            continue
+        if used + step['bytes'] > max_bytes and index != position:
+            step.update(_RECIPE_ONLY)
+        else:
+            used += step['bytes']
+
+def push(record, stack, result, max_steps=HISTORY_MAX_STEPS, max_mb=HISTORY_MAX_MB):
+    """
+    Record a new step after the shown one, dropping the redo steps
+
+    Args:
+        record: Session lifecycle record
+        stack: Edit stack of the new step
+        result: Its stored render
+        max_steps: Steps kept
+        max_mb: Stored renders kept, in megabytes
+    """
+    history = record.get('history')
+    if history is None:
+        return
+    steps = history['steps'][:history['position'] + 1]
+    if steps and steps[-1]['stack'] == stack:
+        # Same stack rendered again (e.g. at full resolution): keep one step
+        steps[-1] = make_step(stack, result)
+    else:
+        steps.append(make_step(stack, result))
+    history['steps'] = steps
+    history['position'] = len(steps) - 1
+    _trim(history, max_steps, int(max_mb * 1024 * 1024))
+
+def move(record, offset, max_steps=HISTORY_MAX_STEPS, max_mb=HISTORY_MAX_MB):
+    """
+    Step back (offset -1, undo) or forward (offset 1, redo)
+
+    Args:
+        record: Session lifecycle record
+        offset: Steps to move
+
+    Returns:
+        The step now shown (its 'path' is None when it must be rendered
+        again), or None when there is nothing to undo or redo
+    """
+    history = record.get('history')
+    if history is None:
+        return None
+    position = history['position'] + offset
+    if not 0 <= position < len(history['steps']):
+        return None
+    history['position'] = position
+    # The renders kept follow the shown step
+    _trim(history, max_steps, int(max_mb * 1024 * 1024))
+    return history['steps'][position]
+
+def store(record, stack, result, max_steps=HISTORY_MAX_STEPS, max_mb=HISTORY_MAX_MB):
+    """
+    Attach a fresh render to the shown step (a recipe-only step rendered again,
+    or a full-resolution render of a preview)
+
+    Args:
+        record: Session lifecycle record
+        stack: Edit stack that was rendered; nothing changes if the shown step
+            has moved on to another one meanwhile
+        result: Its stored render
+    """
+    history = record.get('history')
+    if history is None:
+        return
+    step = history['steps'][history['position']]
+    if step['stack'] != stack:
+        return
+    step.update(make_step(stack, result))
+    _trim(history, max_steps, int(max_mb * 1024 * 1024))
+
+def summary(record):
+    """Undo/redo availability and the steps, for API responses"""
+    history = record.get('history') or {'steps': [], 'position': 0}
+    position = history['position']
+    return {
+        'can_undo': position > 0,
+        'can_redo': position < len(history['steps']) - 1,
+        'position': position,
+        'steps': [{'operations': [operation for operation, _ in step['stack']], 'stored': step['path'] is not None}
+                  for step in history['steps']],
+    }
+
+def pinned_paths(record):
+    """Stored renders (and their variants) the history still points at"""
+    history = record.get('history') or {}
+    paths = set()
+    for step in history.get('steps', ()):
+        if step['path']:
+            paths.add(step['path'])
+            paths.update(variant['path'] for variant in (step.get('variants') or {}).values())
+    return paths
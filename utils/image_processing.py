@@ -1,31 +1,309 @@
 import io
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageDraw, ImageColor
-import rembg
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageDraw, ImageColor, ExifTags
 import os
+import threading
+import time
+from collections import Counter
+
+from utils.mask_cache import content_key, mask_cache
+from utils.metrics import annotate, stage
+from utils.model_sessions import REMBG_MODEL, get_session_pool
+from utils.resize_engine import plan_resize, resize_to
+from utils.timing import TimingStats
+
+# Filter matrices for apply_filter (3x4 matrices = 12 elements each)
+FILTER_MATRICES = {
+    'sepia': [
+        0.393, 0.769, 0.189, 0,
+        0.349, 0.686, 0.168, 0,
+        0.272, 0.534, 0.131, 0
+    ],
+    'cool': [
+        0.8, 0.1, 0.1, 0,
+        0.1, 0.9, 0.1, 0,
+        0.1, 0.1, 1.2, 0
+    ],
+    'warm': [
+        1.2, 0.1, 0.1, 0,
+        0.1, 1.0, 0.1, 0,
+        0.1, 0.1, 0.7, 0
+    ],
+    'vintage': [
+        0.9, 0.5, 0.1, 0,
+        0.3, 0.8, 0.1, 0,
+        0.2, 0.3, 0.7, 0
+    ],
+    'dramatic': [
+        1.5, -0.2, -0.2, 0,
+        -0.2, 1.5, -0.2, 0,
+        -0.2, -0.2, 1.5, 0
+    ],
+    'cinema': [
+        1.1, -0.1, 0.1, 0,
+        0.0, 1.1, 0.1, 0,
+        -0.1, 0.1, 1.0, 0
+    ],
+    'chrome': [
+        1.2, -0.1, -0.1, 0,
+        -0.1, 1.2, -0.1, 0,
+        -0.1, -0.1, 1.2, 0
+    ],
+    'fade': [
+        0.95, 0.05, 0.05, 0.1,
+        0.05, 0.95, 0.05, 0.1,
+        0.05, 0.05, 0.95, 0.1
+    ]
+}
+
+# rembg (and with it onnxruntime, numba and scipy) is imported on first use, see load_rembg
+rembg = None
+
+def load_rembg():
+    """Import rembg if it has not been imported yet and return the module"""
+    global rembg
+    if rembg is None:
+        import rembg as module
+        rembg = module
+    return rembg
+
+# Decodes and pixel conversions done by this process, and by the threads
+# currently counting them (see ImageWork)
+_work_lock = threading.Lock()
+_work_totals = Counter()
+_work_local = threading.local()
+
+def record_image_work(counts):
+    """
+    Count decodes and conversions
+
+    Args:
+        counts: Mapping of kind ('decode', 'orient', 'rgb', 'hsv', ...) to count
+    """
+    with _work_lock:
+        _work_totals.update(counts)
+    for active in getattr(_work_local, 'active', ()):
+        active.update(counts)
+
+def image_work_stats():
+    """Decodes and conversions counted in this process so far, by kind"""
+    with _work_lock:
+        return dict(_work_totals)
+
+class ImageWork:
+    """
+    Context manager counting the decodes and conversions done by the current thread
+
+    During and after the block, `counts` maps each kind of work to how often
+    it happened. Work done in image worker processes on behalf of the thread
+    is added when their results come back (utils/executor.py).
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def __enter__(self):
+        if not hasattr(_work_local, 'active'):
+            _work_local.active = []
+        _work_local.active.append(self.counts)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Empty counters compare equal, so remove by identity
+        _work_local.active = [active for active in _work_local.active if active is not self.counts]
+        return False
+
+    @property
+    def decodes(self):
+        return self.counts['decode']
+
+    @property
+    def conversions(self):
+        return sum(count for kind, count in self.counts.items() if kind != 'decode')
+
+def upright(img):
+    """
+    Rotate or mirror an image as its EXIF orientation tag asks
+
+    Returns:
+        The image itself (still lazily decoded) when it is already upright,
+        otherwise a transposed copy without the tag
+    """
+    if img.getexif().get(ExifTags.Base.Orientation, 1) in (0, 1):
+        return img
+    record_image_work({'orient': 1})
+    return ImageOps.exif_transpose(img)
+
+def open_image(source):
+    """
+    Open an image from a path, raw bytes, a binary stream or a PIL Image
+    
+    Images are turned upright according to their EXIF orientation.
+    
+    Args:
+        source: Path to image file, encoded image bytes, file-like object,
+            PIL Image or DecodedImage object
+        
+    Returns:
+        PIL Image object (decoded lazily when opened from a path, bytes or stream)
+    """
+    if isinstance(source, DecodedImage):
+        return source.image
+    if isinstance(source, Image.Image):
+        return upright(source)
+    record_image_work({'decode': 1})
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return upright(Image.open(io.BytesIO(source)))
+    return upright(Image.open(source))
+
+class DecodedImage:
+    """
+    An image decoded once, with derived pixel views computed on first use
+
+    Operations take their input through decode_image, so an image passed to
+    several operations is opened once and each view is converted at most
+    once. Views are shared: do not modify them, copy arrays before writing.
+
+    Attributes:
+        image: Upright PIL Image object
+        data: Encoded bytes the image was decoded from, or None
+    """
+
+    def __init__(self, image, data=None):
+        self.image = image
+        self.data = data
+        self._views = {}
+
+    def _view(self, kind, convert):
+        view = self._views.get(kind)
+        if view is None:
+            view = self._views[kind] = convert()
+            record_image_work({kind: 1})
+        return view
+
+    @property
+    def mode(self):
+        return self.image.mode
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def has_alpha(self):
+        return 'A' in self.image.mode or 'transparency' in self.image.info
+
+    @property
+    def rgb_image(self):
+        """Colour channels as an RGB PIL Image (alpha dropped)"""
+        if self.image.mode == 'RGB':
+            return self.image
+        return self._view('rgb', lambda: self.image.convert('RGB'))
+
+    @property
+    def editable(self):
+        """The image itself if Pillow's filters take its mode (L, RGB), else its RGB view"""
+        return self.image if self.image.mode in ('L', 'RGB') else self.rgb_image
+
+    @property
+    def alpha(self):
+        """Alpha plane as an L PIL Image, or None for opaque images"""
+        if not self.has_alpha:
+            return None
+        if self.image.mode in ('RGBA', 'LA', 'PA'):
+            return self._view('alpha', lambda: self.image.getchannel('A'))
+        return self._view('alpha', lambda: self.image.convert('RGBA').getchannel('A'))
+
+    @property
+    def rgb(self):
+        """H x W x 3 uint8 RGB array"""
+        return self._view('rgb_array', lambda: np.asarray(self.rgb_image))
+
+    @property
+    def bgr(self):
+        """H x W x 3 uint8 BGR array for OpenCV"""
+        return self._view('bgr', lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2BGR))
+
+    @property
+    def hsv(self):
+        """H x W x 3 uint8 OpenCV HSV array (hue 0-179)"""
+        return self._view('hsv', lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2HSV))
+
+    @property
+    def luminance(self):
+        """Luminance as an L PIL Image"""
+        if self.image.mode == 'L':
+            return self.image
+        return self._view('luminance', lambda: self.image.convert('L'))
+
+def decode_image(source):
+    """
+    Decode an image for one or more operations
+
+    Args:
+        source: Path to image file, encoded image bytes, file-like object,
+            PIL Image or DecodedImage object
+
+    Returns:
+        DecodedImage object (the source itself if it already is one)
+    """
+    if isinstance(source, DecodedImage):
+        return source
+    if isinstance(source, Image.Image):
+        return DecodedImage(open_image(source))
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            data = f.read()
+    else:
+        data = source.read()
+    # Keep the encoded bytes, e.g. to key caches on content
+    return DecodedImage(open_image(data), data)
+
+def finish_image(img, output_path, quality=95):
+    """
+    Save the processed image if an output target is given and return it
+    
+    Args:
+        img: PIL Image object
+        output_path: Path or binary buffer to save to, or None to skip saving
+        quality: Quality for lossy formats (0-100)
+        
+    Returns:
+        The processed PIL Image object
+    """
+    if output_path is not None:
+        save_image_with_format_compatibility(img, output_path, quality=quality)
+    return img
 
 def remove_background(input_image, output_path, bg_color=None):
     """
     Remove background from an image and optionally replace with a color.
     
     Args:
-        input_image: Path to input image or PIL Image object
-        output_path: Path to save output image
+        input_image: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         bg_color: Background color (hex string, color name, or RGB tuple), or None/'transparent' for transparent
     """
-    # Accept both file path and PIL Image
-    if isinstance(input_image, Image.Image):
-        with io.BytesIO() as buf:
-            input_image.save(buf, format='PNG')
-            img_data = buf.getvalue()
+    # Key the mask by input content: the encoded bytes when there are any
+    decoded = decode_image(input_image)
+    source = decoded.image
+    if decoded.data is not None:
+        key = content_key(REMBG_MODEL, decoded.data)
     else:
-        with open(input_image, 'rb') as f:
-            img_data = f.read()
+        key = content_key(REMBG_MODEL, source.mode, str(source.size), source.tobytes())
+    
+    def predict_mask():
+        # Remove background with a pooled, pre-loaded rembg session
+        with get_session_pool().session() as session:
+            return load_rembg().remove(source, session=session, only_mask=True).convert('L')
     
-    # Remove background with rembg
-    output_data = rembg.remove(img_data)
-    img = Image.open(io.BytesIO(output_data)).convert("RGBA")
+    # Segmentation only runs on a cache miss; colour changes reuse the mask
+    mask = mask_cache.get_or_compute(key, predict_mask)
+    rgba = source.convert('RGBA')
+    img = Image.composite(rgba, Image.new('RGBA', rgba.size, 0), mask)
     
     # If a background color is specified and it's not "transparent", apply it
     if bg_color and str(bg_color).lower() != "transparent":
@@ -43,463 +321,323 @@ def remove_background(input_image, output_path, bg_color=None):
             color = (*color, 255)
         background = Image.new("RGBA", img.size, color)
         background.paste(img, (0, 0), img)
-        save_image_with_format_compatibility(background, output_path)
+        return finish_image(background, output_path)
     else:
         # Save with transparent background
-        save_image_with_format_compatibility(img, output_path)
+        return finish_image(img, output_path)
 
 def enhance_image_quality(input_path, output_path):
     """
     Enhance image quality without changing colors or lighting
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
     """
-    img = Image.open(input_path)
-    original_mode = img.mode
+    decoded = decode_image(input_path)
 
-    if original_mode == 'RGBA':
-        # Handle RGBA images
-        r, g, b, a = img.split()
-        rgb_img = Image.merge('RGB', (r, g, b))
-        
-        # Apply only sharpening for quality enhancement
-        rgb_img = rgb_img.filter(ImageFilter.SHARPEN)
-        rgb_img = ImageEnhance.Sharpness(rgb_img).enhance(1.3)
-        
-        # Split and merge back with alpha
-        r, g, b = rgb_img.split()
-        img = Image.merge('RGBA', (r, g, b, a))
-    else:
-        # Apply quality enhancement
-        img = img.filter(ImageFilter.SHARPEN)
-        img = ImageEnhance.Sharpness(img).enhance(1.3)
+    # Apply only sharpening for quality enhancement, to the colour channels
+    img = decoded.rgb_image if decoded.has_alpha else decoded.editable
+    img = img.filter(ImageFilter.SHARPEN)
+    img = ImageEnhance.Sharpness(img).enhance(1.3)
     
-    save_image_with_format_compatibility(img, output_path)
+    # Reattach alpha channel if needed
+    if decoded.has_alpha:
+        img.putalpha(decoded.alpha)
+    
+    return finish_image(img, output_path)
 
 def auto_adjust(input_path, output_path):
     """
     Automatically adjust image settings
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
     """
-    img = Image.open(input_path)
-    original_mode = img.mode
+    decoded = decode_image(input_path)
 
-    if original_mode == 'RGBA':
-        # Handle RGBA images
-        r, g, b, a = img.split()
-        rgb_img = Image.merge('RGB', (r, g, b))
-        
-        # Apply auto adjustments
-        rgb_img = ImageEnhance.Contrast(rgb_img).enhance(1.2)
-        rgb_img = ImageEnhance.Brightness(rgb_img).enhance(1.1)
-        rgb_img = ImageEnhance.Color(rgb_img).enhance(1.2)
-        
-        # Split and merge back with alpha
-        r, g, b = rgb_img.split()
-        img = Image.merge('RGBA', (r, g, b, a))
-    else:
-        # Apply auto adjustments
-        img = ImageEnhance.Contrast(img).enhance(1.2)
-        img = ImageEnhance.Brightness(img).enhance(1.1)
-        img = ImageEnhance.Color(img).enhance(1.2)
+    # Apply auto adjustments to the colour channels
+    img = decoded.rgb_image if decoded.has_alpha else decoded.editable
+    img = ImageEnhance.Contrast(img).enhance(1.2)
+    img = ImageEnhance.Brightness(img).enhance(1.1)
+    img = ImageEnhance.Color(img).enhance(1.2)
+    
+    # Reattach alpha channel if needed
+    if decoded.has_alpha:
+        img.putalpha(decoded.alpha)
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
-def resize_image(input_path, output_path, width, height):
+def resize_image(input_path, output_path, width, height, mode='exact'):
     """
     Resize image to specified dimensions
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         width: Target width
         height: Target height
+        mode: 'exact', 'fit', 'fill', 'crop' or 'thumbnail' (see utils/resize_engine.py)
     """
-    img = Image.open(input_path)
-    img = img.resize((int(width), int(height)), Image.LANCZOS)
+    # Not loaded yet, so JPEG sources can be decoded at reduced scale
+    img = open_image(input_path)
+    out_size, box = plan_resize(img.size, width, height, mode or 'exact')
+    img = resize_to(img, out_size, box)
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
 def rotate_image(input_path, output_path, angle):
     """
     Rotate image by specified angle
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         angle: Rotation angle in degrees
     """
-    img = Image.open(input_path)
+    img = open_image(input_path)
     img = img.rotate(-float(angle), expand=True, resample=Image.BICUBIC)
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
 def flip_image(input_path, output_path, direction):
     """
     Flip image horizontally or vertically
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         direction: 'horizontal' or 'vertical'
     """
-    img = Image.open(input_path)
+    img = open_image(input_path)
     
     if direction == 'horizontal':
         img = img.transpose(Image.FLIP_LEFT_RIGHT)
     elif direction == 'vertical':
         img = img.transpose(Image.FLIP_TOP_BOTTOM)
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
 def adjust_brightness(input_path, output_path, factor):
     """
     Adjust image brightness
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         factor: Brightness factor (1.0 is original, < 1.0 darkens, > 1.0 brightens)
     """
-    img = Image.open(input_path)
+    img = open_image(input_path)
     enhancer = ImageEnhance.Brightness(img)
     img = enhancer.enhance(float(factor))
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
 def adjust_contrast(input_path, output_path, factor):
     """
     Adjust image contrast
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         factor: Contrast factor (1.0 is original, < 1.0 decreases, > 1.0 increases)
     """
-    img = Image.open(input_path)
+    img = open_image(input_path)
     enhancer = ImageEnhance.Contrast(img)
     img = enhancer.enhance(float(factor))
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
 def adjust_saturation(input_path, output_path, factor):
     """
     Adjust image saturation
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         factor: Saturation factor (1.0 is original, < 1.0 decreases, > 1.0 increases)
     """
-    img = Image.open(input_path)
+    img = open_image(input_path)
     enhancer = ImageEnhance.Color(img)
     img = enhancer.enhance(float(factor))
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
 def adjust_hue(input_path, output_path, shift):
     """
     Adjust image hue
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         shift: Hue shift in degrees (0-360)
     """
-    # Load the image with PIL first to check format
-    pil_img = Image.open(input_path)
-    has_alpha = 'A' in pil_img.mode
+    decoded = decode_image(input_path)
     
-    # OpenCV works better for hue adjustment
-    img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED if has_alpha else cv2.IMREAD_COLOR)
+    # OpenCV works better for hue adjustment; shift a copy of the cached HSV view
+    hsv = decoded.hsv.copy()
     
-    if has_alpha:
-        # Split into BGR and Alpha
-        bgr = img[:, :, :3]
-        alpha = img[:, :, 3]
-        
-        # Convert BGR to HSV
-        hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
-        
-        # Shift the hue
-        shift_float = float(shift)
-        hsv[:, :, 0] = (hsv[:, :, 0] + shift_float) % 180
-        
-        # Convert back to BGR
-        bgr_adjusted = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-        
-        # Merge back with alpha
-        img_adjusted = cv2.merge([bgr_adjusted[:, :, 0], 
-                                  bgr_adjusted[:, :, 1], 
-                                  bgr_adjusted[:, :, 2], 
-                                  alpha])
-        
-        # Save with PIL to preserve alpha
-        pil_output = Image.fromarray(cv2.cvtColor(img_adjusted, cv2.COLOR_BGRA2RGBA))
-        save_image_with_format_compatibility(pil_output, output_path)
-    else:
-        # For non-alpha images, use the original approach
-        img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        
-        # Shift the hue
-        img_hsv[:, :, 0] = (img_hsv[:, :, 0] + shift_float) % 180
-        
-        # Convert back to BGR and save
-        img_result = cv2.cvtColor(img_hsv, cv2.COLOR_HSV2BGR)
-        cv2.imwrite(output_path, img_result)
+    # Shift the hue
+    shift_float = float(shift)
+    hsv[:, :, 0] = (hsv[:, :, 0] + shift_float) % 180
+    
+    # Convert back to RGB
+    result = Image.fromarray(cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB))
+    
+    # Reattach alpha channel if needed
+    if decoded.has_alpha:
+        result.putalpha(decoded.alpha)
+    
+    return finish_image(result, output_path)
 
 def adjust_vibrance(input_path, output_path, factor):
     """
     Adjust image vibrance - increases saturation more on less saturated colors
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         factor: Vibrance factor (1.0 is original, < 1.0 decreases, > 1.0 increases)
     """
-    # Load the image with PIL first to check format
-    pil_img = Image.open(input_path)
-    has_alpha = 'A' in pil_img.mode
-    
-    # Use OpenCV for vibrance
-    if has_alpha:
-        # Load with alpha channel
-        img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
-        # Split channels
-        b, g, r, a = cv2.split(img)
-        bgr = cv2.merge([b, g, r])
-        
-        # Process only BGR channels
-        img_hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV).astype(np.float32)
-        
-        # Apply vibrance adjustment
-        factor_float = float(factor) - 1.0
-        if factor_float != 0:
-            mask = (255 - img_hsv[:, :, 1]) / 255.0
-            img_hsv[:, :, 1] += mask * img_hsv[:, :, 1] * factor_float
-            
-        # Clip values to valid range
-        img_hsv[:, :, 1] = np.clip(img_hsv[:, :, 1], 0, 255)
-        
-        # Convert back to BGR
-        bgr_result = cv2.cvtColor(img_hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
-        
-        # Merge back with alpha
-        img_result = cv2.merge([bgr_result[:, :, 0], 
-                               bgr_result[:, :, 1], 
-                               bgr_result[:, :, 2], 
-                               a])
-        
-        # Save with PIL to preserve alpha
-        pil_output = Image.fromarray(cv2.cvtColor(img_result, cv2.COLOR_BGRA2RGBA))
-        save_image_with_format_compatibility(pil_output, output_path)
-    else:
-        # Non-alpha processing
-        img = cv2.imread(input_path)
-        img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype(np.float32)
-        
-        # Apply vibrance adjustment
-        factor_float = float(factor) - 1.0
-        if factor_float != 0:
-            mask = (255 - img_hsv[:, :, 1]) / 255.0
-            img_hsv[:, :, 1] += mask * img_hsv[:, :, 1] * factor_float
-            
-        # Clip values to valid range
-        img_hsv[:, :, 1] = np.clip(img_hsv[:, :, 1], 0, 255)
+    decoded = decode_image(input_path)
+    
+    # Use OpenCV for vibrance, processing only the colour channels
+    img_hsv = decoded.hsv.astype(np.float32)
+    
+    # Apply vibrance adjustment
+    factor_float = float(factor) - 1.0
+    if factor_float != 0:
+        mask = (255 - img_hsv[:, :, 1]) / 255.0
+        img_hsv[:, :, 1] += mask * img_hsv[:, :, 1] * factor_float
         
-        # Convert back to BGR and save
-        img_result = cv2.cvtColor(img_hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
-        cv2.imwrite(output_path, img_result)
+    # Clip values to valid range
+    img_hsv[:, :, 1] = np.clip(img_hsv[:, :, 1], 0, 255)
+    
+    # Convert back to RGB
+    result = Image.fromarray(cv2.cvtColor(img_hsv.astype(np.uint8), cv2.COLOR_HSV2RGB))
+    
+    # Reattach alpha channel if needed
+    if decoded.has_alpha:
+        result.putalpha(decoded.alpha)
+    
+    return finish_image(result, output_path)
 
 def compress_image(input_path, output_path, quality):
     """
     Compress image with specified quality
 
+    In the in-memory pipeline the quality (or a byte budget, see
+    encode_to_target) is applied when the result is encoded; see
+    get_encode_options.
+
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         quality: JPEG quality (0-100)
     """
-    img = Image.open(input_path)
+    img = open_image(input_path)
     
     # Ensure quality is within valid range
     quality_val = max(1, min(int(quality), 95))
     
-    save_image_with_format_compatibility(img, output_path, quality=quality_val)
+    return finish_image(img, output_path, quality=quality_val)
 
 def apply_black_white(input_path, output_path):
     """
     Convert image to black and white
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
     """
-    img = Image.open(input_path)
-    has_alpha = 'A' in img.mode
+    decoded = decode_image(input_path)
     
-    if has_alpha:
-        # Extract alpha channel
-        alpha = img.split()[3]
-        
-        # Convert to grayscale
-        gray = img.convert('L')
+    if decoded.has_alpha:
+        # Grayscale from the cached luminance view
+        gray = decoded.luminance
         
         # Create new RGBA image
-        result = Image.new('RGBA', img.size)
+        result = Image.new('RGBA', decoded.size)
         
         # Fill RGB channels with grayscale
         for i in range(3):
             result.paste(gray, (0, 0), gray)
         
         # Add alpha channel back
-        result.putalpha(alpha)
+        result.putalpha(decoded.alpha)
     else:
         # Simple grayscale conversion
-        result = img.convert('L')
+        result = decoded.luminance
     
-    save_image_with_format_compatibility(result, output_path)
+    return finish_image(result, output_path)
 
 def apply_blur(input_path, output_path, amount=5):
     """
     Apply blur effect to image
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         amount: Blur radius (higher = more blur)
     """
-    img = Image.open(input_path)
-    
-    # Preserve alpha channel if present
-    has_alpha = 'A' in img.mode
+    decoded = decode_image(input_path)
     
-    # Apply Gaussian blur
-    if has_alpha:
-        # Process RGB and A channels separately
-        r, g, b, a = img.split()
-        rgb = Image.merge('RGB', (r, g, b))
-        
-        # Apply blur to RGB channels
-        blurred_rgb = rgb.filter(ImageFilter.GaussianBlur(radius=float(amount)))
-        
-        # Recombine with alpha
-        r, g, b = blurred_rgb.split()
-        img = Image.merge('RGBA', (r, g, b, a))
+    # Preserve alpha channel if present: blur only the colour channels
+    if decoded.has_alpha:
+        img = decoded.rgb_image.filter(ImageFilter.GaussianBlur(radius=float(amount)))
+        img.putalpha(decoded.alpha)
     else:
-        img = img.filter(ImageFilter.GaussianBlur(radius=float(amount)))
+        img = decoded.editable.filter(ImageFilter.GaussianBlur(radius=float(amount)))
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
 def apply_sharpen(input_path, output_path, amount=1.5):
     """
     Apply sharpening effect to image
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         amount: Sharpening factor (higher = more sharp)
     """
-    img = Image.open(input_path)
+    decoded = decode_image(input_path)
     
-    # Preserve alpha channel if present
-    has_alpha = 'A' in img.mode
-    
-    if has_alpha:
-        # Process RGB and A channels separately
-        r, g, b, a = img.split()
-        rgb = Image.merge('RGB', (r, g, b))
-        
-        # Apply sharpening filter
-        enhancer = ImageEnhance.Sharpness(rgb)
-        sharpened_rgb = enhancer.enhance(float(amount))
-        
-        # Recombine with alpha
-        r, g, b = sharpened_rgb.split()
-        img = Image.merge('RGBA', (r, g, b, a))
+    # Preserve alpha channel if present: sharpen only the colour channels
+    if decoded.has_alpha:
+        img = ImageEnhance.Sharpness(decoded.rgb_image).enhance(float(amount))
+        img.putalpha(decoded.alpha)
     else:
-        enhancer = ImageEnhance.Sharpness(img)
+        enhancer = ImageEnhance.Sharpness(decoded.editable)
         img = enhancer.enhance(float(amount))
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
 def apply_filter(input_path, output_path, filter_type, intensity=100):
     """
     Apply various filter effects to image with intensity control
     
     Args:
-        input_path: Path to input image
-        output_path: Path to save output image
+        input_path: Path to input image, raw bytes, PIL Image or DecodedImage object
+        output_path: Path or binary buffer to save output image, or None to return the result
         filter_type: Type of filter to apply
         intensity: Filter intensity (0-100)
     """
-    img = Image.open(input_path)
+    decoded = decode_image(input_path)
     
     # Preserve alpha channel if present
-    has_alpha = 'A' in img.mode
-    alpha = None
-    if has_alpha:
-        alpha = img.split()[3]
+    alpha = decoded.alpha
     
-    # Convert to RGB for consistent processing
-    img = img.convert('RGB')
+    # Work on the RGB view for consistent processing
+    img = decoded.rgb_image
     
     # Calculate blend factor from intensity (0-100)
     # Reverse the blend calculation so higher intensity means stronger filter
-    blend = 1 - ((100 - intensity) / 100.0)  # New calculation
-
-    # Define filter matrices (3x4 matrices = 12 elements each)
-    filter_matrices = {
-        'sepia': [
-            0.393, 0.769, 0.189, 0,
-            0.349, 0.686, 0.168, 0,
-            0.272, 0.534, 0.131, 0
-        ],
-        'cool': [
-            0.8, 0.1, 0.1, 0,
-            0.1, 0.9, 0.1, 0,
-            0.1, 0.1, 1.2, 0
-        ],
-        'warm': [
-            1.2, 0.1, 0.1, 0,
-            0.1, 1.0, 0.1, 0,
-            0.1, 0.1, 0.7, 0
-        ],
-        'vintage': [
-            0.9, 0.5, 0.1, 0,
-            0.3, 0.8, 0.1, 0,
-            0.2, 0.3, 0.7, 0
-        ],
-        'dramatic': [
-            1.5, -0.2, -0.2, 0,
-            -0.2, 1.5, -0.2, 0,
-            -0.2, -0.2, 1.5, 0
-        ],
-        'cinema': [
-            1.1, -0.1, 0.1, 0,
-            0.0, 1.1, 0.1, 0,
-            -0.1, 0.1, 1.0, 0
-        ],
-        'chrome': [
-            1.2, -0.1, -0.1, 0,
-            -0.1, 1.2, -0.1, 0,
-            -0.1, -0.1, 1.2, 0
-        ],
-        'fade': [
-            0.95, 0.05, 0.05, 0.1,
-            0.05, 0.95, 0.05, 0.1,
-            0.05, 0.05, 0.95, 0.1
-        ]
-    }
+    blend = 1 - ((100 - float(intensity)) / 100.0)  # New calculation
 
-    if filter_type in filter_matrices:
+    if filter_type in FILTER_MATRICES:
         # Get the filter matrix
-        filter_matrix = filter_matrices[filter_type]
+        filter_matrix = FILTER_MATRICES[filter_type]
         
         # Identity matrix for blending
         identity = [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0]
@@ -539,71 +677,121 @@ def apply_filter(input_path, output_path, filter_type, intensity=100):
             img = contrast_img
 
     # Reapply alpha channel if needed
-    if has_alpha and alpha is not None:
+    if alpha is not None:
         r, g, b = img.split()
         img = Image.merge('RGBA', (r, g, b, alpha))
     
-    save_image_with_format_compatibility(img, output_path)
+    return finish_image(img, output_path)
 
-def save_image_with_format_compatibility(img, output_path, quality=95):
+# Encoder settings per profile: 'interactive' trades file size for encode
+# speed (slider previews), 'final' trades encode time for smaller files
+# (full-resolution results and downloads). Set ENCODE_PROFILE to change the
+# profile used when a caller does not pick one.
+# GIF 'quantize' picks the palette reduction for RGB(A) input instead of the
+# encoder's default median cut.
+ENCODE_PROFILES = {
+    'interactive': {
+        'JPEG': {'optimize': False},
+        'PNG': {'compress_level': 1},
+        'WEBP': {'method': 1},
+        'GIF': {'quantize': Image.Quantize.FASTOCTREE},
+    },
+    'final': {
+        'JPEG': {'optimize': True, 'progressive': True},
+        'PNG': {'optimize': True},
+        'WEBP': {'method': 4},
+        'GIF': {},
+    },
+}
+ENCODE_PROFILE = os.environ.get('ENCODE_PROFILE', 'final')
+
+# Target-size compression: lowest quality tried before scaling down, and how
+# close under the budget a trial must land to end the search early
+TARGET_MIN_QUALITY = int(os.environ.get('TARGET_MIN_QUALITY', 10))
+TARGET_TOLERANCE = float(os.environ.get('TARGET_TOLERANCE', 0.05))
+TARGET_MAX_SCALE_STEPS = 4
+
+# Encode time and output size per (format, profile) for this process
+_encode_stats = {}
+_encode_stats_lock = threading.Lock()
+
+def _jpeg_ready(img):
+    """RGB version of an image for JPEG; transparent areas become white"""
+    if img.mode == 'RGBA':
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        return background
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+def save_image_with_format_compatibility(img, output_path, quality=95, file_format=None, profile=None):
     """
     Save image with format compatibility handling.
     Converts RGBA to RGB if saving as JPEG.
     
+    The image is never modified, so it is not copied; mode conversions
+    create the new image they need.
+    
     Args:
         img: PIL Image object
-        output_path: Path to save the image
+        output_path: Path to save the image, or a writable binary buffer
         quality: Quality for lossy formats (0-100)
+        file_format: Extension (without dot) to encode as; required when output_path is a buffer
+        profile: Encoder profile name from ENCODE_PROFILES (defaults to ENCODE_PROFILE)
     """
+    is_path = isinstance(output_path, (str, os.PathLike))
+    start = None if is_path else output_path.tell()
+    options = ENCODE_PROFILES[profile or ENCODE_PROFILE]
     try:
-        ext = os.path.splitext(output_path)[1].lower()
-        
-        # Make a copy to avoid modifying the original
-        img_copy = img.copy()
+        if file_format:
+            ext = '.' + file_format.lower().lstrip('.')
+        elif is_path:
+            ext = os.path.splitext(output_path)[1].lower()
+        else:
+            ext = ''
         
         if ext in ['.jpg', '.jpeg']:
-            # Handle RGBA to RGB conversion for JPEG
-            if img_copy.mode == 'RGBA':
-                # Create a white background
-                background = Image.new('RGB', img_copy.size, (255, 255, 255))
-                # Paste the image with alpha as mask
-                background.paste(img_copy, mask=img_copy.split()[3])
-                # Save the result
-                background.save(output_path, format='JPEG', quality=quality, optimize=True)
-            else:
-                # Ensure RGB mode for JPEG
-                img_copy = img_copy.convert('RGB')
-                img_copy.save(output_path, format='JPEG', quality=quality, optimize=True)
+            # JPEG needs RGB; transparency is flattened onto white
+            _jpeg_ready(img).save(output_path, format='JPEG', quality=quality, **options['JPEG'])
                 
         elif ext == '.png':
             # PNG supports all color modes
-            img_copy.save(output_path, format='PNG', optimize=True)
+            img.save(output_path, format='PNG', **options['PNG'])
             
         elif ext == '.webp':
             # WebP supports both RGB and RGBA
-            img_copy.save(output_path, format='WEBP', quality=quality)
+            img.save(output_path, format='WEBP', quality=quality, **options['WEBP'])
             
         elif ext == '.gif':
             # GIF with potential palette optimizations
-            if img_copy.mode not in ['P', 'RGB', 'RGBA']:
-                img_copy = img_copy.convert('RGBA')
-            img_copy.save(output_path, format='GIF')
+            gif = img if img.mode in ['P', 'RGB', 'RGBA'] else img.convert('RGBA')
+            gif_options = dict(options['GIF'])
+            method = gif_options.pop('quantize', None)
+            if method is not None and gif.mode != 'P':
+                gif = gif.quantize(256, method=method)
+            gif.save(output_path, format='GIF', **gif_options)
             
         else:
-            # Default fallback
-            if img_copy.mode == 'RGBA':
-                img_copy.save(output_path + '.png', format='PNG')
+            # Default fallback (buffers have no name to append an extension to)
+            if img.mode == 'RGBA':
+                img.save(output_path + '.png' if is_path else output_path, format='PNG', **options['PNG'])
             else:
-                img_copy = img_copy.convert('RGB')
-                img_copy.save(output_path + '.jpg', format='JPEG', quality=quality, optimize=True)
+                rgb = img if img.mode == 'RGB' else img.convert('RGB')
+                rgb.save(output_path + '.jpg' if is_path else output_path, format='JPEG', quality=quality,
+                         **options['JPEG'])
                 
     except Exception as e:
+        # Discard any partial output written to a buffer
+        if not is_path:
+            output_path.seek(start)
+            output_path.truncate()
         # If there's any error, try a more aggressive approach
         try:
             # Force convert to RGB and save as JPEG
             img_rgb = img.convert('RGB')
             img_rgb.save(output_path, format='JPEG', quality=quality)
         except Exception as e2:
+            if not is_path:
+                raise e
             # If still failing, attempt to save with a new name as PNG
             try:
                 new_path = os.path.splitext(output_path)[0] + "_fallback.png"
@@ -614,6 +802,155 @@ def save_image_with_format_compatibility(img, output_path, quality=95):
             except Exception as e3:
                 # If all else fails, raise the original error
                 raise e
+
+def encode_image(img, file_format, quality=95, profile=None, target_bytes=None, allow_scale=True):
+    """
+    Encode image in memory with the same compatibility rules used when saving to disk
+    
+    Args:
+        img: PIL Image object
+        file_format: Extension (without dot) to encode as
+        quality: Quality for lossy formats (0-100); the upper bound with target_bytes
+        profile: Encoder profile name from ENCODE_PROFILES (defaults to ENCODE_PROFILE)
+        target_bytes: Byte budget; searches quality and scale with encode_to_target
+        allow_scale: Let encode_to_target scale the image down to meet the budget
+        
+    Returns:
+        Encoded image bytes
+    """
+    if target_bytes:
+        data, _ = encode_to_target(img, file_format, target_bytes, quality=quality, profile=profile,
+                                   allow_scale=allow_scale)
+        return data
+    profile = profile or ENCODE_PROFILE
+    annotate(format=file_format.lower())
+    start = time.perf_counter()
+    with stage('encode'), io.BytesIO() as buf:
+        save_image_with_format_compatibility(img, buf, quality=quality, file_format=file_format, profile=profile)
+        data = buf.getvalue()
+    record_encode(file_format, profile, time.perf_counter() - start, len(data))
+    return data
+
+def encode_to_target(img, file_format, target_bytes, quality=95, profile=None, allow_scale=True,
+                     min_quality=TARGET_MIN_QUALITY):
+    """
+    Encode under a byte budget at the highest quality found, scaling down only if quality cannot get there
+    
+    Every trial encodes the same decoded image in memory. For JPEG and WebP
+    the quality is binary-searched between min_quality and quality, stopping
+    as soon as a trial lands within TARGET_TOLERANCE under the budget. If
+    even min_quality is too large (or the format is lossless) and
+    allow_scale is set, the image is scaled down by the estimated factor and
+    searched again, up to TARGET_MAX_SCALE_STEPS times.
+    
+    Pillow already encodes JPEG with 4:2:0 chroma subsampling, so there is
+    no subsampling step to search.
+    
+    Args:
+        img: PIL Image object
+        file_format: Extension (without dot) to encode as
+        target_bytes: Byte budget for the encoded image
+        quality: Highest quality to use (0-100)
+        profile: Encoder profile name from ENCODE_PROFILES (defaults to ENCODE_PROFILE)
+        allow_scale: Scale the image down when quality alone cannot meet the budget
+        min_quality: Lowest quality to try before scaling
+        
+    Returns:
+        Tuple of (encoded bytes, dict with the achieved 'bytes', 'quality',
+        'scale', 'width', 'height', whether the budget was 'met' and the
+        number of 'trials')
+    """
+    profile = profile or ENCODE_PROFILE
+    target_bytes = int(target_bytes)
+    file_format = file_format.lower().lstrip('.')
+    lossy = file_format in ('jpg', 'jpeg', 'webp')
+    quality = max(1, min(int(quality), 95))
+    min_quality = min(min_quality, quality)
+    start = time.perf_counter()
+    trials = 0
+    
+    # Convert once; every trial reuses the same pixels
+    source = _jpeg_ready(img) if file_format in ('jpg', 'jpeg') else img
+    
+    def encode(candidate, q):
+        nonlocal trials
+        trials += 1
+        with io.BytesIO() as buf:
+            save_image_with_format_compatibility(candidate, buf, quality=q, file_format=file_format, profile=profile)
+            return buf.getvalue()
+    
+    def search(candidate):
+        """Returns (bytes, quality, met) for the highest quality under the budget"""
+        data = encode(candidate, quality)
+        if len(data) <= target_bytes or not lossy:
+            return data, quality, len(data) <= target_bytes
+        best, smallest = None, (data, quality)
+        low, high = min_quality, quality - 1
+        while low <= high:
+            q = (low + high) // 2
+            data = encode(candidate, q)
+            if len(data) <= target_bytes:
+                best = (data, q)
+                if len(data) >= target_bytes * (1 - TARGET_TOLERANCE):
+                    break
+                low = q + 1
+            else:
+                if len(data) < len(smallest[0]):
+                    smallest = (data, q)
+                high = q - 1
+        if best:
+            return best[0], best[1], True
+        return smallest[0], smallest[1], False
+    
+    scale = 1.0
+    candidate = source
+    data, achieved_quality, met = search(candidate)
+    steps = 0
+    while not met and allow_scale and steps < TARGET_MAX_SCALE_STEPS:
+        # Encoded size grows roughly with the pixel count
+        scale *= min(0.9, max(0.1, (target_bytes / len(data)) ** 0.5 * 0.95))
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        candidate = resize_to(source, size)
+        data, achieved_quality, met = search(candidate)
+        steps += 1
+    
+    record_encode(file_format, profile, time.perf_counter() - start, len(data))
+    return data, {
+        'bytes': len(data),
+        'target_bytes': target_bytes,
+        'quality': achieved_quality if lossy else None,
+        'scale': round(candidate.width / img.width, 4),
+        'width': candidate.width,
+        'height': candidate.height,
+        'met': met,
+        'trials': trials,
+    }
+
+def record_encode(file_format, profile, seconds, size):
+    """Add one encode to the per-format counters"""
+    key = (file_format.lower().lstrip('.').replace('jpeg', 'jpg'), profile)
+    with _encode_stats_lock:
+        entry = _encode_stats.get(key)
+        if entry is None:
+            entry = _encode_stats[key] = {'time': TimingStats(), 'bytes': 0}
+        entry['time'].record(seconds)
+        entry['bytes'] += size
+
+def encode_stats():
+    """
+    Encode counters of this process
+    
+    Returns:
+        Dictionary of '<format>/<profile>' to timing counters plus total and mean output bytes
+    """
+    with _encode_stats_lock:
+        stats = {}
+        for (file_format, profile), entry in sorted(_encode_stats.items()):
+            timing = entry['time'].as_dict()
+            timing['total_bytes'] = entry['bytes']
+            timing['mean_bytes'] = round(entry['bytes'] / timing['count']) if timing['count'] else None
+            stats[f'{file_format}/{profile}'] = timing
+        return stats
     
 def get_appropriate_extension(operation, input_path=None):
     """
@@ -637,4 +974,89 @@ def get_appropriate_extension(operation, input_path=None):
             return ext[1:]  # Remove the dot
     
     # Default to none (use original or fallback)
-    return None
\ No newline at end of file
+    return None
+
+# Operation names accepted by apply_operation
+OPERATIONS = (
+    'remove_background', 'enhance', 'auto_adjust', 'resize', 'rotate', 'flip',
+    'brightness', 'contrast', 'saturation', 'hue', 'vibrance', 'compress',
+    'bw', 'blur', 'sharpen', 'filter',
+)
+
+def apply_operation(image, operation, params=None):
+    """
+    Apply a named editing operation in memory
+    
+    Args:
+        image: Path to input image, raw bytes, PIL Image or DecodedImage object
+        operation: Operation name as sent by the editor (e.g. 'brightness')
+        params: Dictionary of operation parameters
+        
+    Returns:
+        Processed PIL Image object
+    """
+    if params is None:
+        params = {}
+        
+    if operation == 'remove_background':
+        return remove_background(image, None, params.get('color', None))
+    elif operation == 'enhance':
+        return enhance_image_quality(image, None)
+    elif operation == 'auto_adjust':
+        return auto_adjust(image, None)
+    elif operation == 'resize':
+        return resize_image(image, None, params.get('width'), params.get('height'), params.get('mode', 'exact'))
+    elif operation == 'rotate':
+        return rotate_image(image, None, params.get('angle', 90))
+    elif operation == 'flip':
+        return flip_image(image, None, params.get('direction', 'horizontal'))
+    elif operation == 'brightness':
+        return adjust_brightness(image, None, params.get('factor', 1.0))
+    elif operation == 'contrast':
+        return adjust_contrast(image, None, params.get('factor', 1.0))
+    elif operation == 'saturation':
+        return adjust_saturation(image, None, params.get('factor', 1.0))
+    elif operation == 'hue':
+        return adjust_hue(image, None, params.get('factor', 0))
+    elif operation == 'vibrance':
+        return adjust_vibrance(image, None, params.get('factor', 1.0))
+    elif operation == 'compress':
+        return compress_image(image, None, params.get('quality', 85))
+    elif operation == 'bw':
+        return apply_black_white(image, None)
+    elif operation == 'blur':
+        return apply_blur(image, None, params.get('amount', 5))
+    elif operation == 'sharpen':
+        return apply_sharpen(image, None, params.get('amount', 1.5))
+    elif operation == 'filter':
+        return apply_filter(image, None, params.get('type', 'none'), params.get('intensity', 100))
+    else:
+        raise ValueError(f"Unknown operation: {operation}")
+
+def get_encode_options(operation, params=None):
+    """
+    Determine encoder settings implied by an operation
+    
+    Args:
+        operation: The image operation that produced the image
+        params: Dictionary of operation parameters
+        
+    Returns:
+        Dictionary of keyword arguments for encode_image
+    """
+    if operation == 'compress':
+        params = params or {}
+        target_bytes = params.get('target_bytes')
+        if target_bytes:
+            # Search for the best quality under the budget, starting from the highest
+            target_bytes = int(float(target_bytes))
+            if target_bytes < 1:
+                raise ValueError('target_bytes must be positive')
+            return {
+                'quality': max(1, min(int(float(params.get('quality', 95))), 95)),
+                'target_bytes': target_bytes,
+                'allow_scale': params.get('allow_scale', True) not in (False, 0, '0', 'false'),
+            }
+        quality = params.get('quality', 85)
+        return {'quality': max(1, min(int(quality), 95)), 'target_bytes': None}
+    return {}
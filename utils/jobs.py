@@ -0,0 +1,284 @@
+"""
+Local asynchronous job queue for heavy image operations.
+
+Heavy requests are handed to a bounded thread pool inside the worker and the
+client gets a job id back straight away. Job state is mirrored to small JSON
+files in JOB_STATE_DIR so a status poll that lands on another gunicorn worker
+still sees it, and cancellation requests are passed the same way.
+
+Running jobs cannot be interrupted mid-operation; cancelling a queued job
+stops it from starting, cancelling a running one discards its result.
+
+Configuration (environment variables):
+    JOB_WORKERS            concurrent jobs per worker process (default 2)
+    JOB_QUEUE_SIZE         queued jobs allowed beyond the running ones (default 16)
+    JOB_RETENTION_SECONDS  how long finished jobs stay queryable (default 600)
+    JOB_STATE_DIR          shared job state directory (default /tmp/jobs)
+    ASYNC_BLUR_RADIUS      blur radius from which blur counts as heavy (default 10)
+    ASYNC_RESIZE_PIXELS    target size from which resize counts as heavy (default 12 MP)
+    ASYNC_HEAVY_OPERATIONS set to 1 to run heavy operations as jobs even if the client did not ask
+    JOB_MAX_WAIT_SECONDS   longest long-poll a status request may ask for (default 25)
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 16))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 600))
+JOB_STATE_DIR = os.environ.get('JOB_STATE_DIR', '/tmp/jobs')
+ASYNC_BLUR_RADIUS = float(os.environ.get('ASYNC_BLUR_RADIUS', 10))
+ASYNC_RESIZE_PIXELS = int(os.environ.get('ASYNC_RESIZE_PIXELS', 12 * 1000 * 1000))
+ASYNC_HEAVY_OPERATIONS = os.environ.get('ASYNC_HEAVY_OPERATIONS', '0') == '1'
+JOB_MAX_WAIT_SECONDS = float(os.environ.get('JOB_MAX_WAIT_SECONDS', 25))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = {DONE, FAILED, CANCELLED}
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+
+def is_heavy_operation(operation, params=None):
+    """
+    Whether an operation is slow enough to run as a background job
+
+    Args:
+        operation: Operation name
+        params: Dictionary of operation parameters
+
+    Returns:
+        True for background removal, large blurs and large resizes
+    """
+    params = params or {}
+    try:
+        if operation == 'remove_background':
+            return True
+        if operation == 'blur':
+            return float(params.get('amount', 5)) >= ASYNC_BLUR_RADIUS
+        if operation == 'resize':
+            return int(float(params.get('width'))) * int(float(params.get('height'))) >= ASYNC_RESIZE_PIXELS
+    except (TypeError, ValueError):
+        return False
+    return False
+
+class Job:
+    """
+    A unit of background work and its timing
+    """
+
+    def __init__(self, label, owner=None, meta=None):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.owner = owner
+        self.meta = meta or {}
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.done_event = threading.Event()
+
+    def to_dict(self):
+        now = time.time()
+        queued_until = self.started_at or self.finished_at or now
+        return {
+            'id': self.id,
+            'label': self.label,
+            'owner': self.owner,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'meta': self.meta,
+            'submitted_at': self.submitted_at,
+            'queued_seconds': round(queued_until - self.submitted_at, 4),
+            'run_seconds': round((self.finished_at or now) - self.started_at, 4) if self.started_at else None,
+        }
+
+class JobQueue:
+    """
+    Bounded background job queue backed by a thread pool
+    """
+
+    def __init__(self, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE,
+                 state_dir=JOB_STATE_DIR, retention_seconds=JOB_RETENTION_SECONDS):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.state_dir = state_dir
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def _state_path(self, job_id, suffix='json'):
+        return os.path.join(self.state_dir, f'{job_id}.{suffix}')
+
+    def _persist(self, job):
+        path = self._state_path(job.id)
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Could not persist job {job.id}: {str(e)}")
+
+    def _cancel_marked(self, job):
+        return job.cancel_requested or os.path.exists(self._state_path(job.id, 'cancel'))
+
+    def _active_count(self):
+        return sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+
+    def _purge(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id, job in list(self._jobs.items()):
+            if job.status in FINISHED_STATES and job.finished_at < cutoff:
+                del self._jobs[job_id]
+                for suffix in ('json', 'cancel'):
+                    path = self._state_path(job_id, suffix)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def submit(self, fn, *args, label=None, owner=None, meta=None, **kwargs):
+        """
+        Queue a callable as a background job
+
+        Args:
+            fn: Callable to run; its return value must be JSON-serializable
+            label: Short description (e.g. the operation name)
+            owner: Opaque owner id used to authorise status and cancel calls
+            meta: JSON-serializable data stored with the job
+
+        Returns:
+            Job
+
+        Raises:
+            QueueFullError: if the queue is at capacity
+        """
+        with self._lock:
+            self._purge()
+            if self._active_count() >= self.capacity:
+                self.rejected += 1
+                raise QueueFullError('Too many jobs in progress, try again shortly')
+            job = Job(label, owner=owner, meta=meta)
+            self._jobs[job.id] = job
+            self.submitted += 1
+        self._persist(job)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if self._cancel_marked(job):
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._persist(job)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.label}) failed: {str(e)}")
+            self._finish(job, FAILED, error=str(e))
+            return
+        if self._cancel_marked(job):
+            self._finish(job, CANCELLED)
+        else:
+            self._finish(job, DONE, result=result)
+
+    def _finish(self, job, status, result=None, error=None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        self._persist(job)
+        job.done_event.set()
+        logger.debug(f"Job {job.id} ({job.label}) {status} after {job.to_dict()['run_seconds']}s running")
+
+    def status(self, job_id, wait=0):
+        """
+        Current state of a job, optionally long-polling until it finishes
+
+        Args:
+            job_id: Job id
+            wait: Seconds to wait for the job to finish (0 returns immediately)
+
+        Returns:
+            Job state dictionary, or None if the job is unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            if wait > 0:
+                job.done_event.wait(wait)
+            return job.to_dict()
+
+        # Job owned by another worker process: read its shared state
+        deadline = time.time() + wait
+        while True:
+            state = self._read_state(job_id)
+            if state is None or state['status'] in FINISHED_STATES or time.time() >= deadline:
+                return state
+            time.sleep(0.25)
+
+    def _read_state(self, job_id):
+        if not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def cancel(self, job_id):
+        """
+        Request cancellation of a job
+
+        Args:
+            job_id: Job id
+
+        Returns:
+            Job state dictionary after the request, or None if the job is unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            state = self._read_state(job_id)
+            if state is None or state['status'] in FINISHED_STATES:
+                return state
+            # Leave a marker for the worker process that owns the job
+            open(self._state_path(job_id, 'cancel'), 'w').close()
+            state['cancel_requested'] = True
+            return state
+        job.cancel_requested = True
+        state = job.to_dict()
+        state['cancel_requested'] = True
+        return state
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                'workers': self.workers,
+                'capacity': self.capacity,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'by_status': counts,
+            }
+
+job_queue = JobQueue()
@@ -0,0 +1,411 @@
+"""
+Lifecycle of stored images: garbage collection of old versions and a disk quota.
+
+Every upload and every render stores a new file. The lifecycle manager
+tracks, per browser session, the original, its preview proxy, the current
+image and every other version the session produced. Records are small JSON
+files in LIFECYCLE_DIR, shared by the web workers like job state. A session
+is live while it made a request within LIFECYCLE_SESSION_TTL_SECONDS.
+
+A collection (every LIFECYCLE_GC_INTERVAL_SECONDS, run by one web worker at a
+time on an APScheduler job) removes:
+- superseded versions of live sessions: anything that is no longer the
+  original, proxy or current image, once older than LIFECYCLE_GRACE_SECONDS
+- every file of expired sessions
+- orphaned files in the local folders (local fallback copies, background
+  publishing copies, temp files) that no session tracks, once older than
+  LIFECYCLE_GRACE_SECONDS
+- then, while the local folders are above LIFECYCLE_DISK_QUOTA_MB, the least
+  recently used local files, grace period or not
+
+The original, proxy and current image of a live session, and the renders
+its undo history keeps (utils/history.py), are never removed by any rule.
+The responsive variants of a version (utils/variants.py) share its fate.
+The grace period defaults to the result cache TTL, so no web
+worker's result cache still points at a file when it is collected; the
+collecting worker also skips files its own result cache references and
+drops entries for files it evicts. Reclaimed bytes are reported per reason
+in storage_reclaimed_bytes_total and on /stats/lifecycle.
+
+Configuration (environment variables):
+    LIFECYCLE_ENABLED               set to 0 to never collect (default 1)
+    LIFECYCLE_DIR                   shared session records (default /tmp/lifecycle)
+    LIFECYCLE_GC_INTERVAL_SECONDS   time between collections (default 300)
+    LIFECYCLE_GRACE_SECONDS         minimum age of collected versions and orphans
+                                    (default RESULT_CACHE_TTL_SECONDS)
+    LIFECYCLE_SESSION_TTL_SECONDS   inactivity after which a session expires (default 86400)
+    LIFECYCLE_DISK_QUOTA_MB         size limit of the local folders (default 0, no limit)
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.history import pinned_paths
+from utils.metrics import storage_reclaimed
+from utils.result_cache import RESULT_CACHE_TTL_SECONDS
+from utils.variants import variant_paths
+
+logger = logging.getLogger(__name__)
+
+LIFECYCLE_ENABLED = os.environ.get('LIFECYCLE_ENABLED', '1') == '1'
+LIFECYCLE_DIR = os.environ.get('LIFECYCLE_DIR', '/tmp/lifecycle')
+LIFECYCLE_GC_INTERVAL_SECONDS = float(os.environ.get('LIFECYCLE_GC_INTERVAL_SECONDS', 300))
+LIFECYCLE_GRACE_SECONDS = float(os.environ.get('LIFECYCLE_GRACE_SECONDS', RESULT_CACHE_TTL_SECONDS))
+LIFECYCLE_SESSION_TTL_SECONDS = float(os.environ.get('LIFECYCLE_SESSION_TTL_SECONDS', 86400))
+LIFECYCLE_DISK_QUOTA_MB = float(os.environ.get('LIFECYCLE_DISK_QUOTA_MB', 0))
+
+# How often a session's last activity is written, at most
+TOUCH_INTERVAL_SECONDS = 60
+
+# Session roles whose files are never collected while the session is live
+PROTECTED_ROLES = ('original', 'proxy', 'current')
+
+@contextmanager
+def _locked_file(path, blocking=True):
+    """Open a file under an exclusive lock; yields None if blocking=False and it is taken"""
+    with open(path, 'a+') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield None
+            return
+        try:
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _read(f):
+    f.seek(0)
+    text = f.read()
+    return json.loads(text) if text else None
+
+def _write(f, record):
+    f.seek(0)
+    f.truncate()
+    json.dump(record, f)
+    f.flush()
+
+def _with_variants(record, paths):
+    """Paths plus the stored variants of those that are versions in the record"""
+    versions = record.get('versions', {})
+    expanded = set(paths)
+    for path in paths:
+        expanded.update(versions.get(path, {}).get('variants', ()))
+    return expanded
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class LifecycleManager:
+    """
+    Tracks the stored versions of each session and collects the ones no longer needed
+
+    Args:
+        storage: Callable returning the utils.storage.Storage that holds the files
+        folders: Local directories to clean of orphans and keep under the quota
+        cached_paths: Callable returning storage paths the result cache references
+        invalidate: Callable dropping result cache entries for a deleted path
+    """
+
+    def __init__(self, storage, folders, cached_paths=None, invalidate=None,
+                 directory=LIFECYCLE_DIR, grace_seconds=LIFECYCLE_GRACE_SECONDS,
+                 session_ttl_seconds=LIFECYCLE_SESSION_TTL_SECONDS, quota_mb=LIFECYCLE_DISK_QUOTA_MB):
+        self.storage = storage
+        self.folders = folders
+        self.cached_paths = cached_paths or set
+        self.invalidate = invalidate or (lambda path: None)
+        self.directory = directory
+        self.grace_seconds = grace_seconds
+        self.session_ttl_seconds = session_ttl_seconds
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self.runs = 0
+        self.deleted = {}
+        self.reclaimed_bytes = {}
+        self.last_run = None
+
+    def _session_path(self, sid):
+        if not sid or not sid.isalnum():
+            raise ValueError(f'Invalid session id: {sid!r}')
+        return os.path.join(self.directory, 'sessions', f'{sid}.json')
+
+    @contextmanager
+    def session_record(self, sid, touch=True):
+        """Session record under its file lock; changes are written back (also holds the undo history)"""
+        path = self._session_path(sid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _locked_file(path) as f:
+            record = _read(f) or {'versions': {}, 'last_seen': time.time()}
+            yield record
+            if touch:
+                record['last_seen'] = time.time()
+            _write(f, record)
+        if touch:
+            with self._lock:
+                self._touched[sid] = time.time()
+
+    def _add_version(self, record, result):
+        now = time.time()
+        size = result.get('bytes')
+        version = record['versions'].setdefault(result['path'], {'created': now, 'bytes': size})
+        version['used'] = now
+        if size is not None:
+            version['bytes'] = size
+        variants = variant_paths(result)
+        if variants:
+            version['variants'] = variants
+
+    def record_upload(self, sid, original, proxy=None):
+        """
+        A session uploaded a new original; its earlier files become superseded
+
+        Args:
+            sid: Session id
+            original: Storage result of the original ('path', optionally 'bytes'
+                and 'variants')
+            proxy: Storage result of its preview proxy, or None
+        """
+        if not LIFECYCLE_ENABLED:
+            return
+        with self.session_record(sid) as record:
+            for role, result in (('original', original), ('proxy', proxy), ('current', original)):
+                record[role] = result['path'] if result else None
+                if result:
+                    self._add_version(record, result)
+
+    def record_current(self, sid, result):
+        """
+        A session's current image changed (a render, or a reset to the original)
+
+        Args:
+            sid: Session id
+            result: Storage result of the new current image ('path', optionally
+                'bytes' and 'variants')
+        """
+        if not LIFECYCLE_ENABLED:
+            return
+        with self.session_record(sid) as record:
+            record['current'] = result['path']
+            self._add_version(record, result)
+
+    def touch(self, sid):
+        """Keep a session live (written at most every TOUCH_INTERVAL_SECONDS per worker)"""
+        if not LIFECYCLE_ENABLED or not sid:
+            return
+        with self._lock:
+            if time.time() - self._touched.get(sid, 0) < TOUCH_INTERVAL_SECONDS:
+                return
+        if not os.path.exists(self._session_path(sid)):
+            return
+        with self.session_record(sid):
+            pass
+
+    def _sessions(self):
+        sessions_dir = os.path.join(self.directory, 'sessions')
+        if not os.path.isdir(sessions_dir):
+            return []
+        return [name[:-len('.json')] for name in os.listdir(sessions_dir) if name.endswith('.json')]
+
+    def _load(self, sid):
+        try:
+            with open(self._session_path(sid)) as f:
+                return json.loads(f.read() or 'null')
+        except (OSError, ValueError):
+            return None
+
+    def collect(self):
+        """
+        Run one collection (skipped if another web worker is collecting)
+
+        Returns:
+            Report with files deleted and bytes reclaimed per reason, or None when skipped
+        """
+        if not LIFECYCLE_ENABLED:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        with _locked_file(os.path.join(self.directory, 'gc.lock'), blocking=False) as lock:
+            if lock is None:
+                return None
+            return self._collect()
+
+    def _collect(self):
+        start = time.perf_counter()
+        now = time.time()
+        records = {sid: self._load(sid) for sid in self._sessions()}
+        records = {sid: record for sid, record in records.items() if record}
+        live = {sid for sid, record in records.items()
+                if now - record.get('last_seen', 0) < self.session_ttl_seconds}
+        protected = set()
+        for sid in live:
+            roles = {records[sid].get(role) for role in PROTECTED_ROLES} - {None}
+            protected |= _with_variants(records[sid], roles) | pinned_paths(records[sid])
+        cached = set(self.cached_paths())
+        # (path, reason, bytes or None)
+        garbage = []
+
+        for sid, record in records.items():
+            if sid not in live:
+                paths = set(record.get('versions', {})) | {record.get(role) for role in PROTECTED_ROLES}
+                for path in _with_variants(record, paths - {None}) - protected:
+                    garbage.append((path, 'expired', record.get('versions', {}).get(path, {}).get('bytes')))
+                try:
+                    os.remove(self._session_path(sid))
+                except OSError:
+                    pass
+                continue
+            with self.session_record(sid, touch=False) as current:
+                keep = _with_variants(current, {current.get(role) for role in PROTECTED_ROLES} - {None})
+                keep |= pinned_paths(current)
+                for path, version in list(current.get('versions', {}).items()):
+                    if path in keep or path in protected or path in cached:
+                        continue
+                    if now - version.get('created', now) < self.grace_seconds:
+                        continue
+                    garbage.append((path, 'superseded', version.get('bytes')))
+                    for variant in set(version.get('variants', ())) - keep - protected - cached:
+                        garbage.append((variant, 'superseded', None))
+                    del current['versions'][path]
+
+        deleted = self._delete(garbage)
+        tracked = {os.path.basename(path) for record in records.values()
+                   for path in _with_variants(record, record.get('versions', {}))}
+        protected_names = {os.path.basename(path) for path in protected}
+        deleted += self._collect_orphans(now, tracked | protected_names)
+        deleted += self._enforce_quota(records, protected_names)
+
+        report = {'deleted': {}, 'reclaimed_bytes': {}, 'live_sessions': len(live),
+                  'expired_sessions': len(records) - len(live)}
+        for path, reason, size in deleted:
+            report['deleted'][reason] = report['deleted'].get(reason, 0) + 1
+            report['reclaimed_bytes'][reason] = report['reclaimed_bytes'].get(reason, 0) + (size or 0)
+        report['seconds'] = round(time.perf_counter() - start, 4)
+        with self._lock:
+            self.runs += 1
+            for reason, count in report['deleted'].items():
+                self.deleted[reason] = self.deleted.get(reason, 0) + count
+                self.reclaimed_bytes[reason] = self.reclaimed_bytes.get(reason, 0) + report['reclaimed_bytes'][reason]
+            self.last_run = dict(report, finished=now)
+        for reason, size in report['reclaimed_bytes'].items():
+            storage_reclaimed.inc(size, reason=reason)
+        if deleted:
+            logger.info(f"Lifecycle collection removed {len(deleted)} files, "
+                        f"reclaimed {sum(report['reclaimed_bytes'].values()) / (1024 * 1024):.1f} MB "
+                        f"in {report['seconds']:.2f}s")
+        return report
+
+    def _delete(self, garbage):
+        """Delete stored paths through the storage backends (batched per backend)"""
+        if not garbage:
+            return []
+        storage = self.storage()
+        sized = []
+        for path, reason, size in garbage:
+            if size is None and os.path.isfile(path):
+                size = _file_size(path)
+            sized.append((path, reason, size))
+        storage.delete_many([path for path, _, _ in sized])
+        for path, _, _ in sized:
+            self.invalidate(path)
+        return sized
+
+    def _local_files(self):
+        files = []
+        for folder in self.folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files.append((entry.path, stat.st_size, stat.st_mtime))
+                except OSError:
+                    continue
+        return files
+
+    def _remove_local(self, path, reason, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return None
+        self.invalidate(path)
+        return (path, reason, size)
+
+    def _collect_orphans(self, now, known_names):
+        """Local files no session tracks, older than the grace period"""
+        removed = []
+        for path, size, mtime in self._local_files():
+            if os.path.basename(path) in known_names or now - mtime < self.grace_seconds:
+                continue
+            outcome = self._remove_local(path, 'orphan', size)
+            if outcome:
+                removed.append(outcome)
+        return removed
+
+    def _enforce_quota(self, records, protected_names):
+        """Evict the least recently used local files until the folders fit the quota"""
+        if self.quota_bytes <= 0:
+            return []
+        files = self._local_files()
+        total = sum(size for _, size, _ in files)
+        if total <= self.quota_bytes:
+            return []
+        # Last use of tracked files by name (a local copy shares its object's name)
+        used = {}
+        for record in records.values():
+            for path, version in record.get('versions', {}).items():
+                name = os.path.basename(path)
+                used[name] = max(used.get(name, 0), version.get('used', 0))
+        removed = []
+        for path, size, mtime in sorted(files, key=lambda item: used.get(os.path.basename(item[0]), item[2])):
+            if total <= self.quota_bytes:
+                break
+            if os.path.basename(path) in protected_names:
+                continue
+            outcome = self._remove_local(path, 'quota', size)
+            if outcome:
+                removed.append(outcome)
+                total -= size
+        if total > self.quota_bytes:
+            logger.warning(f"Local storage is {total / (1024 * 1024):.1f} MB, above the "
+                           f"{self.quota_bytes / (1024 * 1024):.0f} MB quota, with only protected files left")
+        return removed
+
+    def start(self, interval=LIFECYCLE_GC_INTERVAL_SECONDS):
+        """Collect on an APScheduler interval job in this process (once per web worker)"""
+        with self._lock:
+            if self._scheduler is not None or not LIFECYCLE_ENABLED:
+                return
+            # Imported here: the scheduler is only needed once the worker runs
+            from apscheduler.schedulers.background import BackgroundScheduler
+            self._scheduler = BackgroundScheduler(daemon=True)
+            self._scheduler.add_job(self.collect, 'interval', seconds=interval, id='lifecycle-gc',
+                                    max_instances=1, coalesce=True)
+            self._scheduler.start()
+        logger.info(f"Lifecycle collection every {interval:g}s")
+
+    def stats(self):
+        local_bytes = sum(size for _, size, _ in self._local_files())
+        with self._lock:
+            return {
+                'enabled': LIFECYCLE_ENABLED,
+                'scheduled': self._scheduler is not None,
+                'runs': self.runs,
+                'grace_seconds': self.grace_seconds,
+                'session_ttl_seconds': self.session_ttl_seconds,
+                'quota_bytes': self.quota_bytes,
+                'local_bytes': local_bytes,
+                'deleted': dict(self.deleted),
+                'reclaimed_bytes': dict(self.reclaimed_bytes),
+                'last_run': self.last_run,
+            }
@@ -0,0 +1,274 @@
+"""
+Live previews streamed over Server-Sent Events while a slider is dragged.
+
+Instead of a /process round trip per slider position (render, upload,
+public URL, browser fetch), the editor keeps one event stream open
+(/preview/live/stream) and posts slider values to /preview/live. The stream
+renders each value against a small in-memory copy of the session's image
+(long edge LIVE_PREVIEW_LONG_EDGE) and pushes the JPEG frame itself as a
+data URL; nothing is stored. When the slider is released, the editor
+commits the value through /process as before.
+
+Only the latest value is rendered. Values that arrive while a frame renders
+replace each other, and a finished frame that a newer value has already
+superseded is dropped rather than sent, unless no frame went out for
+LIVE_PREVIEW_MAX_STALL_SECONDS (so a steady drag still shows movement).
+Frames are counted in live_preview_frames_total by outcome.
+
+The latest value of each session is mirrored to a small JSON file in
+LIVE_PREVIEW_DIR, like job state, so a value posted to one gunicorn worker
+reaches a stream held by another. A stream holds a request thread, so each
+web worker serves at most LIVE_PREVIEW_MAX_STREAMS at a time; beyond that
+the stream is refused and the editor falls back to debounced /process calls.
+
+Configuration (environment variables):
+    LIVE_PREVIEW_ENABLED            set to 0 to turn the channel off (default 1)
+    LIVE_PREVIEW_LONG_EDGE          long edge of streamed frames in pixels (default 640)
+    LIVE_PREVIEW_QUALITY            JPEG quality of streamed frames (default 70)
+    LIVE_PREVIEW_MAX_STREAMS        open streams per web worker (default 4)
+    LIVE_PREVIEW_IDLE_SECONDS       a stream without new values ends after this long (default 30)
+    LIVE_PREVIEW_MAX_STALL_SECONDS  longest time superseded frames are held back (default 0.5)
+    LIVE_PREVIEW_DIR                shared latest values (default /tmp/live_preview)
+"""
+import base64
+import json
+import logging
+import os
+import threading
+import time
+
+from utils.edit_stack import RenderCache, render_stack
+from utils.image_processing import encode_image, open_image
+from utils.metrics import RequestStages, annotate, live_preview_frames, stage
+from utils.preview import make_proxy, scale_stack
+
+logger = logging.getLogger(__name__)
+
+LIVE_PREVIEW_ENABLED = os.environ.get('LIVE_PREVIEW_ENABLED', '1') != '0'
+LIVE_PREVIEW_LONG_EDGE = int(os.environ.get('LIVE_PREVIEW_LONG_EDGE', 640))
+LIVE_PREVIEW_QUALITY = int(os.environ.get('LIVE_PREVIEW_QUALITY', 70))
+LIVE_PREVIEW_MAX_STREAMS = int(os.environ.get('LIVE_PREVIEW_MAX_STREAMS', 4))
+LIVE_PREVIEW_IDLE_SECONDS = float(os.environ.get('LIVE_PREVIEW_IDLE_SECONDS', 30))
+LIVE_PREVIEW_MAX_STALL_SECONDS = float(os.environ.get('LIVE_PREVIEW_MAX_STALL_SECONDS', 0.5))
+LIVE_PREVIEW_DIR = os.environ.get('LIVE_PREVIEW_DIR', '/tmp/live_preview')
+
+# How often a stream checks for values posted to another web worker
+POLL_SECONDS = 0.02
+
+# Comment line sent on idle streams so proxies keep them open
+KEEPALIVE_SECONDS = 15
+
+# A value posted this shortly before a stream opened is still rendered: the
+# editor posts the first slider value while the stream is being opened
+STARTUP_WINDOW_SECONDS = 5
+
+# Intermediate renders of the small frame sources, kept apart from the main render cache
+FRAME_CACHE_BYTES = 64 * 1024 * 1024
+
+class StreamLimitError(Exception):
+    """Raised when a web worker already serves LIVE_PREVIEW_MAX_STREAMS streams"""
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+class LivePreviews:
+    """
+    Latest slider values per session and the streams rendering them
+
+    Args:
+        load_source: Callable returning the encoded bytes of a stored image path
+        apply: Callable applying one render segment to an image (utils.executor)
+    """
+
+    def __init__(self, load_source, apply, directory=LIVE_PREVIEW_DIR, long_edge=LIVE_PREVIEW_LONG_EDGE,
+                 quality=LIVE_PREVIEW_QUALITY, max_streams=LIVE_PREVIEW_MAX_STREAMS,
+                 idle_seconds=LIVE_PREVIEW_IDLE_SECONDS, max_stall_seconds=LIVE_PREVIEW_MAX_STALL_SECONDS):
+        self.load_source = load_source
+        self.apply = apply
+        self.directory = directory
+        self.long_edge = long_edge
+        self.quality = quality
+        self.max_streams = max_streams
+        self.idle_seconds = idle_seconds
+        self.max_stall_seconds = max_stall_seconds
+        self.cache = RenderCache(max_bytes=FRAME_CACHE_BYTES)
+        self._sources = {}
+        self._changed = threading.Condition()
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.refused = 0
+
+    def _value_path(self, sid):
+        if not sid or not sid.isalnum():
+            raise ValueError(f'Invalid session id: {sid!r}')
+        return os.path.join(self.directory, f'{sid}.json')
+
+    def submit(self, sid, value):
+        """
+        Make a slider value the one to render next for a session
+
+        Args:
+            sid: Session id
+            value: Dictionary with the 'stack' to render, its 'source' storage
+                path, the source's content 'hash' and 'scale' (source size /
+                original size)
+
+        Returns:
+            Sequence number of the value; frames carry it back
+        """
+        value = dict(value, seq=time.time_ns())
+        path = self._value_path(sid)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        with self._changed:
+            self._changed.notify_all()
+        return value['seq']
+
+    def latest(self, sid):
+        """Latest value posted for a session, or None"""
+        try:
+            with open(self._value_path(sid)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _wait(self, sid, after, timeout):
+        """Latest value newer than sequence number after, or None after timeout seconds"""
+        deadline = time.time() + timeout
+        while True:
+            value = self.latest(sid)
+            if value is not None and value['seq'] > after:
+                return value
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            # Woken at once by posts to this worker; others are picked up by polling
+            with self._changed:
+                self._changed.wait(min(POLL_SECONDS, remaining))
+
+    def _source(self, path):
+        """Small copy of a stored image and its scale relative to the stored one"""
+        with self._lock:
+            source = self._sources.get(path)
+        if source is None:
+            with stage('download'):
+                data = self.load_source(path)
+            if data is None:
+                raise IOError('Could not retrieve the image')
+            img, scale = make_proxy(data, self.long_edge)
+            if img is None:
+                img, scale = open_image(data), 1.0
+                img.load()
+            source = (img, scale)
+            with self._lock:
+                # Streams only ever need the session's current source
+                if len(self._sources) >= self.max_streams * 2:
+                    self._sources.clear()
+                self._sources[path] = source
+        return source
+
+    def render(self, value):
+        """
+        Render and encode one frame
+
+        Returns:
+            Dictionary with the frame as a JPEG 'image' data URL, its
+            'width', 'height' and 'bytes'
+        """
+        with RequestStages('live_frame') as stages:
+            img, factor = self._source(value['source'])
+            stack = scale_stack(value['stack'], value.get('scale', 1.0) * factor)
+            annotate(operation=stack[-1][0] if stack else '', format='jpg')
+            frame = render_stack(f"live:{value.get('hash') or value['source']}", lambda: img, stack,
+                                 cache=self.cache, apply=self.apply)
+            data = encode_image(frame, 'jpg', quality=self.quality, profile='interactive')
+        # Observed per frame; the stream request itself lasts as long as the drag
+        stages.observe()
+        return {
+            'image': 'data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii'),
+            'width': frame.width,
+            'height': frame.height,
+            'bytes': len(data),
+        }
+
+    def open(self):
+        """Claim a stream slot; raises StreamLimitError when this worker has none left"""
+        with self._lock:
+            if self.streams >= self.max_streams:
+                self.refused += 1
+                raise StreamLimitError(f'{self.streams} live preview streams already open')
+            self.streams += 1
+
+    def close(self):
+        """Release a stream slot (when the response closes, even if it never started)"""
+        with self._lock:
+            self.streams -= 1
+
+    def stream(self, sid, source=None):
+        """
+        Server-Sent Events of rendered frames for a session (after open())
+
+        Yields a 'ready' event, then 'frame' events with the value's 'seq'
+        and the frame, 'error' events for values that could not be rendered,
+        and a final 'idle' event when no value arrived for idle_seconds.
+
+        Args:
+            sid: Session id
+            source: Storage path of the image the session edits, loaded
+                before 'ready' so the first frame does not wait for it
+        """
+        if source:
+            try:
+                self._source(source)
+            except Exception as e:
+                logger.error(f"Could not load live preview source {source}: {str(e)}")
+        yield _event('ready', {'long_edge': self.long_edge})
+        current = self.latest(sid)
+        last_seq = current['seq'] if current else 0
+        if last_seq > time.time_ns() - STARTUP_WINDOW_SECONDS * 1e9:
+            last_seq = 0
+        last_sent = time.time()
+        last_activity = time.time()
+        while True:
+            value = self._wait(sid, last_seq, min(KEEPALIVE_SECONDS, self.idle_seconds))
+            if value is None:
+                if time.time() - last_activity >= self.idle_seconds:
+                    yield _event('idle', {})
+                    return
+                yield ': keepalive\n\n'
+                continue
+            last_seq = value['seq']
+            last_activity = time.time()
+            start = time.perf_counter()
+            try:
+                frame = self.render(value)
+            except Exception as e:
+                logger.error(f"Live preview frame failed: {str(e)}")
+                live_preview_frames.inc(outcome='failed')
+                yield _event('error', {'seq': value['seq'], 'error': str(e)})
+                continue
+            newer = self.latest(sid)
+            if (newer is not None and newer['seq'] > value['seq']
+                    and time.time() - last_sent < self.max_stall_seconds):
+                # Already superseded: render the newer value instead
+                live_preview_frames.inc(outcome='dropped')
+                continue
+            live_preview_frames.inc(outcome='sent')
+            last_sent = time.time()
+            yield _event('frame', dict(frame, seq=value['seq'],
+                                       render_ms=round((time.perf_counter() - start) * 1000, 1)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': LIVE_PREVIEW_ENABLED,
+                'streams': self.streams,
+                'max_streams': self.max_streams,
+                'refused': self.refused,
+                'long_edge': self.long_edge,
+                'sources': len(self._sources),
+                'cache_bytes': self.cache.current_bytes,
+            }
@@ -0,0 +1,206 @@
+"""
+Two-tier LRU cache for foreground masks produced by background removal.
+
+Masks are keyed by a content hash of the input image (plus the model name),
+so trying different background colours on the same photo re-runs only the
+composite, not the segmentation model. The memory tier holds decoded L-mode
+masks for this worker; the disk tier stores them as PNG files shared by all
+workers on the host.
+
+Configuration (environment variables):
+    MASK_CACHE_MEMORY_BYTES  memory tier budget per worker (default 64 MB)
+    MASK_CACHE_DISK_BYTES    disk tier budget (default 512 MB, 0 disables the tier)
+    MASK_CACHE_DIR           disk tier directory (default /tmp/mask_cache)
+"""
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from PIL import Image
+
+from utils.metrics import cache_lookup
+
+logger = logging.getLogger(__name__)
+
+MASK_CACHE_MEMORY_BYTES = int(os.environ.get('MASK_CACHE_MEMORY_BYTES', 64 * 1024 * 1024))
+MASK_CACHE_DISK_BYTES = int(os.environ.get('MASK_CACHE_DISK_BYTES', 512 * 1024 * 1024))
+MASK_CACHE_DIR = os.environ.get('MASK_CACHE_DIR', '/tmp/mask_cache')
+
+def content_key(*parts):
+    """
+    Hash byte strings into a cache key
+
+    Args:
+        parts: bytes or str values identifying the content
+
+    Returns:
+        Hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+class MaskCache:
+    """
+    Size-bounded memory + disk LRU cache of L-mode mask images
+    """
+
+    def __init__(self, memory_bytes=MASK_CACHE_MEMORY_BYTES, disk_bytes=MASK_CACHE_DISK_BYTES,
+                 directory=MASK_CACHE_DIR):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.directory = directory
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_bytes > 0:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f'{key}.png')
+
+    def _remember(self, key, mask):
+        size = mask.width * mask.height
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = mask
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= evicted.width * evicted.height
+                self.evictions += 1
+
+    def get(self, key):
+        """
+        Look up a mask, promoting disk hits into memory
+
+        Args:
+            key: Cache key from content_key
+
+        Returns:
+            L-mode PIL Image or None
+        """
+        with self._lock:
+            mask = self._memory.get(key)
+            if mask is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                cache_lookup('mask', 'hit')
+                return mask
+
+        if self.disk_bytes > 0:
+            path = self._disk_path(key)
+            try:
+                with Image.open(path) as stored:
+                    mask = stored.convert('L')
+                # Touch the file so disk eviction stays least-recently-used
+                os.utime(path)
+            except (FileNotFoundError, OSError):
+                mask = None
+            if mask is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    cache_lookup('mask', 'disk_hit')
+                self._remember(key, mask)
+                return mask
+
+        with self._lock:
+            self.misses += 1
+            cache_lookup('mask', 'miss')
+        return None
+
+    def put(self, key, mask):
+        """
+        Store a mask in both tiers
+
+        Args:
+            key: Cache key from content_key
+            mask: L-mode PIL Image
+        """
+        self._remember(key, mask)
+        if self.disk_bytes <= 0:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            mask.save(tmp_path, format='PNG', compress_level=1)
+            os.replace(tmp_path, path)
+            self._enforce_disk_budget()
+        except Exception as e:
+            logger.error(f"Failed to write mask to disk cache: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _enforce_disk_budget(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.png'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.disk_bytes:
+            return
+        # Oldest access first
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            if total <= self.disk_bytes:
+                break
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached mask for a key, computing and storing it on a miss
+
+        Args:
+            key: Cache key from content_key
+            compute: Callable returning an L-mode PIL Image
+
+        Returns:
+            L-mode PIL Image
+        """
+        mask = self.get(key)
+        if mask is None:
+            mask = compute()
+            self.put(key, mask)
+        return mask
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_used,
+                'memory_max_bytes': self.memory_bytes,
+                'disk_max_bytes': self.disk_bytes,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+mask_cache = MaskCache()
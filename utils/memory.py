@@ -0,0 +1,96 @@
+"""
+Process memory measurement helpers.
+
+Peak memory is read from the kernel's resident-set high-water mark (VmHWM in
+/proc/self/status), which covers allocations made by Pillow, NumPy and OpenCV
+in C as well as Python objects. On Linux the mark can be reset by writing "5"
+to /proc/self/clear_refs, so the peak of a single stage can be measured; where
+that is not possible (other platforms, restricted containers) peaks are
+reported as None rather than guessed.
+
+Freed heap pages are handed back to the OS (glibc malloc_trim) before a
+measurement starts; otherwise a stage reusing memory released by the previous
+one would show no rise at all.
+"""
+import ctypes
+import ctypes.util
+import gc
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'))
+    _malloc_trim = _libc.malloc_trim
+except (OSError, AttributeError, TypeError):
+    _malloc_trim = None
+
+def _status_kb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def current_rss_bytes():
+    """Resident set size of this process in bytes, or None if unavailable"""
+    kb = _status_kb('VmRSS')
+    return kb * 1024 if kb is not None else None
+
+def peak_rss_bytes():
+    """Resident set high-water mark of this process in bytes, or None if unavailable"""
+    kb = _status_kb('VmHWM')
+    return kb * 1024 if kb is not None else None
+
+def reset_peak_rss():
+    """
+    Reset the resident set high-water mark to the current RSS
+
+    Returns:
+        True if the mark was reset, False if the platform does not allow it
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def release_free_memory():
+    """Collect garbage and return free heap pages to the OS where supported"""
+    gc.collect()
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+
+class PeakMemory:
+    """
+    Context manager measuring how far RSS rose above its starting point
+
+    After the block, `peak_bytes` holds the high-water mark minus the RSS at
+    entry (None when the mark could not be reset). The mark is per process,
+    so work running concurrently in other threads is counted as well, and
+    entering resets it for every measurement open in the process: with
+    overlapping measurements a peak reached before the last reset is lost.
+
+    Args:
+        trim: Release free heap pages before measuring (costs a gc.collect)
+    """
+
+    def __init__(self, trim=True):
+        self.trim = trim
+        self.start_bytes = None
+        self.peak_bytes = None
+        self._can_reset = False
+
+    def __enter__(self):
+        if self.trim:
+            release_free_memory()
+        self._can_reset = reset_peak_rss()
+        self.start_bytes = current_rss_bytes()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        peak = peak_rss_bytes()
+        if self._can_reset and peak is not None and self.start_bytes is not None:
+            self.peak_bytes = max(0, peak - self.start_bytes)
+        return False
@@ -0,0 +1,387 @@
+"""
+Prometheus metrics: per-stage latency histograms plus error, storage
+fallback and cache counters, served in the Prometheus text format on /metrics.
+
+Stage timings belong to a request. Code times its work with
+`with stage('decode'):`; a RequestStages block (one per request, or per
+background render job) collects those timings and, when it ends, observes
+each stage and the total in image_stage_seconds, labelled with the endpoint,
+the operation, the output format and the size bucket of the image being
+processed (see size_bucket). Labels are filled in with annotate() by
+whichever code knows them. Image worker processes record into a Capture
+that is replayed in the web worker (utils/executor.py), so their stages and
+counters count as if the work had run inline.
+
+Each gunicorn worker keeps its own metrics and writes a snapshot to
+METRICS_DIR every METRICS_FLUSH_SECONDS (gunicorn.conf.py starts this);
+/metrics serves the sum of every worker's snapshot, with its own taken live.
+Snapshots of exited workers are kept so counters never go down;
+gunicorn.conf.py clears the directory when the server starts.
+
+Metrics:
+    image_stage_seconds{endpoint,stage,operation,format,size}
+        histogram; stage is download, decode, operation, encode, upload or total
+    http_errors_total{endpoint,status}
+        responses with status 400 and above, and failed background jobs ('job', 'failed')
+    storage_fallbacks_total{action}
+        storage operations that fell back to the local filesystem
+    storage_reclaimed_bytes_total{reason}
+        bytes freed by lifecycle collection (superseded, expired, orphan, quota)
+    cache_lookups_total{cache,result}
+        result, render and mask cache lookups; result is hit, disk_hit or miss
+    live_preview_frames_total{outcome}
+        streamed live preview frames (utils/live_preview.py): sent, dropped
+        (superseded by a newer slider value) or failed
+
+Configuration (environment variables):
+    METRICS_ENABLED        set to 0 to stop recording (default 1)
+    METRICS_DIR            snapshot directory shared by the web workers (default /tmp/metrics)
+    METRICS_FLUSH_SECONDS  how often a worker writes its snapshot (default 5)
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+METRICS_DIR = os.environ.get('METRICS_DIR', '/tmp/metrics')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Upper bounds in megapixels and their labels; larger images are '>24MP'
+SIZE_BUCKETS = ((1, '<1MP'), (4, '1-4MP'), (12, '4-12MP'), (24, '12-24MP'))
+
+_lock = threading.Lock()
+_local = threading.local()
+_registry = {}
+_dirty = False
+_snapshots_started = False
+
+def size_bucket(size):
+    """
+    Size bucket label of an image
+
+    Args:
+        size: (width, height) in pixels
+
+    Returns:
+        Label such as '4-12MP'
+    """
+    megapixels = size[0] * size[1] / 1e6
+    for limit, label in SIZE_BUCKETS:
+        if megapixels < limit:
+            return label
+    return '>24MP'
+
+def _active(name):
+    return getattr(_local, name, None) or ()
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _registry[name] = self
+
+    def inc(self, amount=1, **labels):
+        global _dirty
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            _dirty = True
+        for capture in _active('captures'):
+            capture.events.append(('inc', self.name, labels, amount))
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, key, (), value
+
+class Histogram:
+    """Bucketed observations (plus their sum and count) per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: observations per bucket (the last one is +Inf), then the sum
+        self.values = {}
+        _registry[name] = self
+
+    def observe(self, value, **labels):
+        global _dirty
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+            _dirty = True
+
+    def samples(self, values):
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', key, (('le', str(bound)),), cumulative
+            yield f'{self.name}_sum', key, (), counts[-1]
+            yield f'{self.name}_count', key, (), cumulative
+
+stage_seconds = Histogram('image_stage_seconds', 'Time spent per request stage',
+                          ('endpoint', 'stage', 'operation', 'format', 'size'), STAGE_BUCKETS)
+errors = Counter('http_errors_total', 'Responses with an error status and failed background jobs',
+                 ('endpoint', 'status'))
+storage_fallbacks = Counter('storage_fallbacks_total', 'Storage operations that fell back to local files',
+                            ('action',))
+storage_reclaimed = Counter('storage_reclaimed_bytes_total', 'Bytes freed by stored-file lifecycle collection',
+                            ('reason',))
+cache_lookups = Counter('cache_lookups_total', 'Cache lookups by cache and outcome', ('cache', 'result'))
+live_preview_frames = Counter('live_preview_frames_total', 'Streamed live preview frames by outcome', ('outcome',))
+
+def cache_lookup(cache, result):
+    """
+    Count a cache lookup
+
+    Args:
+        cache: Cache name ('result', 'render', 'mask')
+        result: 'hit', 'disk_hit' or 'miss'
+    """
+    cache_lookups.inc(cache=cache, result=result)
+
+class RequestStages:
+    """
+    Context manager collecting the stage timings of one request or background job
+
+    Blocks nested inside another one (e.g. a render job run inside the
+    request that submitted it) feed the outer block and observe nothing
+    themselves.
+
+    Args:
+        endpoint: Endpoint label (the URL rule, 'job', or 'live_frame' for
+            streamed live preview frames)
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.labels = {}
+        self.stages = []
+        self.start = None
+        self.nested = False
+
+    def __enter__(self):
+        if not hasattr(_local, 'requests'):
+            _local.requests = []
+        self.nested = bool(_local.requests)
+        _local.requests.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.requests = [active for active in _local.requests if active is not self]
+        return False
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.start
+
+    def observe(self, force=False):
+        """
+        Observe the collected stages and the total time
+
+        Args:
+            force: Observe the total even if no stage ran and no operation was
+                named (requests that did no image work are skipped otherwise)
+        """
+        if self.nested or not (force or self.stages or self.labels.get('operation')):
+            return
+        labels = {name: self.labels.get(name, '') for name in ('operation', 'format', 'size')}
+        for name, operation, seconds in self.stages:
+            stage_seconds.observe(seconds, endpoint=self.endpoint, stage=name,
+                                  **dict(labels, operation=operation or labels['operation']))
+        stage_seconds.observe(self.seconds, endpoint=self.endpoint, stage='total', **labels)
+
+def _record_stage(name, operation, seconds):
+    for active in _active('requests'):
+        active.stages.append((name, operation, seconds))
+    for capture in _active('captures'):
+        capture.events.append(('stage', name, operation, seconds))
+
+@contextmanager
+def stage(name, operation=None):
+    """
+    Time a block as a stage of the current request
+
+    Args:
+        name: Stage name (download, decode, operation, encode, upload)
+        operation: Operation label for this stage, if it differs from the request's
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_stage(name, operation, time.perf_counter() - start)
+
+def annotate(**labels):
+    """
+    Label the current request (operation, format, size); the first value set wins
+    """
+    for active in _active('requests'):
+        for name, value in labels.items():
+            if value:
+                active.labels.setdefault(name, value)
+    for capture in _active('captures'):
+        capture.events.append(('annotate', labels))
+
+class Capture:
+    """
+    Context manager recording the metric events of the current thread
+
+    Used in image worker processes: the events are sent back with the result
+    and replayed in the web worker.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __enter__(self):
+        if not hasattr(_local, 'captures'):
+            _local.captures = []
+        _local.captures.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.captures = [active for active in _local.captures if active is not self]
+        return False
+
+def replay(events):
+    """
+    Record events captured in another process as if they happened in this thread
+
+    Args:
+        events: Capture.events list
+    """
+    for event in events:
+        if event[0] == 'inc':
+            _, name, labels, amount = event
+            _registry[name].inc(amount, **labels)
+        elif event[0] == 'stage':
+            _record_stage(*event[1:])
+        elif event[0] == 'annotate':
+            annotate(**event[1])
+
+def _snapshot():
+    with _lock:
+        return {name: [[list(key), value if not isinstance(value, list) else list(value)]
+                       for key, value in metric.values.items()]
+                for name, metric in _registry.items()}
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f'{pid}.json')
+
+def write_snapshot():
+    """Write this process's metrics to METRICS_DIR for the other workers' /metrics"""
+    global _dirty
+    with _lock:
+        _dirty = False
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = _snapshot_path(os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(_snapshot(), f)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.error(f"Could not write metrics snapshot: {str(e)}")
+
+def start_snapshots(interval=METRICS_FLUSH_SECONDS):
+    """Write snapshots in a background thread (once per web worker)"""
+    global _snapshots_started
+    if _snapshots_started or not METRICS_ENABLED:
+        return
+    _snapshots_started = True
+
+    def flush():
+        while True:
+            time.sleep(interval)
+            if _dirty:
+                write_snapshot()
+
+    threading.Thread(target=flush, name='metrics-snapshots', daemon=True).start()
+
+def clear_snapshots():
+    """Remove the snapshots of a previous server run"""
+    if not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+def _format(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render():
+    """
+    Prometheus text exposition of the metrics of every web worker
+
+    Returns:
+        Text in the Prometheus 0.0.4 exposition format
+    """
+    merged = {name: {} for name in _registry}
+    snapshots = [_snapshot()]
+    if _snapshots_started and os.path.isdir(METRICS_DIR):
+        own = f'{os.getpid()}.json'
+        for name in os.listdir(METRICS_DIR):
+            if not name.endswith('.json') or name == own:
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    for snapshot in snapshots:
+        for name, entries in snapshot.items():
+            metric = _registry.get(name)
+            if metric is None:
+                continue
+            values = merged[name]
+            for key, value in entries:
+                key = tuple(key)
+                if metric.kind == 'histogram':
+                    counts = values.get(key)
+                    values[key] = list(value) if counts is None else [a + b for a, b in zip(counts, value)]
+                else:
+                    values[key] = values.get(key, 0) + value
+
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for sample, key, extra, value in metric.samples(merged[name]):
+            pairs = list(zip(metric.labelnames, key)) + list(extra)
+            labels = ','.join(f'{label}="{_escape(str(v))}"' for label, v in pairs)
+            lines.append(f'{sample}{{{labels}}} {_format(value)}' if labels else f'{sample} {_format(value)}')
+    return '\n'.join(lines) + '\n'
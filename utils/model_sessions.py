@@ -0,0 +1,217 @@
+"""
+Managed rembg/ONNX Runtime sessions for background removal.
+
+Each worker process keeps one SessionPool per model. Sessions are created
+lazily (or up front with warm_up) and handed out one request at a time, so
+concurrent requests in a threaded worker never share an InferenceSession.
+Load and inference timings are tracked per pool for capacity planning.
+
+Configuration (environment variables):
+    REMBG_MODEL             model name passed to rembg (default u2net)
+    REMBG_POOL_SIZE         sessions per model and worker (default 1)
+    REMBG_INTRA_OP_THREADS  ONNX Runtime intra-op threads (0 = runtime default)
+    REMBG_INTER_OP_THREADS  ONNX Runtime inter-op threads (0 = runtime default)
+    REMBG_PRELOAD           set to 1 to load and warm the pool when the app starts
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.timing import TimingStats
+
+logger = logging.getLogger(__name__)
+
+REMBG_MODEL = os.environ.get('REMBG_MODEL', 'u2net')
+REMBG_POOL_SIZE = max(1, int(os.environ.get('REMBG_POOL_SIZE', 1)))
+REMBG_INTRA_OP_THREADS = int(os.environ.get('REMBG_INTRA_OP_THREADS', 0))
+REMBG_INTER_OP_THREADS = int(os.environ.get('REMBG_INTER_OP_THREADS', 0))
+REMBG_PRELOAD = os.environ.get('REMBG_PRELOAD', '0') == '1'
+
+def _create_session(model_name, intra_op_threads, inter_op_threads):
+    """
+    Create a rembg session with explicit ONNX Runtime thread settings
+
+    Args:
+        model_name: rembg model name
+        intra_op_threads: Threads used inside an operator (0 = runtime default)
+        inter_op_threads: Threads used across operators (0 = runtime default)
+
+    Returns:
+        rembg session object
+    """
+    import onnxruntime as ort
+    import rembg
+    from rembg.sessions import sessions_class
+
+    sess_opts = ort.SessionOptions()
+    if intra_op_threads:
+        sess_opts.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        sess_opts.inter_op_num_threads = inter_op_threads
+
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return session_class(model_name, sess_opts)
+
+    # Unknown to this rembg version's registry, let rembg resolve it
+    logger.warning(f"Model '{model_name}' not found in rembg session registry, using rembg.new_session")
+    return rembg.new_session(model_name)
+
+class SessionPool:
+    """
+    Fixed-size pool of rembg sessions for one model
+    """
+
+    def __init__(self, model_name, size=REMBG_POOL_SIZE,
+                 intra_op_threads=REMBG_INTRA_OP_THREADS, inter_op_threads=REMBG_INTER_OP_THREADS):
+        self.model_name = model_name
+        self.size = size
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.load_times = TimingStats()
+        self.inference_times = TimingStats()
+        self.wait_times = TimingStats()
+
+    def _new_session(self):
+        start = time.perf_counter()
+        session = _create_session(self.model_name, self.intra_op_threads, self.inter_op_threads)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.load_times.record(elapsed)
+        logger.info(f"Loaded rembg session '{self.model_name}' in {elapsed:.2f}s")
+        return session
+
+    def _checkout(self, timeout=None):
+        # Reuse an idle session first, then grow the pool up to its size
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._new_session()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=timeout)
+
+    @contextmanager
+    def session(self, timeout=None):
+        """
+        Borrow a session for one inference
+
+        Args:
+            timeout: Seconds to wait for a free session (None waits forever)
+
+        Yields:
+            rembg session object
+        """
+        wait_start = time.perf_counter()
+        session = self._checkout(timeout)
+        start = time.perf_counter()
+        with self._lock:
+            self.wait_times.record(start - wait_start)
+        try:
+            yield session
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.inference_times.record(elapsed)
+            self._idle.put(session)
+
+    def warm(self, run_inference=True):
+        """
+        Load every session in the pool and optionally run a tiny inference on each
+
+        Args:
+            run_inference: Also push a small image through each session so
+                ONNX Runtime finishes its lazy allocations before real traffic
+        """
+        sessions = []
+        with self._lock:
+            missing = self.size - self._created
+            self._created += missing
+        try:
+            for _ in range(missing):
+                sessions.append(self._new_session())
+        except Exception:
+            with self._lock:
+                self._created -= missing - len(sessions)
+            for session in sessions:
+                self._idle.put(session)
+            raise
+        for session in sessions:
+            if run_inference:
+                from PIL import Image
+                import rembg
+                rembg.remove(Image.new('RGB', (64, 64)), session=session)
+            self._idle.put(session)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'model': self.model_name,
+                'pool_size': self.size,
+                'loaded': self._created,
+                'idle': self._idle.qsize(),
+                'intra_op_threads': self.intra_op_threads,
+                'inter_op_threads': self.inter_op_threads,
+                'load': self.load_times.as_dict(),
+                'inference': self.inference_times.as_dict(),
+                'wait': self.wait_times.as_dict(),
+            }
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_session_pool(model_name=None):
+    """
+    Get (or create) the session pool for a model in this worker process
+
+    Args:
+        model_name: rembg model name (defaults to REMBG_MODEL)
+
+    Returns:
+        SessionPool
+    """
+    model_name = model_name or REMBG_MODEL
+    with _pools_lock:
+        pool = _pools.get(model_name)
+        if pool is None:
+            pool = _pools[model_name] = SessionPool(model_name)
+        return pool
+
+def warm_up(model_name=None, run_inference=True):
+    """
+    Load and warm the session pool for a model, logging instead of raising
+
+    Args:
+        model_name: rembg model name (defaults to REMBG_MODEL)
+        run_inference: Run a tiny inference on each session after loading
+
+    Returns:
+        True if the pool is ready
+    """
+    try:
+        get_session_pool(model_name).warm(run_inference=run_inference)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to warm rembg sessions: {str(e)}")
+        return False
+
+def registry_stats():
+    """Stats for every session pool loaded in this worker"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
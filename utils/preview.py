@@ -0,0 +1,83 @@
+"""
+Proxy-resolution previews for interactive editing.
+
+While the user drags sliders, edits are rendered against a downscaled proxy
+of the original (long edge PREVIEW_LONG_EDGE). The full-resolution image is
+rendered only when the edit is committed or downloaded, by replaying the same
+edit stack on the original. Parameters measured in pixels are scaled to the
+proxy so the preview looks like the final output.
+
+Configuration (environment variables):
+    PREVIEW_ENABLED    set to 0 to render every edit at full resolution
+    PREVIEW_LONG_EDGE  long edge of the proxy in pixels (default 1280)
+"""
+import os
+
+from PIL import Image
+
+from utils.image_processing import open_image
+from utils.metrics import annotate, size_bucket
+
+PREVIEW_ENABLED = os.environ.get('PREVIEW_ENABLED', '1') != '0'
+PREVIEW_LONG_EDGE = int(os.environ.get('PREVIEW_LONG_EDGE', 1280))
+
+def make_proxy(image, long_edge=PREVIEW_LONG_EDGE):
+    """
+    Downscale an image so its long edge fits the preview size
+
+    Args:
+        image: Path to input image, raw bytes or PIL Image object
+        long_edge: Maximum long edge of the proxy in pixels
+
+    Returns:
+        Tuple of (proxy PIL Image, scale factor proxy/original), or (None, 1.0)
+        if the image is already small enough to edit directly
+    """
+    img = open_image(image)
+    width, height = img.size
+    annotate(size=size_bucket(img.size))
+    scale = long_edge / float(max(width, height))
+    if scale >= 1.0:
+        return None, 1.0
+
+    target = (max(1, round(width * scale)), max(1, round(height * scale)))
+    # Let JPEG decode at reduced DCT scale when the image is not loaded yet
+    img.draft(None, target)
+    proxy = img.resize(target, Image.LANCZOS, reducing_gap=3.0)
+    return proxy, target[0] / float(width)
+
+def scale_params(operation, params, scale):
+    """
+    Scale pixel-based parameters of an operation to proxy resolution
+
+    Args:
+        operation: Operation name
+        params: Dictionary of operation parameters
+        scale: Proxy scale factor (proxy size / original size)
+
+    Returns:
+        New parameter dictionary
+    """
+    params = dict(params or {})
+    if scale == 1.0:
+        return params
+    if operation == 'blur':
+        params['amount'] = float(params.get('amount', 5)) * scale
+    elif operation == 'resize':
+        for key in ('width', 'height'):
+            if params.get(key) not in (None, ''):
+                params[key] = max(1, round(float(params[key]) * scale))
+    return params
+
+def scale_stack(stack, scale):
+    """
+    Scale every operation in an edit stack to proxy resolution
+
+    Args:
+        stack: List of [operation, params] pairs
+        scale: Proxy scale factor (proxy size / original size)
+
+    Returns:
+        New stack list
+    """
+    return [[operation, scale_params(operation, params, scale)] for operation, params in stack]
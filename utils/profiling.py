@@ -0,0 +1,243 @@
+"""
+Opt-in request profiling and Server-Timing headers for /process and /upload.
+
+A request is profiled when it carries the X-Profile header (if allowed, see
+below) or is picked by PROFILE_SAMPLE_RATE. Profiled requests get a
+Server-Timing header with their stage durations (utils/metrics.py) and an
+X-Profile-Id header, and, depending on the mode, a profile written to
+PROFILE_DIR:
+
+    timing  Server-Timing only
+    cpu     cProfile of the request, including the image worker processes
+            that ran its operations; one <id>.prof file, read it offline with
+            `python -m pstats <file>` or snakeviz
+    memory  tracemalloc snapshots: <id>.web.tracemalloc for the web worker
+            and <id>.worker-N.tracemalloc per image worker task, taken when the
+            work ends (the peak is logged); load them with
+            tracemalloc.Snapshot.load. tracemalloc is process-wide, so the web
+            worker snapshot also holds allocations of concurrent requests.
+
+Background jobs (async /process) are not profiled; the request that
+submits them is. Only one request per process is profiled with cpu or
+memory at a time; others that ask meanwhile get timing only. Requests that are not profiled
+cost a header lookup and, with a sample rate set, one random number.
+
+Configuration (environment variables):
+    PROFILE_HEADER_ENABLED  honour X-Profile from any client (default 0)
+    PROFILE_TOKEN           honour X-Profile when X-Profile-Token matches this value
+    PROFILE_SAMPLE_RATE     fraction of requests profiled without asking (default 0)
+    PROFILE_SAMPLE_MODE     mode for sampled requests (default cpu)
+    PROFILE_DIR             where profiles are written (default /tmp/profiles)
+    PROFILE_MAX_FILES       profiles kept, oldest removed first (default 200)
+    PROFILE_TRACE_FRAMES    frames kept per allocation in memory mode (default 10)
+    SERVER_TIMING           set to 1 to send Server-Timing on every profiled endpoint
+"""
+import cProfile
+import glob
+import hmac
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER_ENABLED = os.environ.get('PROFILE_HEADER_ENABLED', '0') == '1'
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SAMPLE_MODE = os.environ.get('PROFILE_SAMPLE_MODE', 'cpu')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+PROFILE_TRACE_FRAMES = int(os.environ.get('PROFILE_TRACE_FRAMES', 10))
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+PROFILE_MODES = ('timing', 'cpu', 'memory')
+
+# Endpoints that can be profiled
+PROFILED_ENDPOINTS = ('/process', '/upload')
+
+# cProfile and tracemalloc are used by one request per process at a time
+_capture_lock = threading.Lock()
+_local = threading.local()
+
+def requested_mode(headers, sample=random.random):
+    """
+    Profiling mode asked for by a request, or None
+
+    Args:
+        headers: Request headers
+        sample: Source of random numbers in [0, 1) for PROFILE_SAMPLE_RATE
+
+    Returns:
+        One of PROFILE_MODES, or None when the request is not profiled
+    """
+    mode = headers.get('X-Profile')
+    if mode:
+        token = headers.get('X-Profile-Token', '')
+        allowed = PROFILE_HEADER_ENABLED or (PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN))
+        mode = mode.strip().lower()
+        if allowed and mode in PROFILE_MODES:
+            return mode
+    if PROFILE_SAMPLE_RATE > 0 and sample() < PROFILE_SAMPLE_RATE:
+        return PROFILE_SAMPLE_MODE
+    return None
+
+@contextmanager
+def capture(mode, path):
+    """
+    Profile a block and write the result to path
+
+    Args:
+        mode: 'cpu' (cProfile stats) or 'memory' (tracemalloc snapshot)
+        path: File to write
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if mode == 'cpu':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    elif mode == 'memory':
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        try:
+            yield
+        finally:
+            # The snapshot holds what is still allocated; log the peak as well
+            tracemalloc.take_snapshot().dump(path)
+            logger.info(f"Traced memory peak {tracemalloc.get_traced_memory()[1] / (1024 * 1024):.1f} MB "
+                        f"for {os.path.basename(path)}")
+            if started:
+                tracemalloc.stop()
+    else:
+        yield
+
+@contextmanager
+def profile_task(profile):
+    """
+    Profile an image worker task as asked by the request that sent it
+
+    Args:
+        profile: {'mode': ..., 'path': ...} from RequestProfile.task_profile, or None
+    """
+    if not profile:
+        yield
+        return
+    with capture(profile['mode'], profile['path']):
+        yield
+
+class RequestProfile:
+    """
+    Profiling state of one request
+
+    Args:
+        mode: One of PROFILE_MODES
+        endpoint: Endpoint the request was routed to
+    """
+
+    def __init__(self, mode, endpoint):
+        self.id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.mode = mode
+        self.worker_paths = []
+        self.files = []
+        self._capture = None
+        self._locked = False
+
+    def _path(self, suffix):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        return os.path.join(PROFILE_DIR, f"{stamp}-{self.endpoint.strip('/')}-{self.id}{suffix}")
+
+    def start(self):
+        """Start capturing in the calling thread (falls back to timing when busy)"""
+        if self.mode in ('cpu', 'memory'):
+            if not _capture_lock.acquire(blocking=False):
+                logger.debug(f"Profiler busy, profiling request {self.id} for timing only")
+                self.mode = 'timing'
+            else:
+                self._locked = True
+                suffix = '.prof' if self.mode == 'cpu' else '.web.tracemalloc'
+                self.files.append(self._path(suffix))
+                self._capture = capture(self.mode, self.files[0])
+                self._capture.__enter__()
+        _local.profile = self
+        return self
+
+    def task_profile(self):
+        """Profile request for an image worker task, or None in timing mode"""
+        if self.mode == 'timing':
+            return None
+        suffix = f'.worker-{len(self.worker_paths) + 1}' + ('.prof' if self.mode == 'cpu' else '.tracemalloc')
+        path = self._path(suffix)
+        self.worker_paths.append(path)
+        return {'mode': self.mode, 'path': path}
+
+    def finish(self):
+        """Stop capturing and write the profile files"""
+        _local.profile = None
+        if self._capture is None:
+            return
+        try:
+            self._capture.__exit__(None, None, None)
+        finally:
+            self._capture = None
+            if self._locked:
+                _capture_lock.release()
+                self._locked = False
+        written = [path for path in self.worker_paths if os.path.exists(path)]
+        if self.mode == 'cpu' and written:
+            # One file for the whole request: web worker and image workers
+            stats = pstats.Stats(self.files[0])
+            for path in written:
+                stats.add(path)
+                os.remove(path)
+            stats.dump_stats(self.files[0])
+        elif self.mode == 'memory':
+            self.files.extend(written)
+        logger.info(f"Profiled {self.endpoint} request {self.id} ({self.mode}): {', '.join(self.files)}")
+        prune_profiles()
+
+def current_profile():
+    """RequestProfile of the request running in this thread, or None"""
+    return getattr(_local, 'profile', None)
+
+def prune_profiles(max_files=PROFILE_MAX_FILES):
+    """Remove the oldest profile files beyond max_files"""
+    paths = sorted(glob.glob(os.path.join(PROFILE_DIR, '*')), key=os.path.getmtime)
+    for path in paths[:max(0, len(paths) - max_files)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def server_timing(stages, total_seconds):
+    """
+    Format stage durations as a Server-Timing header value
+
+    Args:
+        stages: List of (stage, operation or None, seconds) in the order they ran
+        total_seconds: Wall time of the whole request
+
+    Returns:
+        Header value, e.g. 'download;dur=3.1, operation;dur=40.2;desc="blur", total;dur=52.0'
+    """
+    durations = {}
+    for name, operation, seconds in stages:
+        durations[(name, operation)] = durations.get((name, operation), 0.0) + seconds
+    entries = []
+    for (name, operation), seconds in durations.items():
+        entry = f'{name};dur={seconds * 1000:.1f}'
+        if operation:
+            entry += f';desc="{operation}"'
+        entries.append(entry)
+    entries.append(f'total;dur={total_seconds * 1000:.1f}')
+    return ', '.join(entries)
@@ -0,0 +1,130 @@
+"""
+Lazily initialised subsystems and the readiness report served on /ready.
+
+Nothing slow happens when main.py is imported: storage clients, the image
+worker processes and rembg model sessions are set up on first use. A web
+worker warms them in a background thread as soon as it starts
+(gunicorn.conf.py), so it can answer /health and serve pages and uploads
+while the heavy parts are still loading; /ready reports which subsystems
+are warm and returns 503 until the required ones are.
+
+Configuration (environment variables):
+    WARM_ON_START   set to 0 to leave every subsystem to its first use (default 1)
+    READY_REQUIRES  comma-separated subsystems /ready waits for (default storage,executor)
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WARM_ON_START = os.environ.get('WARM_ON_START', '1') == '1'
+READY_REQUIRES = [name for name in os.environ.get('READY_REQUIRES', 'storage,executor').split(',') if name]
+
+_subsystems = {}
+_warm_up_lock = threading.Lock()
+_warm_up_started = False
+
+class Subsystem:
+    """
+    A part of the app that is set up once, on first use or by the warm-up thread
+
+    Args:
+        name: Name reported by /ready
+        load: Callable doing the setup; its return value is what get() returns
+        warm_on_start: Set up by the warm-up thread (otherwise only on first use)
+        is_warm: Optional callable overriding the warm check, for subsystems that
+            can also be set up by code that does not go through get()
+    """
+
+    def __init__(self, name, load, warm_on_start=True, is_warm=None):
+        self.name = name
+        self.load = load
+        self.warm_on_start = warm_on_start
+        self._is_warm = is_warm
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.value = None
+        self.seconds = None
+        self.error = None
+
+    def get(self):
+        """Set the subsystem up if that has not happened yet and return it"""
+        if self._loaded:
+            return self.value
+        with self._lock:
+            if not self._loaded:
+                start = time.perf_counter()
+                try:
+                    self.value = self.load()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.seconds = time.perf_counter() - start
+                self.error = None
+                self._loaded = True
+                logger.info(f"{self.name} ready in {self.seconds:.2f}s")
+        return self.value
+
+    @property
+    def warm(self):
+        return self._is_warm() if self._is_warm is not None else self._loaded
+
+    def status(self):
+        return {
+            'warm': self.warm,
+            'seconds': round(self.seconds, 3) if self.seconds is not None else None,
+            'error': self.error,
+        }
+
+def register(name, load, warm_on_start=True, is_warm=None):
+    """
+    Register a lazily initialised subsystem
+
+    Args:
+        name: Name reported by /ready
+        load: Callable doing the setup
+        warm_on_start: Set up by the warm-up thread (otherwise only on first use)
+        is_warm: Optional callable overriding the warm check
+
+    Returns:
+        Subsystem; call its get() wherever the subsystem is used
+    """
+    subsystem = Subsystem(name, load, warm_on_start, is_warm)
+    _subsystems[name] = subsystem
+    return subsystem
+
+def warm_up_all():
+    """Set up every subsystem marked warm_on_start, logging failures instead of raising"""
+    for subsystem in list(_subsystems.values()):
+        if not subsystem.warm_on_start:
+            continue
+        try:
+            subsystem.get()
+        except Exception as e:
+            logger.error(f"Could not warm up {subsystem.name}: {str(e)}")
+
+def start_warm_up():
+    """Warm the subsystems in a background thread (once per process, unless WARM_ON_START=0)"""
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started or not WARM_ON_START:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up_all, name='warm-up', daemon=True).start()
+
+def readiness(requires=None):
+    """
+    Readiness of this process
+
+    Args:
+        requires: Subsystems that must be warm (defaults to READY_REQUIRES)
+
+    Returns:
+        Tuple of (ready, {name: status}); unknown required names count as not ready
+    """
+    requires = READY_REQUIRES if requires is None else requires
+    report = {name: subsystem.status() for name, subsystem in _subsystems.items()}
+    ready = all(name in _subsystems and _subsystems[name].warm for name in requires)
+    return ready, report
@@ -0,0 +1,161 @@
+"""
+Resize engine: geometry modes, shrink-on-load and multi-step reduction.
+
+Large reductions are split into cheap steps before the final filter:
+
+1. JPEG sources that have not been decoded yet are decoded with DCT scaling
+   (Image.draft) to the smallest 1/2, 1/4 or 1/8 scale that still leaves
+   RESIZE_REDUCING_GAP times the target size.
+2. Pillow's reducing_gap reduces by an integer factor with box averaging
+   (Image.reduce) until the remaining ratio is below the gap.
+3. The final Lanczos resample only covers the last, small ratio.
+
+With the optional OpenCV backend, downscales of L and RGB images use
+cv2.INTER_AREA instead of step 2 and 3. Palette and alpha images always use
+Pillow, which resizes alpha premultiplied.
+
+Geometry modes:
+    exact      stretch to width x height (the original behaviour)
+    fit        keep aspect ratio, fit inside width x height
+    fill       keep aspect ratio, cover width x height and centre-crop the overflow
+    crop       centre-crop to width x height without scaling
+    thumbnail  like fit, but never enlarge
+
+With fit and thumbnail either dimension may be omitted.
+
+Quality tolerance: against the reference (full decode, then a single LANCZOS
+resize), the Pillow path stays at or above RESIZE_MIN_PSNR (40 dB) on photos;
+the differences come from the DCT-scaled decode and from box-averaged reduce
+steps and are not visible. cv2.INTER_AREA is a different filter (slightly
+softer than Lanczos) and is held to RESIZE_MIN_PSNR_OPENCV (32 dB).
+benchmarks/bench_resize.py measures both.
+
+Configuration (environment variables):
+    RESIZE_BACKEND       'pillow' (default) or 'opencv'
+    RESIZE_REDUCING_GAP  ratio kept for the final filter (default 3.0, 0 disables draft and reduce steps)
+"""
+import logging
+import math
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+RESIZE_BACKEND = os.environ.get('RESIZE_BACKEND', 'pillow')
+RESIZE_REDUCING_GAP = float(os.environ.get('RESIZE_REDUCING_GAP', 3.0))
+
+RESIZE_MODES = ('exact', 'fit', 'fill', 'crop', 'thumbnail')
+
+# Documented quality floor against the single-LANCZOS reference
+RESIZE_MIN_PSNR = 40.0
+RESIZE_MIN_PSNR_OPENCV = 32.0
+
+def _dimension(value):
+    if value in (None, ''):
+        return None
+    value = int(float(value))
+    if value < 1:
+        raise ValueError('Resize dimensions must be positive')
+    return value
+
+def plan_resize(size, width, height, mode='exact'):
+    """
+    Work out the output size and the source region for a resize
+
+    Args:
+        size: Source (width, height)
+        width: Requested width (may be None for fit/thumbnail/exact)
+        height: Requested height (may be None for fit/thumbnail/exact)
+        mode: One of RESIZE_MODES
+
+    Returns:
+        Tuple of (output (width, height), source box (left, top, right, bottom))
+    """
+    if mode not in RESIZE_MODES:
+        raise ValueError(f"Unknown resize mode: {mode}")
+    src_w, src_h = size
+    w, h = _dimension(width), _dimension(height)
+    if w is None and h is None:
+        raise ValueError('Resize needs a width or a height')
+    full = (0, 0, src_w, src_h)
+
+    if mode == 'crop':
+        w, h = min(w or src_w, src_w), min(h or src_h, src_h)
+        left, top = (src_w - w) // 2, (src_h - h) // 2
+        return (w, h), (left, top, left + w, top + h)
+
+    if mode == 'fill' and w and h:
+        scale = max(w / src_w, h / src_h)
+        box_w, box_h = w / scale, h / scale
+        left, top = (src_w - box_w) / 2, (src_h - box_h) / 2
+        return (w, h), (left, top, left + box_w, top + box_h)
+
+    if mode == 'exact' and w and h:
+        return (w, h), full
+
+    # fit, thumbnail, and exact/fill with one dimension: keep the aspect ratio
+    scale = min(w / src_w if w else math.inf, h / src_h if h else math.inf)
+    if mode == 'thumbnail':
+        scale = min(scale, 1.0)
+    return (max(1, round(src_w * scale)), max(1, round(src_h * scale))), full
+
+def _draft(img, out_size, box, reducing_gap):
+    """
+    Let the JPEG decoder scale down while decoding
+
+    Returns:
+        Source box in the coordinates of the (possibly smaller) decoded image
+    """
+    if img.format != 'JPEG' or not getattr(img, 'tile', None):
+        return box
+    box_w, box_h = box[2] - box[0], box[3] - box[1]
+    # Size the whole image must keep so the box still has gap x the output pixels
+    requested = (
+        math.ceil(img.width * out_size[0] / box_w * reducing_gap),
+        math.ceil(img.height * out_size[1] / box_h * reducing_gap),
+    )
+    if requested[0] >= img.width and requested[1] >= img.height:
+        return box
+    before = img.size
+    img.draft(None, requested)
+    if img.size == before:
+        return box
+    sx, sy = img.width / before[0], img.height / before[1]
+    logger.debug(f"Draft decode {before[0]}x{before[1]} -> {img.width}x{img.height}")
+    return (box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy)
+
+def resize_to(img, out_size, box=None, backend=RESIZE_BACKEND, reducing_gap=RESIZE_REDUCING_GAP):
+    """
+    Resample a region of an image to an output size
+
+    Args:
+        img: PIL Image object (JPEG sources benefit from not being loaded yet)
+        out_size: Output (width, height)
+        box: Source region (left, top, right, bottom), the whole image if omitted
+        backend: 'pillow' or 'opencv'
+        reducing_gap: Ratio kept for the final filter, 0 to disable draft and reduce steps
+
+    Returns:
+        Resized PIL Image object
+    """
+    box = box or (0, 0, img.width, img.height)
+    box_w, box_h = box[2] - box[0], box[3] - box[1]
+    if (box_w, box_h) == tuple(out_size) and all(float(v).is_integer() for v in box):
+        # Pure crop, no resampling
+        return img.crop(tuple(int(v) for v in box))
+
+    if reducing_gap:
+        box = _draft(img, out_size, box, reducing_gap)
+        box_w, box_h = box[2] - box[0], box[3] - box[1]
+
+    shrinking = out_size[0] < box_w and out_size[1] < box_h
+    if backend == 'opencv' and shrinking and img.mode in ('L', 'RGB'):
+        region = img.crop(tuple(round(v) for v in box))
+        result = cv2.resize(np.asarray(region), tuple(out_size), interpolation=cv2.INTER_AREA)
+        return Image.fromarray(result)
+
+    return img.resize(tuple(out_size), Image.LANCZOS, box=box,
+                      reducing_gap=reducing_gap if reducing_gap and reducing_gap >= 1.0 else None)
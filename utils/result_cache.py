@@ -0,0 +1,152 @@
+"""
+Content-addressed cache of stored results.
+
+Maps a hash of (input content, operation chain with normalized params,
+output format) to the storage location of an already uploaded result, so a
+repeated request returns the existing URL without decoding, processing or
+uploading anything. Entries expire after a TTL and the cache is LRU-bounded.
+
+Configuration (environment variables):
+    RESULT_CACHE_MAX_ENTRIES  entries kept per worker (default 1024, 0 disables the cache)
+    RESULT_CACHE_TTL_SECONDS  lifetime of an entry (default 3600)
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.edit_stack import derive_key, prefix_keys
+from utils.metrics import cache_lookup
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 1024))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', 3600))
+
+def result_key(input_key, stack, output_ext, namespace='render'):
+    """
+    Cache key for rendering a stack on an input and encoding it
+
+    Args:
+        input_key: Content hash of the input image
+        stack: List of [operation, params] pairs
+        output_ext: Output extension (without dot)
+        namespace: Pipeline that stores the result: 'render' results
+            (render_and_store) carry variants and a srcset, 'batch' ones do not
+
+    Returns:
+        Hex digest
+    """
+    return derive_key(prefix_keys(input_key, stack)[-1], 'encode', {'ext': output_ext, 'namespace': namespace})
+
+def _stored_paths(stored):
+    """Storage paths of a cached result and its variants"""
+    return [stored['path']] + [variant['path'] for variant in (stored.get('variants') or {}).values()]
+
+class ResultCache:
+    """
+    LRU + TTL map from result keys to stored file descriptors
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl_seconds=RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        """
+        Look up a stored result
+
+        Args:
+            key: Key from result_key
+
+        Returns:
+            Copy of the stored result dictionary ('path', 'url', 'storage', 'bytes'
+            and 'variants' and 'srcset' when it has them), or None
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is not None and entry[1]['storage'] == 'local' and not os.path.exists(entry[1]['path']):
+                # The local file was removed behind our back
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                cache_lookup('result', 'miss')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            cache_lookup('result', 'hit')
+            return dict(entry[1])
+
+    def put(self, key, result):
+        """
+        Remember where a result was stored
+
+        Args:
+            key: Key from result_key
+            result: Dictionary with 'path', 'url', 'storage' and 'bytes' (and
+                'compression' for target-size results, 'variants' and 'srcset'
+                for results stored with responsive variants)
+        """
+        if not self.enabled:
+            return
+        stored = {name: result[name] for name in ('path', 'url', 'storage', 'bytes', 'compression', 'variants', 'srcset') if name in result}
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, stored)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_path(self, path):
+        """
+        Drop every entry pointing at a storage path, as the result or one of
+        its variants (e.g. after deleting it)
+
+        Args:
+            path: Storage path of the deleted file
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            stale = [key for key, (_, stored) in self._entries.items() if path in _stored_paths(stored)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def paths(self):
+        """Storage paths currently referenced by the cache"""
+        with self._lock:
+            return {path for _, stored in self._entries.values() for path in _stored_paths(stored)}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+result_cache = ResultCache()
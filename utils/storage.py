@@ -0,0 +1,371 @@
+"""
+Storage backends for uploaded and processed images.
+
+Every backend offers the same operations on stored paths: put bytes, get
+bytes, open a read stream, delete one or many objects, build the public URL,
+and tell whether a path is one of its own. Storage routes each path to the
+backend that stored it and writes new objects to the primary backend,
+falling back to the local backend when that fails (counted in
+storage_fallbacks_total).
+
+Backends:
+    gcs     Google Cloud Storage through a pooled HTTP session and
+            StorageUploader (public-read ACL set by the upload, optional
+            background publishing); with STORAGE_EMULATOR=fake it runs
+            against the in-process fake bucket (utils/fake_gcs.py)
+    local   files in the public folder served by the app (static/uploads)
+    memory  objects held in this process, for tests and offline benchmarks;
+            served by the app under its URL prefix
+
+gcs and memory objects are stored as 'uploads/<name>'; local objects as
+their file path in the public folder.
+
+Configuration (environment variables):
+    STORAGE_BACKEND   primary backend: gcs (default), local or memory
+"""
+import io
+import logging
+import os
+import threading
+import time
+
+from utils.metrics import storage_fallbacks
+from utils.storage_uploader import StorageUploader, create_gcs_client
+from utils.timing import TimingStats
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'gcs')
+
+# Object prefix of gcs and memory objects
+OBJECT_PREFIX = 'uploads'
+
+# Requests per GCS batch call (the API's limit)
+GCS_BATCH_SIZE = 100
+
+def is_object_path(path, prefix=OBJECT_PREFIX):
+    """Whether a path names an object under prefix (and does not climb out of it)"""
+    return isinstance(path, str) and path.startswith(f'{prefix}/') and '..' not in path.split('/')
+
+class GCSBackend:
+    """
+    Objects in a GCS bucket (or utils.fake_gcs.FakeBucket)
+
+    Args:
+        uploader: StorageUploader bound to the bucket
+    """
+
+    name = 'gcs'
+
+    def __init__(self, uploader):
+        self.uploader = uploader
+        self.bucket = uploader.bucket
+
+    def owns(self, path):
+        return is_object_path(path)
+
+    def put(self, data, filename):
+        return self.uploader.upload(data, filename, prefix=OBJECT_PREFIX)
+
+    def get(self, path):
+        # Published in the background (by any worker): read the local copy
+        local_path = self.uploader.local_copy_path(path)
+        if local_path:
+            with open(local_path, 'rb') as f:
+                return f.read()
+        return self.bucket.blob(path).download_as_bytes()
+
+    def open(self, path):
+        local_path = self.uploader.local_copy_path(path)
+        if local_path:
+            return open(local_path, 'rb')
+        return self.bucket.blob(path).open('rb')
+
+    def delete(self, path):
+        self.uploader.discard_local(path)
+        self.bucket.blob(path).delete()
+
+    def delete_many(self, paths):
+        # One batch request per GCS_BATCH_SIZE objects instead of a round-trip each;
+        # objects that are already gone do not fail the batch
+        for start in range(0, len(paths), GCS_BATCH_SIZE):
+            with self.bucket.client.batch(raise_exception=False):
+                for path in paths[start:start + GCS_BATCH_SIZE]:
+                    self.uploader.discard_local(path)
+                    self.bucket.blob(path).delete()
+
+    def url(self, path):
+        return self.uploader.url_for(path)
+
+    def stats(self):
+        return self.uploader.stats()
+
+class LocalBackend:
+    """
+    Files in a local directory served at url_prefix
+
+    Args:
+        folder: Directory the files are written to
+        url_prefix: URL prefix the directory is served under
+    """
+
+    name = 'local'
+
+    def __init__(self, folder, url_prefix):
+        self.folder = folder
+        self.url_prefix = url_prefix
+        os.makedirs(folder, exist_ok=True)
+
+    def owns(self, path):
+        if not isinstance(path, str) or '..' in path.split('/'):
+            return False
+        return os.path.dirname(os.path.realpath(path)) == os.path.realpath(self.folder)
+
+    def put(self, data, filename):
+        path = os.path.join(self.folder, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return {'path': path, 'url': self.url(path), 'storage': self.name}
+
+    def get(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def open(self, path):
+        return open(path, 'rb')
+
+    def delete(self, path):
+        os.remove(path)
+
+    def delete_many(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def url(self, path):
+        return f'{self.url_prefix}{os.path.basename(path)}'
+
+    def stats(self):
+        return {}
+
+class MemoryBackend:
+    """
+    Objects held in this process
+
+    Args:
+        url_prefix: URL prefix the app serves the objects under
+        latency_seconds: Artificial delay added to every call, to stand in
+            for a remote store in benchmarks
+    """
+
+    name = 'memory'
+
+    def __init__(self, url_prefix='/storage/', latency_seconds=0.0):
+        self.url_prefix = url_prefix
+        self.latency_seconds = latency_seconds
+        self._objects = {}
+        self._lock = threading.Lock()
+        self.upload_times = TimingStats()
+
+    def _call(self):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def owns(self, path):
+        return is_object_path(path)
+
+    def put(self, data, filename):
+        start = time.perf_counter()
+        path = f'{OBJECT_PREFIX}/{filename}'
+        self._call()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._objects[path] = bytes(data)
+            self.upload_times.record(elapsed)
+        return {'path': path, 'url': self.url(path), 'storage': self.name, 'upload_seconds': elapsed}
+
+    def get(self, path):
+        self._call()
+        with self._lock:
+            if path not in self._objects:
+                raise FileNotFoundError(path)
+            return self._objects[path]
+
+    def open(self, path):
+        return io.BytesIO(self.get(path))
+
+    def delete(self, path):
+        self._call()
+        with self._lock:
+            if self._objects.pop(path, None) is None:
+                raise FileNotFoundError(path)
+
+    def delete_many(self, paths):
+        self._call()
+        with self._lock:
+            for path in paths:
+                self._objects.pop(path, None)
+
+    def url(self, path):
+        return f'{self.url_prefix}{path}'
+
+    def stats(self):
+        with self._lock:
+            return {
+                'objects': len(self._objects),
+                'bytes': sum(len(data) for data in self._objects.values()),
+                'upload': self.upload_times.as_dict(),
+            }
+
+class Storage:
+    """
+    Routes stored paths to their backend and writes new objects with a local fallback
+
+    Args:
+        primary: Backend new objects are written to, or None when it could not
+            be set up (every write then falls back)
+        fallback: LocalBackend used when the primary backend fails
+    """
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.backends = [primary, fallback] if primary not in (None, fallback) else [fallback]
+
+    @property
+    def name(self):
+        return self.primary.name if self.primary is not None else self.fallback.name
+
+    def backend_for(self, path):
+        """Backend that stored a path, or None if it is not a stored path"""
+        for backend in self.backends:
+            if backend.owns(path):
+                return backend
+        return None
+
+    def owns(self, path):
+        """Whether a path names a file this app stored"""
+        return self.backend_for(path) is not None
+
+    def _backend(self, path):
+        backend = self.backend_for(path)
+        if backend is None:
+            raise ValueError(f'Not a stored path: {path}')
+        return backend
+
+    def put(self, data, filename):
+        """
+        Store bytes, falling back to the local backend
+
+        Args:
+            data: Encoded file contents
+            filename: Name to store under
+
+        Returns:
+            Dictionary with 'path', 'url', 'storage' and 'bytes' (and
+            'upload_seconds' when the primary backend stored it)
+        """
+        try:
+            if self.primary is None:
+                raise RuntimeError("Storage backend is not configured")
+            result = self.primary.put(data, filename)
+            if result.get('upload_seconds') is not None:
+                logger.debug(f"Uploaded {filename} in {result['upload_seconds'] * 1000:.1f} ms")
+        except Exception as e:
+            if self.primary is self.fallback:
+                raise
+            logger.error(f"Upload of {filename} failed, storing it locally: {str(e)}")
+            storage_fallbacks.inc(action='upload')
+            result = self.fallback.put(data, filename)
+        result['bytes'] = len(data)
+        return result
+
+    def get(self, path):
+        """File contents of a stored path, or None if it cannot be read"""
+        try:
+            return self._backend(path).get(path)
+        except Exception as e:
+            logger.error(f"Error retrieving {path}: {str(e)}")
+            return None
+
+    def open(self, path):
+        """Binary read stream of a stored path"""
+        return self._backend(path).open(path)
+
+    def delete(self, path):
+        """Delete a stored path, logging instead of raising"""
+        try:
+            self._backend(path).delete(path)
+        except Exception as e:
+            logger.error(f"Error deleting {path}: {str(e)}")
+
+    def delete_many(self, paths):
+        """Delete stored paths, batched per backend; paths already gone are skipped"""
+        grouped = {}
+        for path in paths:
+            backend = self.backend_for(path)
+            if backend is not None:
+                grouped.setdefault(backend.name, (backend, []))[1].append(path)
+        for backend, backend_paths in grouped.values():
+            try:
+                backend.delete_many(backend_paths)
+            except Exception as e:
+                logger.error(f"Error deleting {len(backend_paths)} {backend.name} objects: {str(e)}")
+
+    def url(self, path):
+        """Public URL of a stored path"""
+        return self._backend(path).url(path)
+
+    def stats(self):
+        return dict(self.primary.stats() if self.primary is not None else {}, backend=self.name)
+
+def create_storage(backend, bucket_name, public_folder, public_url_prefix, emulator=''):
+    """
+    Set up the storage backends (imports Firebase and the GCS client only for gcs)
+
+    Args:
+        backend: Primary backend name: 'gcs', 'local' or 'memory'
+        bucket_name: GCS bucket
+        public_folder: Directory of the local backend
+        public_url_prefix: URL prefix the public folder is served under
+        emulator: 'fake' to run the gcs backend against utils.fake_gcs
+
+    Returns:
+        Storage; its primary backend is None when GCS could not be set up
+    """
+    local = LocalBackend(public_folder, public_url_prefix)
+    if backend == 'local':
+        return Storage(local, local)
+    if backend == 'memory':
+        return Storage(MemoryBackend(), local)
+    if backend != 'gcs':
+        raise ValueError(f'Unknown storage backend: {backend}')
+
+    if emulator == 'fake':
+        # Local in-process GCS stand-in for offline testing and benchmarks
+        from utils.fake_gcs import FakeClient
+        storage_client = FakeClient(
+            directory=os.environ.get('FAKE_GCS_DIR'),
+            latency_seconds=float(os.environ.get('FAKE_GCS_LATENCY_MS', 0)) / 1000.0
+        )
+        logger.info("Using fake GCS storage emulator")
+    else:
+        # Initialize Firebase Admin SDK with service account
+        try:
+            import firebase_admin
+            from firebase_admin import credentials
+            cred = credentials.Certificate('firebase-config.json')
+            firebase_admin.initialize_app(cred, {
+                'storageBucket': bucket_name
+            })
+            # Pooled HTTP session shared by every upload and download
+            storage_client = create_gcs_client('firebase-config.json')
+            logger.info("Successfully initialized GCS with service account")
+        except Exception as e:
+            logger.error(f"Failed to initialize GCS: {str(e)}")
+            return Storage(None, local)
+    bucket = storage_client.bucket(bucket_name)
+    uploader = StorageUploader(bucket, bucket_name, public_folder, public_url_prefix)
+    return Storage(GCSBackend(uploader), local)
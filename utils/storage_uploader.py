@@ -0,0 +1,241 @@
+"""
+Upload pipeline for processed images.
+
+- uploads straight from in-memory buffers
+- reuses a pooled HTTP session for all GCS calls (create_gcs_client)
+- sets the public-read ACL as part of the upload instead of a second
+  make_public() round-trip
+- optionally publishes asynchronously: the bytes are written to the local
+  public folder and served from there right away while the GCS upload runs
+  in the background; later lookups of the path use the GCS URL once the
+  upload has finished. Publishing state lives on disk (the local copy plus
+  a marker in PUBLISHING_DIR under the public folder), so every web worker
+  process sees it, not just the one that queued the upload. A failed upload
+  is retried PUBLISH_RETRIES times, then logged and given up on; its local
+  copy and marker stay, so the object keeps being served locally
+
+Upload latency is recorded per call and aggregated in stats().
+
+Configuration (environment variables):
+    GCS_HTTP_POOL_SIZE      pooled connections to GCS (default 16)
+    ASYNC_PUBLISH           set to 1 to publish uploads in the background
+    PUBLISH_WORKERS         background upload threads (default 4)
+    PUBLISH_RETRIES         extra attempts of a failed background upload (default 3)
+    PUBLISH_RETRY_SECONDS   delay before the first retry, doubled each time (default 1)
+"""
+import io
+import logging
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.timing import TimingStats
+
+logger = logging.getLogger(__name__)
+
+GCS_HTTP_POOL_SIZE = int(os.environ.get('GCS_HTTP_POOL_SIZE', 16))
+ASYNC_PUBLISH = os.environ.get('ASYNC_PUBLISH', '0') == '1'
+PUBLISH_WORKERS = int(os.environ.get('PUBLISH_WORKERS', 4))
+PUBLISH_RETRIES = int(os.environ.get('PUBLISH_RETRIES', 3))
+PUBLISH_RETRY_SECONDS = float(os.environ.get('PUBLISH_RETRY_SECONDS', 1))
+
+# Markers of objects not (yet) in the bucket, next to their local copies
+PUBLISHING_DIR = '.publishing'
+
+def create_gcs_client(credentials_path, pool_size=GCS_HTTP_POOL_SIZE):
+    """
+    Build a GCS client whose HTTP session keeps a connection pool
+
+    Args:
+        credentials_path: Path to a service account JSON file
+        pool_size: Maximum pooled connections
+
+    Returns:
+        google.cloud.storage.Client
+    """
+    import requests
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import storage as gcs
+    from google.oauth2 import service_account
+
+    credentials = service_account.Credentials.from_service_account_file(
+        credentials_path,
+        scopes=['https://www.googleapis.com/auth/devstorage.full_control']
+    )
+    http = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+    http.mount('https://', adapter)
+    return gcs.Client(project=credentials.project_id, credentials=credentials, _http=http)
+
+class StorageUploader:
+    """
+    Uploads encoded images to a bucket, optionally in the background
+
+    Args:
+        bucket: google.cloud.storage.Bucket (or utils.fake_gcs.FakeBucket)
+        bucket_name: Bucket name used to build public URLs
+        public_folder: Local directory served at public_url_prefix
+        public_url_prefix: URL prefix for files in public_folder
+        async_publish: Return a local URL immediately and upload in the background
+        workers: Background upload threads
+        retries: Extra attempts of a failed background upload
+        retry_seconds: Delay before the first retry, doubled each time
+    """
+
+    def __init__(self, bucket, bucket_name, public_folder, public_url_prefix,
+                 async_publish=ASYNC_PUBLISH, workers=PUBLISH_WORKERS,
+                 retries=PUBLISH_RETRIES, retry_seconds=PUBLISH_RETRY_SECONDS):
+        self.bucket = bucket
+        self.bucket_name = bucket_name
+        self.public_folder = public_folder
+        self.public_url_prefix = public_url_prefix
+        self.async_publish = async_publish
+        self.retries = retries
+        self.retry_seconds = retry_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='publish') if async_publish else None
+        # Uploads this process has queued and not yet finished or given up on
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.upload_times = TimingStats()
+        self.failures = 0
+        self.abandoned = 0
+        if async_publish:
+            os.makedirs(os.path.join(public_folder, PUBLISHING_DIR), exist_ok=True)
+
+    def public_url(self, gcs_path):
+        return f'https://storage.googleapis.com/{self.bucket_name}/{gcs_path}'
+
+    def _upload(self, data, gcs_path, content_type):
+        start = time.perf_counter()
+        blob = self.bucket.blob(gcs_path)
+        try:
+            blob.upload_from_file(io.BytesIO(data), size=len(data), content_type=content_type,
+                                  predefined_acl='publicRead')
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.upload_times.record(elapsed)
+        logger.debug(f"Uploaded {gcs_path} ({len(data)} bytes) in {elapsed * 1000:.1f} ms")
+        return elapsed
+
+    def upload(self, data, filename, prefix='uploads'):
+        """
+        Upload bytes and make them publicly readable
+
+        Args:
+            data: Encoded file contents
+            filename: Object name within the prefix
+            prefix: Object prefix in the bucket
+
+        Returns:
+            Dictionary with 'path', 'url', 'storage' and 'upload_seconds'
+            (None when the upload continues in the background)
+        """
+        gcs_path = f'{prefix}/{filename}'
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        if not self.async_publish:
+            elapsed = self._upload(data, gcs_path, content_type)
+            return {'path': gcs_path, 'url': self.public_url(gcs_path), 'storage': 'gcs', 'upload_seconds': elapsed}
+
+        # Serve the local copy until the background upload lands; the marker
+        # goes first so no worker sends clients to the bucket too early
+        open(self._marker_path(gcs_path), 'wb').close()
+        with open(self._local_path(gcs_path), 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self._pending.add(gcs_path)
+        self._executor.submit(self._publish, data, gcs_path, content_type)
+        return {
+            'path': gcs_path,
+            'url': f'{self.public_url_prefix}{filename}',
+            'storage': 'gcs',
+            'upload_seconds': None
+        }
+
+    def _publish(self, data, gcs_path, content_type):
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    self._upload(data, gcs_path, content_type)
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        # The local copy and marker stay, so the object is still served locally
+                        logger.error(f"Giving up on background upload of {gcs_path} "
+                                     f"after {attempt + 1} attempts: {str(e)}")
+                        with self._lock:
+                            self.abandoned += 1
+                        return
+                    logger.warning(f"Background upload of {gcs_path} failed, retrying: {str(e)}")
+                    time.sleep(self.retry_seconds * 2 ** attempt)
+            try:
+                os.remove(self._marker_path(gcs_path))
+            except OSError:
+                pass
+        finally:
+            with self._lock:
+                self._pending.discard(gcs_path)
+
+    def _local_path(self, gcs_path):
+        return os.path.join(self.public_folder, os.path.basename(gcs_path))
+
+    def _marker_path(self, gcs_path):
+        return os.path.join(self.public_folder, PUBLISHING_DIR, os.path.basename(gcs_path))
+
+    def local_copy_path(self, gcs_path):
+        """
+        Local copy of a background-published object, in any worker process
+
+        Args:
+            gcs_path: Object path in the bucket
+
+        Returns:
+            Local file path, or None without async publishing or once the
+            copy is gone (the bucket then has the object)
+        """
+        if not self.async_publish:
+            return None
+        local_path = self._local_path(gcs_path)
+        return local_path if os.path.isfile(local_path) else None
+
+    def is_publishing(self, gcs_path):
+        """
+        Whether an object is not in the bucket yet (or its upload was given up on)
+        """
+        return self.async_publish and os.path.exists(self._marker_path(gcs_path))
+
+    def discard_local(self, gcs_path):
+        """
+        Remove the local copy and marker of a deleted object
+        """
+        if not self.async_publish:
+            return
+        for path in (self._local_path(gcs_path), self._marker_path(gcs_path)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def url_for(self, gcs_path):
+        """
+        Best URL for an object right now: the local copy while publishing, GCS afterwards
+        """
+        if self.is_publishing(gcs_path):
+            return f'{self.public_url_prefix}{os.path.basename(gcs_path)}'
+        return self.public_url(gcs_path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'async_publish': self.async_publish,
+                'pending': len(self._pending),
+                'failures': self.failures,
+                'abandoned': self.abandoned,
+                'upload': self.upload_times.as_dict(),
+            }
@@ -0,0 +1,225 @@
+"""
+Strip-wise execution of point and local-neighbourhood operations.
+
+Large images are processed in horizontal strips instead of handing the whole
+image to an operation that may allocate several full-size temporaries (split
+and merge, float32 HSV planes, enhancer degenerates). Each strip is cropped
+from the decoded source, processed and pasted into the output image, so the
+only full-size buffers are the source and the result; the working set of a
+strip is kept under TILE_MEMORY_BYTES.
+
+Supported operations:
+- single point and local operations (colour adjustments, filters, bw, blur,
+  sharpen, enhance) run the regular operation on each strip; the
+  neighbourhood ones read halo rows above and below the strip so the pasted
+  rows are identical to processing the whole image at once
+- colour chains, and single operations whose result depends on the image's
+  mean (contrast, the high_contrast filter), go through the fused colour
+  engine with the mean colour of the whole image; this matches what
+  render_stack produces untiled, and differs from the standalone contrast
+  operation the same way the fused engine does
+
+Everything else (geometry, background removal, ...) runs untiled.
+
+Configuration (environment variables):
+    TILED_MIN_PIXELS   images with at least this many pixels are tiled (default 16 MP, 0 disables tiling)
+    TILE_MEMORY_BYTES  working memory ceiling per strip (default 64 MB)
+"""
+import logging
+import math
+import os
+
+import numpy as np
+from PIL import Image, ImageStat
+
+from utils.color_engine import FUSABLE_OPERATIONS, apply_color_chain, needs_mean
+from utils.image_processing import apply_operation, open_image
+
+logger = logging.getLogger(__name__)
+
+TILED_MIN_PIXELS = int(os.environ.get('TILED_MIN_PIXELS', 16 * 1000 * 1000))
+TILE_MEMORY_BYTES = int(os.environ.get('TILE_MEMORY_BYTES', 64 * 1024 * 1024))
+
+# Non-colour operations that can run strip by strip
+LOCAL_OPERATIONS = {'bw', 'blur', 'sharpen', 'enhance'}
+
+# Rough working bytes per pixel of a strip (crop, temporaries, result)
+WORKING_BYTES_PER_PIXEL = {
+    'fused': 24,
+    'brightness': 16,
+    'contrast': 16,
+    'saturation': 16,
+    'hue': 40,
+    'vibrance': 40,
+    'filter': 20,
+    'bw': 20,
+    'blur': 28,
+    'sharpen': 28,
+    'enhance': 36,
+}
+
+def halo_rows(operation, params=None):
+    """
+    Rows of context a strip needs above and below for a local operation
+
+    Args:
+        operation: Operation name
+        params: Dictionary of operation parameters
+
+    Returns:
+        Number of halo rows (0 for point operations)
+    """
+    params = params or {}
+    if operation == 'blur':
+        # PIL's Gaussian blur is three box passes reaching about 3 sigma
+        return int(math.ceil(3 * float(params.get('amount', 5)))) + 3
+    if operation == 'sharpen':
+        # Sharpness blends with a 3x3 smoothing kernel
+        return 1
+    if operation == 'enhance':
+        # SHARPEN kernel followed by Sharpness, two 3x3 kernels
+        return 2
+    return 0
+
+def is_tileable(operations):
+    """
+    Whether a render segment can be processed in strips
+
+    Args:
+        operations: List of [operation, params] pairs forming one segment
+            (a colour chain or a single operation)
+
+    Returns:
+        True if apply_tiled supports the segment
+    """
+    if not operations:
+        return False
+    if all(operation in FUSABLE_OPERATIONS for operation, _ in operations):
+        return True
+    return len(operations) == 1 and operations[0][0] in LOCAL_OPERATIONS
+
+def should_tile(image, operations):
+    """Whether a segment should run tiled on this image"""
+    return (TILED_MIN_PIXELS > 0 and image.width * image.height >= TILED_MIN_PIXELS
+            and is_tileable(operations))
+
+def strip_height(width, bytes_per_pixel, halo, memory_bytes=TILE_MEMORY_BYTES):
+    """
+    Rows per strip that keep a strip's working set under the memory ceiling
+
+    Args:
+        width: Image width in pixels
+        bytes_per_pixel: Working bytes per strip pixel
+        halo: Halo rows added above and below each strip
+        memory_bytes: Working memory ceiling
+
+    Returns:
+        Number of output rows per strip (at least 1)
+    """
+    rows = memory_bytes // max(1, width * bytes_per_pixel) - 2 * halo
+    if rows < 1:
+        logger.warning(f"TILE_MEMORY_BYTES={memory_bytes} is too small for width {width} with halo {halo}, "
+                       f"using single-row strips")
+        return 1
+    return rows
+
+def _color_source(img):
+    """Mode the colour engine works in for this image"""
+    if img.mode in ('RGB', 'RGBA'):
+        return img.mode
+    return 'RGBA' if 'A' in img.mode or 'transparency' in img.info else 'RGB'
+
+def image_mean_rgb(img, rows):
+    """
+    Mean RGB of the whole image, converting at most one strip at a time
+
+    Args:
+        img: Loaded PIL Image object
+        rows: Strip height used for modes that need conversion
+
+    Returns:
+        List of three channel means
+    """
+    mode = _color_source(img)
+    if img.mode == mode:
+        # Histogram based, no pixel copy
+        return ImageStat.Stat(img).mean[:3]
+    total = np.zeros(3)
+    for top in range(0, img.height, rows):
+        strip = img.crop((0, top, img.width, min(img.height, top + rows))).convert(mode)
+        total += np.array(ImageStat.Stat(strip).sum[:3])
+    return list(total / (img.width * img.height))
+
+def apply_tiled(image, operations, fused=True, memory_bytes=TILE_MEMORY_BYTES):
+    """
+    Apply a render segment strip by strip
+
+    Args:
+        image: Path to input image, raw bytes or PIL Image object
+        operations: List of [operation, params] pairs accepted by is_tileable
+        fused: Run single colour operations through the fused colour engine,
+            as render_stack does; otherwise through apply_operation
+        memory_bytes: Working memory ceiling per strip
+
+    Returns:
+        Processed PIL Image object
+    """
+    if not is_tileable(operations):
+        raise ValueError(f"Operations {[op for op, _ in operations]} cannot be tiled")
+    img = open_image(image)
+    img.load()
+    width, height = img.size
+    operation, params = operations[0]
+
+    if operation in FUSABLE_OPERATIONS and (fused or len(operations) > 1 or needs_mean(operations)):
+        halo = 0
+        rows = strip_height(width, WORKING_BYTES_PER_PIXEL['fused'], halo, memory_bytes)
+        mean_rgb = image_mean_rgb(img, rows) if needs_mean(operations) else None
+
+        def process(strip):
+            return apply_color_chain(strip, operations, mean_rgb=mean_rgb)
+    else:
+        halo = halo_rows(operation, params)
+        rows = strip_height(width, WORKING_BYTES_PER_PIXEL[operation], halo, memory_bytes)
+
+        def process(strip):
+            return apply_operation(strip, operation, params)
+
+    if rows >= height:
+        # Fits in a single strip, nothing to gain from tiling
+        return process(img)
+
+    output = None
+    strips = 0
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        context_top = max(0, top - halo)
+        context_bottom = min(height, bottom + halo)
+        result = process(img.crop((0, context_top, width, context_bottom)))
+        if output is None:
+            output = Image.new(result.mode, (width, height))
+        offset = top - context_top
+        output.paste(result.crop((0, offset, width, offset + bottom - top)), (0, top))
+        strips += 1
+
+    logger.debug(f"Processed {width}x{height} image in {strips} strips of {rows} rows (halo {halo})")
+    return output
+
+def apply_segment(image, operations):
+    """
+    Apply a render segment, tiling it when the image is large enough
+
+    Args:
+        image: Path to input image, raw bytes or PIL Image object
+        operations: List of [operation, params] pairs: a colour chain or a single operation
+
+    Returns:
+        Processed PIL Image object
+    """
+    img = open_image(image)
+    if should_tile(img, operations):
+        return apply_tiled(img, operations)
+    if all(operation in FUSABLE_OPERATIONS for operation, _ in operations):
+        return apply_color_chain(img, operations)
+    operation, params = operations[0]
+    return apply_operation(img, operation, params)
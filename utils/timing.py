@@ -0,0 +1,27 @@
+"""
+Shared timing helpers for per-stage latency counters.
+"""
+
+class TimingStats:
+    """Running count/total/min/max of durations in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total, 4),
+            'mean_seconds': round(self.total / self.count, 4) if self.count else None,
+            'min_seconds': round(self.min, 4) if self.min is not None else None,
+            'max_seconds': round(self.max, 4) if self.max is not None else None,
+        }
@@ -0,0 +1,122 @@
+"""
+Responsive output variants: smaller copies of a result from the same decode.
+
+The editor shows results in a canvas far smaller than most full-resolution
+files. Next to a stored result, the thumbnail and display widths in
+OUTPUT_VARIANTS are downscaled and encoded from the already decoded image on
+a small thread pool, while the caller encodes the full-size file. The stored
+variants are returned as a srcset string, so the browser fetches the
+smallest file that fills the canvas. Widths above MAX_VARIANT_RATIO of the
+image's own are skipped: the full-size file is barely larger (a 1280 px
+preview render gets a thumbnail but no 1024 px copy).
+
+Configuration (environment variables):
+    OUTPUT_VARIANTS   name:width pairs stored next to each result
+                      (default "thumb:256,display:1024", empty to disable)
+    VARIANT_WORKERS   threads encoding variants concurrently (default 4)
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from utils.image_processing import encode_image, encode_to_target
+
+def parse_variants(spec):
+    """
+    Parse "name:width,..." into [(name, width), ...], widest first
+
+    Args:
+        spec: Comma-separated name:width pairs
+    """
+    variants = []
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, width = item.split(':')
+        variants.append((name.strip(), int(width)))
+    return sorted(variants, key=lambda variant: -variant[1])
+
+OUTPUT_VARIANTS = parse_variants(os.environ.get('OUTPUT_VARIANTS', 'thumb:256,display:1024'))
+VARIANT_WORKERS = int(os.environ.get('VARIANT_WORKERS', 4))
+
+# Largest variant width relative to the image worth storing
+MAX_VARIANT_RATIO = 0.75
+
+# Created on first use; PIL releases the GIL while resampling and encoding
+_executor = None
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=VARIANT_WORKERS, thread_name_prefix='variant')
+    return _executor
+
+def _resize_and_encode(img, size, file_format, profile):
+    # A box reduction by an integer factor first (e.g. 2 for 4000 -> 1024 px),
+    # then LANCZOS for the rest: close to a fair resample at a fraction of the cost
+    resized = img.resize(size, Image.LANCZOS, reducing_gap=1.5)
+    return encode_image(resized, file_format, profile=profile)
+
+def encode_variants(img, file_format, encode_full, profile='interactive', variants=None):
+    """
+    Encode the full-size result and its smaller variants concurrently
+
+    Args:
+        img: Decoded result (PIL Image)
+        file_format: Extension (without dot) to encode the variants as
+        encode_full: Callable encoding the full-size file, run in this thread
+        profile: Encoder profile of the variants
+        variants: List of (name, width) pairs, widest first (defaults to OUTPUT_VARIANTS)
+
+    Returns:
+        Tuple of (what encode_full returned, list of dicts with 'name',
+        'width', 'height' and encoded 'data')
+    """
+    if variants is None:
+        variants = OUTPUT_VARIANTS
+    width, height = img.size
+    # Decode before the threads share the image
+    img.load()
+    pending = []
+    for name, target_width in variants:
+        if target_width > width * MAX_VARIANT_RATIO:
+            continue
+        size = (target_width, max(1, round(height * target_width / float(width))))
+        pending.append(({'name': name, 'width': size[0], 'height': size[1]},
+                        _pool().submit(_resize_and_encode, img, size, file_format, profile)))
+    full = encode_full()
+    return full, [dict(variant, data=future.result()) for variant, future in pending]
+
+def encode_result(img, file_format, encode_options, profile=None, variants=None):
+    """
+    Encode a result with its encoder settings, and its variants next to it
+
+    Args:
+        img: Decoded result (PIL Image)
+        file_format: Extension (without dot) to encode as
+        encode_options: Keyword arguments for encode_image; a 'target_bytes'
+            budget searches quality (and scale) with encode_to_target
+        profile: Encoder profile of the full-size file
+        variants: List of (name, width) pairs (defaults to OUTPUT_VARIANTS, [] for none)
+
+    Returns:
+        Tuple of ((encoded bytes, what encode_to_target achieved for a byte
+        budget or None), variants as returned by encode_variants)
+    """
+    def encode_full():
+        if encode_options.get('target_bytes'):
+            return encode_to_target(img, file_format, profile=profile, **encode_options)
+        return encode_image(img, file_format, profile=profile, **encode_options), None
+
+    return encode_variants(img, file_format, encode_full, variants=variants)
+
+def srcset(variants):
+    """srcset attribute value for stored variants ({name: {'url', 'width'}})"""
+    ordered = sorted(variants.values(), key=lambda variant: variant['width'])
+    return ', '.join(f"{variant['url']} {variant['width']}w" for variant in ordered)
+
+def variant_paths(result):
+    """Storage paths of a result's variants other than the result itself"""
+    return [variant['path'] for variant in (result.get('variants') or {}).values()
+            if variant['path'] != result.get('path')]